@@ -0,0 +1,95 @@
+import csv
+import json
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+
+import numpy as np
+
+from config import *
+from map import map_files
+from pacman import Game
+
+FIELDS = ['folder', 'map', 'seed', 'outcome', 'score', 'level', 'lives', 'deaths', 'ticks', 'path_time', 'wall_time']
+
+def play(folder, map_name, seed, max_ticks):
+    """
+        Plays one headless game on a single map.
+
+        Each game gets its own RandomState seeded with seed, so the placement of the entities does not
+        depend on the other games run by the same worker (same placement as pacman.py --seed).
+
+        Args:
+        folder (str): The folder containing the map.
+        map_name (str): The map file.
+        seed (int): Seed of the entity placement.
+        max_ticks (int): Number of frames after which the game stops.
+
+        Returns:
+        dict: The result of the game (see Game.result) with the map, seed and wall time.
+    """
+    start = perf_counter()
+    game = Game(folder, headless=True, max_ticks=max_ticks, levels=[map_name], rng=np.random.RandomState(seed))
+    try:
+        result = game.a_star()
+    finally:
+        game.close() # planner pools and renderer
+    result.update(folder=folder, map=map_name, seed=seed, wall_time=perf_counter() - start)
+    return result
+
+def run_batch(map_folders=('maps/levels', 'maps/test_maps'), seeds=range(10), max_ticks=5000, workers=None):
+    """
+        Plays one game per (map, seed) pair over a pool of processes.
+
+        Args:
+        map_folders (tuple of str): Folders containing the maps to play.
+        seeds (iterable of int): Seeds of the entity placement.
+        max_ticks (int): Number of frames after which a game stops.
+        workers (int, optional): Number of processes, the number of CPUs by default.
+
+        Returns:
+        list: The results of the games, in (folder, map, seed) order.
+    """
+    tasks = [(folder, name, seed, max_ticks)
+             for folder in map_folders for name in map_files(folder) for seed in seeds]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(play, *task) for task in tasks]
+        return [future.result() for future in futures]
+
+def save(results, path):
+    """
+        Writes the results to a CSV or JSON file, depending on its extension.
+
+        Args:
+        results (list of dict): The results of the games.
+        path (str): The output file (.csv or .json).
+    """
+    with open(path, 'w', newline='') as f:
+        if path.endswith('.json'):
+            json.dump(results, f, indent=2)
+        else:
+            writer = csv.DictWriter(f, fieldnames=FIELDS)
+            writer.writeheader()
+            writer.writerows(results)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Play the bot on every map for several seeds')
+    parser.add_argument('folders', nargs='*', default=['maps/levels', 'maps/test_maps'], help='folders containing the maps')
+    parser.add_argument('--seeds', type=int, default=10, help='number of seeds per map')
+    parser.add_argument('--first-seed', type=int, default=0, help='first seed')
+    parser.add_argument('--max-ticks', type=int, default=5000, help='stop a game after this many frames')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes')
+    parser.add_argument('--out', default='results.csv', help='output file (.csv or .json)')
+    args = parser.parse_args()
+
+    seeds = range(args.first_seed, args.first_seed + args.seeds)
+    results = run_batch(args.folders, seeds, args.max_ticks, args.workers)
+    save(results, args.out)
+
+    for outcome in ['won', 'lost', 'timeout']:
+        print(f'{outcome}: {sum(r["outcome"] == outcome for r in results)}')
+    print(f'mean score: {np.mean([r["score"] for r in results]):.1f}')
+    print(f'mean ticks: {np.mean([r["ticks"] for r in results]):.1f}')
+    print(f'path time: {sum(r["path_time"] for r in results):.2f}s')
@@ -0,0 +1,359 @@
+import json
+import tracemalloc
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+
+from config import *
+import pathfinding
+from pathfinding import path_to_prize, search, path_cost
+from heuristics import HEURISTICS, DangerCost, Manhattan
+from hierarchical import HierarchicalPlanner
+from map import Map, map_files, entity_counts
+from pacman import Game
+
+MAP_FOLDERS = ('maps/levels', 'maps/test_maps')
+
+def open_cells(map):
+    """
+        Gets the open cells of a map.
+
+        Args:
+        map (Map): The map.
+
+        Returns:
+        list: The (x, y) positions of the cells that are not walls.
+    """
+    ys, xs = np.nonzero(map.walkable)
+    return [(int(x), int(y)) for x, y in zip(xs, ys)]
+
+def bench_astar(map_path, seed, n_queries):
+    """
+        Times single A* queries between random open cells, avoiding N_ENEMIES random cells.
+
+        Args:
+        map_path (str): The map file.
+        seed (int): Seed of the queries.
+        n_queries (int): Number of queries.
+
+        Returns:
+        tuple: The total time of the queries and the number of nodes expanded.
+    """
+    map = Map(map_path)
+    cells = open_cells(map)
+    rng = np.random.RandomState(seed)
+    queries = []
+    for _ in range(n_queries):
+        start, end = (cells[i] for i in rng.randint(len(cells), size=2))
+        queries.append((start, end, [cells[i] for i in rng.randint(len(cells), size=N_ENEMIES)]))
+
+    expanded = pathfinding.counters['expanded']
+    start_time = perf_counter()
+    for start, end, avoid_pos in queries:
+        path_to_prize(start, end, map, avoid_pos=avoid_pos)
+    return perf_counter() - start_time, pathfinding.counters['expanded'] - expanded
+
+def bench_frame(map_path, seed, n_frames):
+    """
+        Times the per-frame decision step of Game.a_star by playing a headless game on one map.
+
+        Args:
+        map_path (str): The map file.
+        seed (int): Seed of the entity placement.
+        n_frames (int): Maximum number of frames played.
+
+        Returns:
+        tuple: The time per frame and the number of nodes expanded per frame.
+    """
+    map_path = Path(map_path)
+    expanded = pathfinding.counters['expanded']
+    start_time = perf_counter()
+    game = Game(map_path.parent, headless=True, max_ticks=n_frames, levels=[map_path.name], rng=np.random.RandomState(seed))
+    try:
+        result = game.a_star()
+        elapsed = perf_counter() - start_time
+    finally:
+        game.close()
+    return elapsed / result['ticks'], (pathfinding.counters['expanded'] - expanded) / result['ticks']
+
+def bench_update(map_path, seed, n_moves):
+    """
+        Times Map.update_map with random moves of the player and the enemies,
+        placing the entities again whenever the level ends.
+
+        Args:
+        map_path (str): The map file.
+        seed (int): Seed of the entity placement and of the moves.
+        n_moves (int): Number of calls to update_map.
+
+        Returns:
+        float: The time per call.
+    """
+    rng = np.random.RandomState(seed)
+    moves = MOVES
+    elapsed = 0
+    done = 0
+    while done < n_moves:
+        map = Map(map_path, rng=rng)
+        map.add_entities(**entity_counts(map_path))
+        ids = [map.player_id] + map.get_entity_category('enemy')
+        steps = [(ids[i], moves[k]) for i, k in zip(rng.randint(len(ids), size=n_moves - done), rng.randint(len(moves), size=n_moves - done))]
+        start_time = perf_counter()
+        for entity_id, move in steps:
+            if entity_id not in map.entities: # eaten
+                continue
+            status = map.update_map(entity_id, move)
+            done += 1
+            if status in (LOST, WON):
+                break
+        elapsed += perf_counter() - start_time
+    return elapsed / n_moves
+
+# (heuristic, weight) of each search compared by bench_searches, None for path_to_prize
+SEARCHES = {
+    'legacy': None,
+    'euclidean': ('euclidean', 1),
+    'manhattan': ('manhattan', 1),
+    'exact': ('exact', 1),
+    'alt': ('alt', 1),
+    'manhattan-w1.5': ('manhattan', 1.5),
+    'alt-w2': ('alt', 2),
+}
+
+def bench_searches(map_path, seed, n_queries):
+    """
+        Runs the same A* queries as bench_astar with each search of SEARCHES, the danger of the cells
+        to avoid counting as a move cost (see DangerCost).
+
+        The excess of a search is the mean relative extra cost of its paths over the cheapest ones
+        (found by the Manhattan search, which is admissible): 0 if it is correct.
+
+        Args:
+        map_path (str): The map file.
+        seed (int): Seed of the queries.
+        n_queries (int): Number of queries.
+
+        Returns:
+        dict: The time, nodes expanded and excess of each search, keyed by 'search/metric'.
+    """
+    map = Map(map_path)
+    cells = open_cells(map)
+    rng = np.random.RandomState(seed)
+    queries = []
+    for _ in range(n_queries):
+        start, end = (cells[i] for i in rng.randint(len(cells), size=2))
+        avoid_pos = [cells[i] for i in rng.randint(len(cells), size=N_ENEMIES)]
+        queries.append((start, end, avoid_pos, DangerCost(map.danger_field(avoid_pos))))
+    heuristics = {name: HEURISTICS[name](map) for name in {choice[0] for choice in SEARCHES.values() if choice}}
+
+    metrics = {}
+    costs = {}
+    for name, choice in SEARCHES.items():
+        expanded = pathfinding.counters['expanded']
+        start_time = perf_counter()
+        if choice is None:
+            paths = [path_to_prize(start, end, map, avoid_pos=avoid_pos) for start, end, avoid_pos, _ in queries]
+        else:
+            heuristic, weight = heuristics[choice[0]], choice[1]
+            paths = [search(start, end, map, heuristic, cost, weight) for start, end, _, cost in queries]
+        metrics[f'{name}/time'] = perf_counter() - start_time
+        metrics[f'{name}/nodes'] = pathfinding.counters['expanded'] - expanded
+        costs[name] = np.array([path_cost(start, path, map, cost) if path else np.inf
+                                for (start, _, _, cost), path in zip(queries, paths)])
+
+    cheapest = costs['manhattan']
+    reachable = np.isfinite(cheapest) & (cheapest > 0)
+    for name in SEARCHES:
+        metrics[f'{name}/excess'] = float(np.mean(costs[name][reachable] / cheapest[reachable] - 1)) if reachable.any() else 0.0
+    return metrics
+
+def bench_hierarchical(map_path, seed, n_queries):
+    """
+        Compares the hierarchical planner with a flat A* search (Manhattan heuristic) on queries
+        like those of bench_searches, both with the move costs of the planner (danger ignored below
+        DANGER_CUTOFF). The excess of the hierarchical planner is the mean relative extra cost of its
+        paths over the cheapest ones.
+
+        Args:
+        map_path (str): The map file.
+        seed (int): Seed of the queries.
+        n_queries (int): Number of queries.
+
+        Returns:
+        dict: The build time and peak memory of the planner, the size of its abstract graph and of an
+        all-pairs table (DistanceTable), and the time per query, nodes expanded per query and peak memory
+        of the queries of each planner ('hpa' and 'flat'), keyed by 'planner/metric'.
+    """
+    map = Map(map_path)
+    cells = open_cells(map)
+    rng = np.random.RandomState(seed)
+    queries = []
+    for _ in range(n_queries):
+        start, end = (cells[i] for i in rng.randint(len(cells), size=2))
+        avoid_pos = [cells[i] for i in rng.randint(len(cells), size=N_ENEMIES)]
+        danger = map.danger_field(avoid_pos)
+        queries.append((start, end, danger, DangerCost(np.where(danger >= DANGER_CUTOFF, danger, 0))))
+
+    metrics = {'hpa/build_memory': peak_memory(HierarchicalPlanner, map)}
+    start_time = perf_counter()
+    planner = HierarchicalPlanner(map)
+    metrics['hpa/build_time'] = perf_counter() - start_time
+    metrics['hpa/graph_bytes'] = planner.nbytes()
+    metrics['flat/table_bytes'] = len(cells) ** 2 * 3 # int16 distances and int8 next moves
+
+    heuristic = Manhattan(map)
+    hpa_costs = []
+    def hpa():
+        hpa_costs.clear()
+        for start, end, danger, _ in queries:
+            planner.next_move(start, end, danger)
+            hpa_costs.append(planner.path_cost)
+    def flat():
+        return [search(start, end, map, heuristic, cost) for start, end, _, cost in queries]
+
+    for name, function in (('hpa', hpa), ('flat', flat)):
+        expanded = pathfinding.counters['expanded']
+        start_time = perf_counter()
+        paths = function()
+        metrics[f'{name}/time'] = (perf_counter() - start_time) / n_queries
+        metrics[f'{name}/nodes'] = (pathfinding.counters['expanded'] - expanded) / n_queries
+        metrics[f'{name}/peak_memory'] = peak_memory(function)
+
+    cheapest = np.array([path_cost(start, path, map, cost) if path else np.inf
+                         for (start, _, _, cost), path in zip(queries, paths)])
+    reachable = np.isfinite(cheapest) & (cheapest > 0)
+    metrics['hpa/excess'] = float(np.mean(np.array(hpa_costs)[reachable] / cheapest[reachable] - 1)) if reachable.any() else 0.0
+    return metrics
+
+WORKLOADS = {
+    'astar': (bench_astar, 200),
+    'frame': (bench_frame, 300),
+    'update': (bench_update, 5000),
+}
+
+def peak_memory(function, *args):
+    """
+        Measures the peak memory allocated by Python while running a function.
+
+        Args:
+        function (callable): The function to run.
+        args: Its arguments.
+
+        Returns:
+        int: The peak memory, in bytes.
+    """
+    tracemalloc.start()
+    function(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+def run(map_folders=MAP_FOLDERS, seed=0, repeat=3):
+    """
+        Runs every workload on every map.
+
+        Wall times are the best of repeat runs. Peak memory is measured in a separate run,
+        as tracing allocations slows the code down.
+
+        Args:
+        map_folders (tuple of str): Folders containing the maps.
+        seed (int): Seed of the entity placement and of the queries.
+        repeat (int): Number of timed runs of each workload.
+
+        Returns:
+        dict: The metrics, keyed by 'workload/map/metric'.
+    """
+    metrics = {}
+    for folder in map_folders:
+        for name in map_files(folder):
+            map_path = str(Path(folder, name))
+            for workload, (function, size) in WORKLOADS.items():
+                key = f'{workload}/{map_path}'
+                runs = [function(map_path, seed, size) for _ in range(repeat)]
+                if workload == 'update':
+                    metrics[f'{key}/time'] = min(runs)
+                else:
+                    metrics[f'{key}/time'] = min(r[0] for r in runs)
+                    metrics[f'{key}/nodes'] = runs[0][1]
+                metrics[f'{key}/peak_memory'] = peak_memory(function, map_path, seed, size)
+            for name, value in bench_searches(map_path, seed, WORKLOADS['astar'][1]).items():
+                metrics[f'search/{map_path}/{name}'] = value
+    return metrics
+
+def search_table(metrics):
+    """
+        Sums the metrics of bench_searches over the maps.
+
+        Args:
+        metrics (dict): The metrics returned by run().
+
+        Returns:
+        str: One line per search with its total time and nodes expanded and its mean excess.
+    """
+    lines = [f'{"search":<16}{"time":>10}{"nodes":>10}{"excess":>10}']
+    for name in SEARCHES:
+        values = {metric: [v for k, v in metrics.items() if k.startswith('search/') and k.endswith(f'/{name}/{metric}')]
+                  for metric in ('time', 'nodes', 'excess')}
+        if values['nodes']:
+            lines.append(f'{name:<16}{sum(values["time"]):>10.3f}{sum(values["nodes"]):>10.0f}{np.mean(values["excess"]):>10.4f}')
+    return '\n'.join(lines)
+
+def compare(metrics, baseline, threshold):
+    """
+        Finds the metrics that regressed past a threshold.
+
+        Args:
+        metrics (dict): The new metrics.
+        baseline (dict): The reference metrics.
+        threshold (float): Allowed relative increase (e.g. 0.2 for +20%).
+
+        Returns:
+        list: The (key, baseline value, new value) of the regressed metrics.
+    """
+    regressions = []
+    for key, value in metrics.items():
+        reference = baseline.get(key)
+        if reference is not None and value > reference * (1 + threshold):
+            regressions.append((key, reference, value))
+    return regressions
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description='Pathfinding and game loop benchmarks')
+    parser.add_argument('folders', nargs='*', default=list(MAP_FOLDERS), help='folders containing the maps')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the entity placement and queries')
+    parser.add_argument('--repeat', type=int, default=3, help='number of timed runs of each workload')
+    parser.add_argument('--save', default=None, help='write the metrics to this JSON baseline')
+    parser.add_argument('--baseline', default=None, help='compare the metrics to this JSON baseline')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed relative regression')
+    parser.add_argument('--hierarchical', nargs='+', default=None, help='only compare the hierarchical planner with flat A* on these maps')
+    args = parser.parse_args()
+
+    if args.hierarchical:
+        for map_path in args.hierarchical:
+            metrics = bench_hierarchical(map_path, args.seed, 50)
+            print(map_path)
+            for key, value in metrics.items():
+                print(f'  {key}: {value:.6g}')
+        sys.exit(0)
+
+    metrics = run(args.folders, args.seed, args.repeat)
+    for key, value in metrics.items():
+        print(f'{key}: {value:.6g}')
+    print(search_table(metrics))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(metrics, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(metrics, baseline, args.threshold)
+        for key, reference, value in regressions:
+            print(f'REGRESSION {key}: {reference:.6g} -> {value:.6g}')
+        sys.exit(1 if regressions else 0)
@@ -22,6 +22,108 @@ POWER_DURATION = 5
 # Sleep duration between frames in the game loop
 SLEEP = 0.1
 
+# Keep one frame every SLEEP seconds, sleeping only what is left after the frame's work
+ADAPTIVE_PACING = True
+
+# After a frame overran, skip rendering and reuse the previous enemy moves, at most this many frames in a row
+MAX_DEGRADED_FRAMES = 3
+
+# Run without display nor sleep, as fast as possible
+HEADLESS = False
+
+# Number of frames after which a headless game started from the command line stops, the bot can get stuck
+HEADLESS_MAX_TICKS = 10000
+
+# Duration of the power-up effect in frames (headless mode)
+POWER_TICKS = round(POWER_DURATION / SLEEP)
+
+# Only redraw the cells that changed since the last frame
+DIFF_RENDER = True
+
+# Precompute all-pairs distances of each level (enemy moves become table lookups)
+PRECOMPUTE_DISTANCES = False
+
+# Folder where precomputed distance tables are cached
+DISTANCE_CACHE = '.cache/distances'
+
+# Plan all enemies (and all scared enemies) with one search from their common target
+BATCHED_AGENTS = False
+
+# Plan the enemies (and the scared enemies) of a frame at once on a pool of workers (see parallel.py)
+PARALLEL_AGENTS = False
+
+# Number of planning workers (None for the number of CPUs)
+PLANNING_WORKERS = None
+
+# Planning workers: 'process' (layout in shared memory), 'thread', or 'auto' for threads on free-threaded Python only
+PLANNING_POOL = 'auto'
+
+# Keep the player's search across frames (D* Lite) instead of a new A* search every frame
+INCREMENTAL_PLAYER = False
+
+# Memory limit of the cache of the enemies' planned moves (see pathfinding.PathCache), in bytes; 0 to disable it
+PATH_CACHE_BYTES = 4 * 2 ** 20
+
+# Memory limit of the separate cache of the player's moves, keyed on every enemy position, in bytes; 0 to disable it
+PLAYER_CACHE_BYTES = 64 * 2 ** 10
+
+# Positions to avoid are rounded to squares of this many cells in the keys of the cache (1: exact moves)
+PATH_CACHE_QUANTUM = 1
+
+# Plan the player's moves on an abstract graph of clusters of cells (HPA*, see hierarchical.py), for large mazes
+HIERARCHICAL_PLAYER = False
+
+# Width and height of the clusters of the hierarchical planner, in cells
+HPA_CLUSTER = 16
+
+# Heuristic of the game's A* searches: None for path_to_prize (squared distance, danger added to the
+# heuristic), or 'manhattan', 'exact', 'alt', 'euclidean' with the danger as a move cost (see heuristics.py)
+SEARCH_HEURISTIC = None
+
+# Weighted A* (f = g + SEARCH_WEIGHT * h) when SEARCH_HEURISTIC is set
+SEARCH_WEIGHT = 1
+
+# Width of the square buckets indexing the player's targets, in cells
+TARGET_BUCKET = 8
+
+# Distance used to pick the player's target: 'euclidean' (straight line) or 'maze' (number of moves)
+TARGET_DISTANCE = 'euclidean'
+
+# Enemy danger below which a cell costs nothing extra to the incremental planner
+DANGER_CUTOFF = 0.5
+
+# Extension of the binary level files (see level_format.py)
+BINARY_SUFFIX = '.pacb'
+
+# Moves of the entities (left, right, up, down), in the order neighbours are explored
+MOVES = ((-1, 0), (1, 0), (0, -1), (0, 1))
+
+# Character codes of the empty and wall cells (see Map.cells)
+EMPTY = ord('-')
+WALL = ord('%')
+
+# Weight of the enemy-avoidance penalty DANGER_WEIGHT / (eps + squared distance) (see Map.danger_field)
+DANGER_WEIGHT = 20
+
+# Number of cells times enemies whose danger Map.danger_field computes at once (bounds its memory)
+DANGER_CHUNK = 2 ** 20
+
+# Scared enemies look this many times closer to the player when choosing what to eat
+SCARED_BONUS = 10
+
+# Time the phases of each frame of the game loop (see profiler.py)
+PROFILE = False
+
+# Address of the game server (see server.py)
+SERVER_HOST = '127.0.0.1'
+SERVER_PORT = 8765
+
+# Frames waiting to be sent to a client of the game server before it is resynced with full frames
+CLIENT_QUEUE = 64
+
+# Results of finished sessions kept by the game server once their sessions are dropped
+FINISHED_SESSIONS = 1000
+
 # Status codes for various game events
 PRIZE = 0    # Code for collecting a prize
 WON = 1        # Code for winning the level
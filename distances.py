@@ -0,0 +1,147 @@
+import hashlib
+import os
+import tempfile
+from collections import deque
+from pathlib import Path
+
+import numpy as np
+
+from config import *
+
+VERSION = 1 # bump when the cached layout changes
+
+class DistanceTable():
+    """
+        A class to hold the all-pairs shortest path distances and next moves of a level.
+
+        Open cells (Map.walkable) are numbered row by row. dist[i, j] is the number of moves from
+        cell i to cell j (-1 if unreachable) and next_hop[i, j] the index in MOVES of the first move
+        of a shortest path from i to j (-1 if i == j or unreachable).
+
+        Attributes:
+        index (numpy array): Cell number of each map position, -1 for walls.
+        cells (numpy array): (x, y) position of each cell number.
+        dist (numpy array): The int16 distance matrix.
+        next_hop (numpy array): The int8 next move matrix.
+
+        Methods:
+        __init__(walkable): Computes the tables from a map layout.
+        load(map_path, walkable, cache_dir): Loads the tables from the disk cache, computing them if missing.
+        distance(start_pos, end_pos): Gets the distance between two positions.
+        next_move(start_pos, end_pos): Gets the first move from start_pos towards end_pos.
+    """
+    def __init__(self, walkable=None, arrays=None):
+        """
+            Computes the tables from a map layout, or wraps already computed arrays.
+
+            Args:
+            walkable (numpy array): The open cells of the map, as in Map.walkable.
+            arrays (dict, optional): The index, cells, dist and next_hop arrays (e.g. read from the cache).
+        """
+        if arrays is not None:
+            self.index = arrays['index']
+            self.cells = arrays['cells']
+            self.dist = arrays['dist']
+            self.next_hop = arrays['next_hop']
+            return
+
+        height, width = walkable.shape
+        ys, xs = np.nonzero(walkable)
+        n = len(xs)
+        self.cells = np.stack([xs, ys], axis=1).astype(np.int32)
+        self.index = np.full((height, width), -1, dtype=np.int32)
+        self.index[ys, xs] = np.arange(n, dtype=np.int32)
+
+        neighbours = np.full((n, len(MOVES)), -1, dtype=np.int32)
+        for k, (dx, dy) in enumerate(MOVES):
+            nx, ny = xs + dx, ys + dy
+            inside = (nx >= 0) & (nx < width) & (ny >= 0) & (ny < height)
+            neighbours[inside, k] = self.index[ny[inside], nx[inside]]
+
+        self.dist = np.full((n, n), -1, dtype=np.int16)
+        adjacency = [[int(j) for j in row if j >= 0] for row in neighbours]
+        for source in range(n):
+            row = self.dist[source]
+            row[source] = 0
+            queue = deque([source])
+            while queue:
+                i = queue.popleft()
+                d = row[i] + 1
+                for j in adjacency[i]:
+                    if row[j] < 0:
+                        row[j] = d
+                        queue.append(j)
+
+        # first move (in MOVES order) that gets one step closer to the target
+        self.next_hop = np.full((n, n), -1, dtype=np.int8)
+        for k in range(len(MOVES)):
+            valid = neighbours[:, k] >= 0
+            closer = np.zeros((n, n), dtype=bool)
+            closer[valid] = self.dist[neighbours[valid, k]] == self.dist[valid] - 1
+            closer &= (self.dist > 0) & (self.next_hop < 0)
+            self.next_hop[closer] = k
+
+    @classmethod
+    def load(cls, map_path, walkable, cache_dir=DISTANCE_CACHE):
+        """
+            Loads the tables of a level from the disk cache, computing and caching them if missing.
+
+            Args:
+            map_path (str): The path to the map file, hashed to key the cache.
+            walkable (numpy array): The open cells of the map, used if the tables have to be computed.
+            cache_dir (str, optional): The cache folder, None to disable caching.
+
+            Returns:
+            DistanceTable: The tables of the level.
+        """
+        if cache_dir is None:
+            return cls(walkable)
+
+        with open(map_path, 'rb') as f:
+            digest = hashlib.sha1(f.read()).hexdigest()
+        cache_path = Path(cache_dir, f'{digest}-v{VERSION}.npz')
+
+        if cache_path.exists():
+            with np.load(cache_path) as arrays:
+                return cls(arrays=dict(arrays))
+
+        table = cls(walkable)
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.npz') # one per writer, games may compute the same level
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, index=table.index, cells=table.cells, dist=table.dist, next_hop=table.next_hop)
+            os.replace(tmp_path, cache_path) # concurrent games never read a partial file
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return table
+
+    def distance(self, start_pos, end_pos):
+        """
+            Gets the number of moves between two positions.
+
+            Args:
+            start_pos (tuple): The starting position.
+            end_pos (tuple): The target position.
+
+            Returns:
+            int: The distance, -1 if end_pos cannot be reached.
+        """
+        return int(self.dist[self.index[start_pos[1], start_pos[0]], self.index[end_pos[1], end_pos[0]]])
+
+    def next_move(self, start_pos, end_pos):
+        """
+            Gets the first move of a shortest path from start_pos to end_pos.
+
+            Args:
+            start_pos (tuple): The starting position.
+            end_pos (tuple): The target position.
+
+            Returns:
+            tuple: The move, (0, 0) if already there or end_pos cannot be reached.
+        """
+        k = self.next_hop[self.index[start_pos[1], start_pos[0]], self.index[end_pos[1], end_pos[0]]]
+        if k < 0:
+            return (0, 0)
+        return MOVES[k]
@@ -0,0 +1,115 @@
+import json
+from pathlib import Path
+
+import numpy as np
+
+from config import *
+
+def generate_maze(width, height, density=1.0, loops=0.1, seed=None):
+    """
+        Generates a maze in the map format read by Map.load_map.
+
+        A randomized depth-first search carves corridors between the cells at odd coordinates, which
+        gives a maze without loops. It stops once a density fraction of these cells is carved, the
+        others stay walls. Then a loops fraction of the walls separating two corridors is knocked down.
+
+        Args:
+        width (int): Width of the map, in characters (at least 3).
+        height (int): Height of the map, in lines (at least 3).
+        density (float, optional): Fraction of the cells reached by corridors, between 0 and 1.
+        loops (float, optional): Fraction of the remaining inner walls between corridors removed, between 0 and 1.
+        seed (int, optional): Seed of the generator.
+
+        Returns:
+        numpy array: The map, '%' for walls and '-' for open cells.
+    """
+    rng = np.random.RandomState(seed)
+    cells_w, cells_h = (width - 1) // 2, (height - 1) // 2
+    open_cells = np.zeros((height, width), dtype=bool)
+    visited = np.zeros((cells_h, cells_w), dtype=bool)
+
+    n_target = max(1, int(density * cells_w * cells_h))
+    start = (rng.randint(cells_w), rng.randint(cells_h))
+    visited[start[1], start[0]] = True
+    open_cells[2 * start[1] + 1, 2 * start[0] + 1] = True
+    stack = [start]
+    carved = 1
+    while stack and carved < n_target:
+        cx, cy = stack[-1]
+        options = [(cx + dx, cy + dy) for dx, dy in MOVES
+                   if 0 <= cx + dx < cells_w and 0 <= cy + dy < cells_h and not visited[cy + dy, cx + dx]]
+        if not options:
+            stack.pop()
+            continue
+        nx, ny = options[rng.randint(len(options))]
+        visited[ny, nx] = True
+        open_cells[2 * ny + 1, 2 * nx + 1] = True
+        open_cells[cy + ny + 1, cx + nx + 1] = True # wall between both cells
+        stack.append((nx, ny))
+        carved += 1
+
+    # walls between two open cells, horizontally or vertically
+    inner = np.zeros((height, width), dtype=bool)
+    inner[1:-1, 1:-1] = ~open_cells[1:-1, 1:-1] & (
+        (open_cells[1:-1, :-2] & open_cells[1:-1, 2:]) | (open_cells[:-2, 1:-1] & open_cells[2:, 1:-1]))
+    ys, xs = np.nonzero(inner)
+    knocked = rng.random_sample(len(xs)) < loops
+    open_cells[ys[knocked], xs[knocked]] = True
+
+    return np.where(open_cells, '-', '%')
+
+def entity_counts_for(maze, enemies=0.005, prizes=0.02, powers=0.002):
+    """
+        Scales the number of entities with the number of open cells of a maze.
+
+        Args:
+        maze (numpy array): The map.
+        enemies (float, optional): Enemies per open cell.
+        prizes (float, optional): Prizes per open cell.
+        powers (float, optional): Power-ups per open cell.
+
+        Returns:
+        dict: The arguments of Map.add_entities.
+    """
+    n_open = int((maze != '%').sum())
+    return {'n_enemies': max(1, round(enemies * n_open)),
+            'n_prizes': max(1, round(prizes * n_open)),
+            'n_powers': round(powers * n_open)}
+
+def save_maze(maze, map_path, counts=None):
+    """
+        Writes a maze, and optionally its entity counts next to it (see entity_counts).
+
+        Args:
+        maze (numpy array): The map.
+        map_path (str): The map file (.txt).
+        counts (dict, optional): The arguments of Map.add_entities, written to the .json file of the same name.
+    """
+    map_path = Path(map_path)
+    map_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(map_path, 'w') as f:
+        for line in maze:
+            f.write(''.join(line) + '\n')
+    if counts is not None:
+        with open(map_path.with_suffix('.json'), 'w') as f:
+            json.dump(counts, f)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Generate random mazes for scaling tests')
+    parser.add_argument('out', help='output folder')
+    parser.add_argument('--width', type=int, default=101, help='width of the maps')
+    parser.add_argument('--height', type=int, default=101, help='height of the maps')
+    parser.add_argument('--density', type=float, default=1.0, help='fraction of the maze cells reached by corridors')
+    parser.add_argument('--loops', type=float, default=0.1, help='fraction of inner walls removed to create loops')
+    parser.add_argument('--count', type=int, default=1, help='number of maps')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the first map')
+    parser.add_argument('--entities', action='store_true', help='also write entity counts scaled to the map size')
+    args = parser.parse_args()
+
+    for i in range(args.count):
+        maze = generate_maze(args.width, args.height, args.density, args.loops, args.seed + i)
+        counts = entity_counts_for(maze) if args.entities else None
+        save_maze(maze, Path(args.out, f'maze_{args.width}x{args.height}_{args.seed + i:03d}.txt'), counts)
@@ -0,0 +1,168 @@
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+from config import *
+from distances import DistanceTable
+
+class Heuristic(ABC):
+    """
+        Base class of the heuristics of the A* search (see pathfinding.search).
+
+        A heuristic estimates the cost of the moves left from a cell to the target. It is admissible
+        if it never overestimates that cost, and A* then returns a cheapest path. With move costs of
+        at least 1 (see DangerCost), the number of moves left is admissible.
+
+        Attributes:
+        width (int): The width of the map, to turn flat cell IDs (y * width + x) into positions.
+        admissible (bool): Whether the heuristic never overestimates the number of moves left.
+
+        Methods:
+        __init__(map): Precomputes what the heuristic needs for a level.
+        to(end): Gets the estimate function towards a target cell (abstract).
+    """
+    admissible = True
+
+    def __init__(self, map):
+        self.width = map.width
+
+    @abstractmethod
+    def to(self, end):
+        """
+            Gets the estimate function towards a target cell.
+
+            Args:
+            end (int): The flat ID of the target cell.
+
+            Returns:
+            callable: Estimates the cost left from a flat cell ID.
+        """
+
+class SquaredEuclidean(Heuristic):
+    """
+        The squared straight-line distance, the heuristic of path_to_prize. It overestimates as soon
+        as the target is more than one move away, so the path found may not be the cheapest.
+    """
+    admissible = False
+
+    def to(self, end):
+        width = self.width
+        end_y, end_x = divmod(end, width)
+
+        def estimate(cell):
+            y, x = divmod(cell, width)
+            return (x - end_x) ** 2 + (y - end_y) ** 2
+        return estimate
+
+class Manhattan(Heuristic):
+    """
+        The number of moves left if there were no walls.
+    """
+    def to(self, end):
+        width = self.width
+        end_y, end_x = divmod(end, width)
+
+        def estimate(cell):
+            y, x = divmod(cell, width)
+            return abs(x - end_x) + abs(y - end_y)
+        return estimate
+
+class Exact(Heuristic):
+    """
+        The exact number of moves left, read from the all-pairs distances of the level. With unit move
+        costs, A* only expands cells of shortest paths.
+    """
+    def __init__(self, map, table=None):
+        """
+            Args:
+            map (Map): The map.
+            table (DistanceTable, optional): The distances of the level, map.distances or computed if not given.
+        """
+        super().__init__(map)
+        if table is None:
+            table = map.distances if map.distances is not None else DistanceTable(map.walkable)
+        self.index = table.index.ravel()
+        self.dist = table.dist
+
+    def to(self, end):
+        row = self.dist[self.index.item(end)] # distances are symmetric
+        index = self.index
+        return lambda cell: row.item(index.item(cell))
+
+class Landmarks(Heuristic):
+    """
+        The ALT heuristic (A*, landmarks, triangle inequality). The number of moves from a few landmark
+        cells to every cell is computed once per level. For any landmark L, |d(L, end) - d(L, cell)|
+        never exceeds d(cell, end). The estimate is the largest of these bounds. Landmarks are chosen
+        far from each other (farthest-point selection), and each query computes the estimates of all
+        cells at once.
+
+        Attributes:
+        landmarks (list of int): The flat IDs of the landmark cells.
+        fields (numpy array): The (landmarks, cells) int32 number of moves from each landmark, -1 if unreachable.
+    """
+    def __init__(self, map, n_landmarks=8):
+        """
+            Args:
+            map (Map): The map.
+            n_landmarks (int, optional): Number of landmarks.
+        """
+        from pathfinding import distance_field
+
+        super().__init__(map)
+        n_cells = map.width * map.height
+        open_cells = np.flatnonzero(map.walkable)
+
+        def field_from(cell):
+            field = np.full(n_cells, -1, dtype=np.int32)
+            distances = distance_field(divmod(int(cell), map.width)[::-1], map)
+            field[list(distances)] = list(distances.values())
+            return field
+
+        # the first landmark is the farthest cell from an arbitrary one, the next ones the farthest from the chosen ones
+        far = np.iinfo(np.int32).max
+        landmark = int(open_cells[np.argmax(field_from(open_cells[0])[open_cells])])
+        nearest = np.full(len(open_cells), far)
+        self.landmarks = []
+        fields = []
+        for _ in range(min(n_landmarks, len(open_cells))):
+            field = field_from(landmark)
+            self.landmarks.append(landmark)
+            fields.append(field)
+            nearest = np.minimum(nearest, np.where(field[open_cells] >= 0, field[open_cells], far))
+            landmark = int(open_cells[np.argmax(nearest)])
+        self.fields = np.array(fields, dtype=np.int32).reshape(-1, n_cells)
+
+    def to(self, end):
+        target = self.fields[:, end]
+        reached = target >= 0 # landmarks in the component of end
+        if not reached.any():
+            return lambda cell: 0
+        estimates = np.abs(self.fields[reached] - target[reached, None]).max(axis=0)
+        return estimates.item
+
+class DangerCost():
+    """
+        Cost model of the searches avoiding enemies: a move costs 1 plus the danger of the cell it enters
+        (see Map.danger_field), instead of adding the danger to the heuristic as path_to_prize does.
+
+        Attributes:
+        danger (numpy array): The danger of each flat cell ID.
+    """
+    def __init__(self, danger):
+        """
+            Args:
+            danger (numpy array): The (height, width) danger field.
+        """
+        self.danger = danger.ravel()
+
+    def __call__(self, cell):
+        return 1 + self.danger.item(cell)
+
+# heuristics selectable in config.py (SEARCH_HEURISTIC) and benchmarked by benchmark.py
+HEURISTICS = {
+    'euclidean': SquaredEuclidean,
+    'manhattan': Manhattan,
+    'exact': Exact,
+    'alt': Landmarks,
+}
@@ -0,0 +1,347 @@
+import heapq
+from collections import deque
+from itertools import count
+from math import inf
+
+import numpy as np
+
+from config import *
+import pathfinding
+
+# paths found on generated mazes cost at most this many times the cheapest ones (see HierarchicalPlanner)
+HPA_BOUND = 1.1
+
+class HierarchicalPlanner():
+    """
+        A hierarchical (HPA*) planner for the player bot on large mazes.
+
+        The map is split into square clusters of HPA_CLUSTER cells. Where two neighbouring clusters touch,
+        each run of open cells on both sides of their border is an entrance, crossed at its middle cell
+        (or at both ends of runs of 6 cells or more). The cells on both sides of the crossings are the
+        nodes of an abstract graph: the cost of moving between two nodes of the same cluster, without
+        leaving it, is computed when the level is loaded, and crossing a border costs 1.
+
+        A query links the start and the target to the nodes of their clusters, searches the abstract
+        graph with A*, and only refines the first abstract edge into moves, as the game only uses the
+        first move. On generated mazes, paths cost at most HPA_BOUND times the cheapest ones, usually
+        a few percent more; on small levels, with few cells per cluster, they can cost more.
+
+        Entering a cell costs 1 plus its enemy danger, ignored below DANGER_CUTOFF (as for the incremental
+        planner). When the danger in a cluster changes, the costs between its nodes are dropped and
+        computed again from each node the next searches reach, and they are restored once the enemies
+        are gone.
+
+        Attributes:
+        map (Map): The map the planner runs on.
+        size (int): Width and height of a cluster, in cells.
+        cluster_of (numpy array): The cluster of each flat cell ID (y * width + x).
+        nodes (list of list): The node cells of each cluster.
+        node_index (dict): Index of each node in the nodes of its cluster.
+        crossings (dict): The nodes across a border from each node.
+        base (list of numpy array): The costs between the nodes of each cluster, without danger.
+        intra (list): The costs between the nodes of each cluster with the current danger: the base costs, or
+        for clusters with danger a dict of the costs from the nodes reached since the danger changed.
+        penalty (dict): The danger of the cells of each cluster its costs were computed with.
+        expanded (int): Number of nodes expanded by the last query.
+        path_cost (float): Cost of the path found by the last query (inf if none).
+
+        Methods:
+        __init__(map, size): Builds the abstract graph of a map.
+        next_move(start_pos, target_pos, danger): Gets the first move of a path to the target.
+        update_costs(penalty): Drops the costs of the clusters whose danger changed.
+        local_search(source, cluster, cost, reverse): Searches the cells of a cluster.
+        nbytes(): Memory used by the abstract graph.
+    """
+    def __init__(self, map, size=HPA_CLUSTER):
+        """
+            Builds the abstract graph of a map.
+
+            Args:
+            map (Map): The map.
+            size (int, optional): Width and height of a cluster, in cells.
+        """
+        self.map = map
+        self.size = size
+        width, height = map.width, map.height
+        self.n_cx = -(-width // size)
+        n_clusters = self.n_cx * -(-height // size)
+        ys, xs = np.indices((height, width))
+        self.cluster_of = ((ys // size) * self.n_cx + xs // size).astype(np.int32).ravel()
+
+        # open cells of each cluster, to compare the danger in a cluster between frames
+        open_cells = np.flatnonzero(map.walkable)
+        order = open_cells[np.argsort(self.cluster_of[open_cells], kind='stable')].astype(np.int32)
+        bounds = np.searchsorted(self.cluster_of[order], np.arange(n_clusters + 1))
+        self.cluster_cells = [order[bounds[c]:bounds[c + 1]] for c in range(n_clusters)]
+
+        self.nodes = [[] for _ in range(n_clusters)]
+        self.node_index = {}
+        self.crossings = {}
+        for a, b in self.entrances():
+            for node, other in ((a, b), (b, a)):
+                if node not in self.node_index:
+                    cluster = self.cluster_of.item(node)
+                    self.node_index[node] = len(self.nodes[cluster])
+                    self.nodes[cluster].append(node)
+                self.crossings.setdefault(node, []).append(other)
+
+        self.base = [self.cluster_costs(c) for c in range(n_clusters)]
+        self.intra = list(self.base)
+        self.penalty = {}
+        self.expanded = 0
+        self.path_cost = inf
+
+    def entrances(self):
+        """
+            Finds the crossings between neighbouring clusters.
+
+            Returns:
+            list of tuple: The two flat cell IDs, on each side of a border, of each crossing.
+        """
+        walkable = self.map.walkable
+        width, height = self.map.width, self.map.height
+        crossings = []
+        # (cells before the border, cells after it) of every vertical then horizontal border, row or column at a time
+        borders = [(walkable[:, x - 1], walkable[:, x], lambda i, x=x: (i * width + x - 1, i * width + x))
+                   for x in range(self.size, width, self.size)]
+        borders += [(walkable[y - 1], walkable[y], lambda i, y=y: ((y - 1) * width + i, y * width + i))
+                    for y in range(self.size, height, self.size)]
+        for before, after, cells in borders:
+            open_both = before & after
+            for start in range(0, len(open_both), self.size): # one segment per pair of clusters
+                segment = open_both[start:start + self.size]
+                run = None
+                for i, is_open in enumerate(list(segment) + [False]):
+                    if is_open and run is None:
+                        run = i
+                    elif not is_open and run is not None:
+                        if i - run >= 6:
+                            crossings += [cells(start + run), cells(start + i - 1)]
+                        else:
+                            crossings.append(cells(start + (run + i - 1) // 2))
+                        run = None
+        return crossings
+
+    def cluster_costs(self, cluster, cost=None):
+        """
+            Computes the costs between the nodes of a cluster, moving inside it.
+
+            Args:
+            cluster (int): The cluster.
+            cost (numpy array, optional): The cost of entering each flat cell, 1 everywhere by default.
+
+            Returns:
+            numpy array: The (nodes, nodes) costs, inf between nodes not connected inside the cluster.
+        """
+        nodes = self.nodes[cluster]
+        costs = np.full((len(nodes), len(nodes)), inf)
+        for i, node in enumerate(nodes):
+            costs[i] = self.costs_from(node, cluster, cost)
+        return costs
+
+    def costs_from(self, node, cluster, cost=None):
+        """
+            Computes the costs from a node to the nodes of its cluster, moving inside it.
+
+            Returns:
+            list of float: The cost to each node of the cluster, inf if not connected inside the cluster.
+        """
+        dist, _ = self.local_search(node, cluster, cost)
+        return [dist.get(other, inf) for other in self.nodes[cluster]]
+
+    def local_search(self, source, cluster, cost=None, reverse=False):
+        """
+            Computes the cheapest costs from source to the cells of a cluster, or from the cells of the
+            cluster to source if reverse, moving inside the cluster.
+
+            Args:
+            source (int): The flat ID of the source cell.
+            cluster (int): The cluster.
+            cost (numpy array, optional): The cost of entering each flat cell, 1 everywhere by default.
+            reverse (bool, optional): Compute the costs to source instead of from it.
+
+            Returns:
+            tuple: The costs and the previous cell on the cheapest path of each reached cell (dicts).
+        """
+        offsets, cells = self.map.adj_offsets, self.map.adj_cells
+        cluster_of = self.cluster_of
+        dist = {source: 0}
+        parent = {source: None}
+        if cost is None: # breadth-first search
+            queue = deque([source])
+            while queue:
+                cell = queue.popleft()
+                d = dist[cell] + 1
+                for i in range(offsets.item(cell), offsets.item(cell + 1)):
+                    child = cells.item(i)
+                    if child not in dist and cluster_of.item(child) == cluster:
+                        dist[child] = d
+                        parent[child] = cell
+                        queue.append(child)
+            return dist, parent
+
+        heap = [(0, source)]
+        while heap:
+            d, cell = heapq.heappop(heap)
+            if d > dist[cell]:
+                continue
+            step = cost.item(cell) if reverse else None
+            for i in range(offsets.item(cell), offsets.item(cell + 1)):
+                child = cells.item(i)
+                if cluster_of.item(child) != cluster:
+                    continue
+                new_d = d + (step if reverse else cost.item(child))
+                if new_d < dist.get(child, inf):
+                    dist[child] = new_d
+                    parent[child] = cell
+                    heapq.heappush(heap, (new_d, child))
+        return dist, parent
+
+    def update_costs(self, penalty):
+        """
+            Drops the costs between the nodes of the clusters whose danger changed, and restores the
+            costs of the clusters without danger left.
+
+            Args:
+            penalty (numpy array): The extra cost of entering each flat cell.
+        """
+        hot = set(np.unique(self.cluster_of[np.flatnonzero(penalty)]).tolist())
+        for cluster in list(self.penalty):
+            if cluster not in hot:
+                self.intra[cluster] = self.base[cluster]
+                del self.penalty[cluster]
+        for cluster in hot:
+            values = penalty[self.cluster_cells[cluster]]
+            previous = self.penalty.get(cluster)
+            if previous is None or not np.array_equal(previous, values):
+                self.intra[cluster] = {} # filled by the searches
+                self.penalty[cluster] = values
+
+    def next_move(self, start_pos, target_pos, danger=None):
+        """
+            Gets the first move of a path from start_pos to target_pos.
+
+            Args:
+            start_pos (tuple): The position of the player.
+            target_pos (tuple): The target position.
+            danger (numpy array, optional): Danger field of the enemies.
+
+            Returns:
+            tuple: The move, (0, 0) if already there or target_pos cannot be reached.
+        """
+        width = self.map.width
+        start = start_pos[1] * width + start_pos[0]
+        target = target_pos[1] * width + target_pos[0]
+        if start == target:
+            return (0, 0)
+
+        if danger is not None:
+            penalty = np.where(danger >= DANGER_CUTOFF, danger, 0).ravel()
+        else:
+            penalty = np.zeros(width * self.map.height)
+        self.update_costs(penalty)
+        cost = 1 + penalty if self.penalty else None
+
+        start_cluster = self.cluster_of.item(start)
+        target_cluster = self.cluster_of.item(target)
+        from_start, parent = self.local_search(start, start_cluster, cost)
+        to_target, _ = self.local_search(target, target_cluster, cost, reverse=True)
+        first = self.abstract_search(start, target, from_start, to_target, cost)
+        if first is None:
+            return (0, 0)
+
+        # refine the first abstract edge: a crossing out of the start cell, or a path inside its cluster
+        cell = first
+        if self.cluster_of.item(first) == start_cluster:
+            while parent[cell] != start:
+                cell = parent[cell]
+        return (cell % width - start_pos[0], cell // width - start_pos[1])
+
+    def abstract_search(self, start, target, from_start, to_target, cost):
+        """
+            Searches the abstract graph, with start and target linked to the nodes of their clusters.
+
+            Args:
+            start (int): The flat ID of the start cell.
+            target (int): The flat ID of the target cell.
+            from_start (dict): The costs from start to the cells of its cluster.
+            to_target (dict): The costs from the cells of the target's cluster to the target.
+            cost (numpy array): The cost of entering each flat cell, None if it is 1 everywhere.
+
+            Returns:
+            int: The flat ID of the node after start on the cheapest abstract path, None if target cannot be reached.
+        """
+        width = self.map.width
+        cluster_of, node_index, crossings = self.cluster_of, self.node_index, self.crossings
+        start_cluster = cluster_of.item(start)
+        target_cluster = cluster_of.item(target)
+        target_y, target_x = divmod(target, width)
+
+        def edges(node):
+            if node == start:
+                for other in self.nodes[start_cluster]:
+                    if other != start and other in from_start:
+                        yield other, from_start[other]
+                if target in from_start:
+                    yield target, from_start[target]
+            else:
+                cluster = cluster_of.item(node)
+                costs = self.intra[cluster]
+                if isinstance(costs, dict): # danger in the cluster
+                    row = costs.get(node)
+                    if row is None:
+                        row = costs[node] = self.costs_from(node, cluster, cost)
+                else:
+                    row = costs[node_index[node]].tolist()
+                for other, d in zip(self.nodes[cluster], row):
+                    if d < inf and other != node:
+                        yield other, d
+                if cluster == target_cluster and node in to_target:
+                    yield target, to_target[node]
+            for other in crossings.get(node, ()):
+                yield other, 1 if cost is None else cost.item(other)
+
+        tie = count()
+        g = {start: 0}
+        parent = {start: None}
+        closed = set()
+        heap = [(0, next(tie), start)]
+        expanded = 0
+        while heap:
+            _, _, node = heapq.heappop(heap)
+            if node in closed:
+                continue
+            if node == target:
+                break
+            closed.add(node)
+            expanded += 1
+            g_node = g[node]
+            for other, d in edges(node):
+                new_g = g_node + d
+                if new_g < g.get(other, inf):
+                    g[other] = new_g
+                    parent[other] = node
+                    y, x = divmod(other, width)
+                    heapq.heappush(heap, (new_g + abs(x - target_x) + abs(y - target_y), next(tie), other))
+        self.expanded = expanded
+        pathfinding.counters['searches'] += 1
+        pathfinding.counters['expanded'] += expanded
+        self.path_cost = g.get(target, inf)
+        if target not in parent:
+            return None
+        node = target
+        while parent[node] != start:
+            node = parent[node]
+        return node
+
+    def nbytes(self):
+        """
+            Estimates the memory used by the abstract graph (arrays, nodes and crossings).
+
+            Returns:
+            int: The size in bytes.
+        """
+        arrays = self.cluster_of.nbytes + sum(cells.nbytes for cells in self.cluster_cells)
+        arrays += sum(costs.nbytes for costs in self.base)
+        n_nodes = len(self.node_index)
+        return arrays + n_nodes * 2 * 64 # rough size of a dict entry and a list item per node
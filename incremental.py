@@ -0,0 +1,210 @@
+import heapq
+from collections import Counter
+from math import inf, isqrt
+
+import numpy as np
+
+from config import *
+import pathfinding
+
+class IncrementalPlanner():
+    """
+        A D* Lite planner for the player bot, keeping its search state across frames.
+
+        The search runs backwards from the target, so the player can move without invalidating it.
+        Entering a cell costs 1 plus the danger of each enemy (DANGER_WEIGHT / (eps + squared distance),
+        as in Map.danger_field), ignored below DANGER_CUTOFF enemy by enemy: an enemy only adds to the
+        cost of the cells within a small radius of it, so a move of an enemy only changes the costs of
+        the cells around its old and new positions. Each frame only those cells are looked at, and only
+        the vertices next to cells whose cost changed are updated; the search restarts from scratch only
+        when the target changes (or on a new map).
+
+        Attributes:
+        map (Map): The map the planner runs on.
+        target (tuple): The current target position.
+        cost (numpy array): The cost of entering each cell.
+        enemies (list): The enemy positions the costs were computed for.
+        disk (list): The offsets of the cells an enemy adds to the cost of.
+        g (dict): Cost-to-target estimate of each vertex.
+        rhs (dict): One-step lookahead of g.
+        km (float): Key modifier accounting for the moves of the player.
+
+        Methods:
+        __init__(map): Initializes the planner on a map.
+        next_move(start_pos, target_pos, enemy_pos): Gets the first move of a cheapest path to the target.
+        reset(start_pos, target_pos): Starts a new search.
+        move_enemies(enemy_pos): Updates the costs around the enemies that moved.
+        update_costs(cells): Updates the vertices affected by cost changes.
+    """
+    def __init__(self, map, eps=1e-6):
+        """
+            Args:
+            map (Map): The map.
+            eps (float, optional): A small value to prevent division by zero, as in Map.danger_field.
+        """
+        self.map = map
+        self.eps = eps
+        self.target = None
+        self.cost = np.ones((map.height, map.width))
+        self.enemies = []
+        # an enemy adds DANGER_WEIGHT / (eps + d2) >= DANGER_CUTOFF only to the cells with d2 <= radius2
+        radius2 = DANGER_WEIGHT / DANGER_CUTOFF - eps if DANGER_CUTOFF > 0 else inf
+        r = min(isqrt(int(radius2)) if radius2 != inf else inf, max(map.width, map.height))
+        self.disk = [(dx, dy) for dx in range(-r, r + 1) for dy in range(-r, r + 1) if dx * dx + dy * dy <= radius2]
+        self.adjacent = {} # (move, neighbour) pairs of each cell, built when first needed
+
+    def next_move(self, start_pos, target_pos, enemy_pos=()):
+        """
+            Gets the first move of a cheapest path from start_pos to target_pos.
+
+            Args:
+            start_pos (tuple): The position of the player.
+            target_pos (tuple): The target position.
+            enemy_pos (list of positions, optional): The positions of the enemies.
+
+            Returns:
+            tuple: The move, (0, 0) if already there or target_pos cannot be reached.
+        """
+        changed = self.move_enemies(enemy_pos)
+        if target_pos != self.target:
+            self.reset(start_pos, target_pos)
+        else:
+            self.km += self.heuristic(self.last, start_pos)
+            self.last = self.start = start_pos
+            self.update_costs(changed)
+        self.compute_shortest_path()
+
+        if start_pos == target_pos or self.g.get(start_pos, inf) == inf:
+            return (0, 0)
+        best, best_cost = (0, 0), inf
+        for move, pos in self.successors(start_pos):
+            total = self.cost.item(pos[1], pos[0]) + self.g.get(pos, inf)
+            if total < best_cost:
+                best, best_cost = move, total
+        return best
+
+    def reset(self, start_pos, target_pos):
+        """
+            Starts a new search towards target_pos.
+
+            Args:
+            start_pos (tuple): The position of the player.
+            target_pos (tuple): The target position.
+        """
+        self.target = target_pos
+        self.start = self.last = start_pos
+        self.km = 0
+        self.g = {}
+        self.rhs = {target_pos: 0}
+        self.keys = {}
+        self.queue = []
+        self.push(target_pos)
+
+    def move_enemies(self, enemy_pos):
+        """
+            Updates the costs of the cells around the old and new positions of the enemies that moved.
+
+            Args:
+            enemy_pos (list of positions): The new positions of the enemies.
+
+            Returns:
+            list: The cells whose cost changed.
+        """
+        old, new = Counter(self.enemies), Counter(map(tuple, enemy_pos))
+        moved = list((old - new) + (new - old))
+        self.enemies = list(new.elements())
+        if not moved:
+            return []
+        width, height = self.map.width, self.map.height
+        walkable, eps = self.map.walkable, self.eps
+        cells = {(x + dx, y + dy) for x, y in moved for dx, dy in self.disk}
+        changed = []
+        for x, y in cells:
+            if not (0 <= x < width and 0 <= y < height and walkable.item(y, x)):
+                continue
+            cost = 1
+            for ex, ey in self.enemies:
+                penalty = DANGER_WEIGHT / (eps + (x - ex) ** 2 + (y - ey) ** 2)
+                if penalty >= DANGER_CUTOFF:
+                    cost += penalty
+            if cost != self.cost.item(y, x):
+                self.cost[y, x] = cost
+                changed.append((x, y))
+        return changed
+
+    def update_costs(self, cells):
+        """
+            Updates the vertices whose outgoing edges changed cost, i.e. the neighbours of the cells
+            whose cost changed.
+
+            Args:
+            cells (list of positions): The cells whose cost changed.
+        """
+        for cell in cells:
+            for _, pos in self.successors(cell): # neighbours are both successors and predecessors
+                self.update_vertex(pos)
+
+    def heuristic(self, a, b):
+        return abs(a[0] - b[0]) + abs(a[1] - b[1])
+
+    def key(self, pos):
+        m = min(self.g.get(pos, inf), self.rhs.get(pos, inf))
+        return (m + self.heuristic(self.start, pos) + self.km, m)
+
+    def push(self, pos):
+        key = self.key(pos)
+        self.keys[pos] = key
+        heapq.heappush(self.queue, (key, pos))
+
+    def successors(self, pos):
+        adjacent = self.adjacent.get(pos)
+        if adjacent is None:
+            x, y = pos
+            mask = self.map.neighbours.item(y, x)
+            adjacent = self.adjacent[pos] = [(move, (x + move[0], y + move[1])) for k, move in enumerate(MOVES) if mask >> k & 1]
+        return adjacent
+
+    def update_vertex(self, pos):
+        if pos != self.target:
+            best, cost, g = inf, self.cost, self.g
+            for _, s in self.successors(pos):
+                total = cost.item(s[1], s[0]) + g.get(s, inf)
+                if total < best:
+                    best = total
+            self.rhs[pos] = best
+        self.keys.pop(pos, None) # lazy deletion: stale queue entries are skipped
+        if self.g.get(pos, inf) != self.rhs.get(pos, inf):
+            self.push(pos)
+
+    def top(self):
+        while self.queue and self.keys.get(self.queue[0][1]) != self.queue[0][0]:
+            heapq.heappop(self.queue)
+        return self.queue[0] if self.queue else ((inf, inf), None)
+
+    def compute_shortest_path(self):
+        """
+            Expands vertices until the cost-to-target of the player's position is consistent.
+        """
+        expanded = 0
+        while True:
+            k_old, pos = self.top()
+            start_key = self.key(self.start)
+            if pos is None or (k_old >= start_key and self.rhs.get(self.start, inf) == self.g.get(self.start, inf)):
+                break
+            heapq.heappop(self.queue)
+            del self.keys[pos]
+            expanded += 1
+            k_new = self.key(pos)
+            if k_old < k_new:
+                self.push(pos)
+            elif self.g.get(pos, inf) > self.rhs.get(pos, inf):
+                self.g[pos] = self.rhs[pos]
+                for _, s in self.successors(pos):
+                    self.update_vertex(s)
+            else:
+                self.g[pos] = inf
+                self.update_vertex(pos)
+                for _, s in self.successors(pos):
+                    self.update_vertex(s)
+        pathfinding.counters['searches'] += 1
+        pathfinding.counters['expanded'] += expanded
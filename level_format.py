@@ -0,0 +1,119 @@
+import struct
+from pathlib import Path
+
+import numpy as np
+
+from config import *
+
+MAGIC = b'PACB'
+VERSION = 1
+HEADER = struct.Struct('<4sHHII') # magic, version, flags, width, height
+HAS_NEIGHBOURS = 1 # flag: the neighbour bitmasks follow the grid
+HAS_ADJACENCY = 2 # flag: the CSR adjacency follows (see Map.csr_adjacency)
+
+def save_binary(cells, map_path, neighbours=None, adjacency=None):
+    """
+        Writes a level in the binary format: a header, the uint8 character codes of the cells
+        row by row and, optionally, the uint8 neighbour bitmasks of the cells (see Map.neighbours)
+        and the CSR adjacency of the cells: the int32 offsets and neighbour cells, aligned on 4 bytes,
+        then the int8 moves.
+
+        Args:
+        cells (numpy array): The character codes of the cells, as in Map.cells.
+        map_path (str): The binary file (BINARY_SUFFIX).
+        neighbours (numpy array, optional): The neighbour bitmasks, so that loading skips computing them.
+        adjacency (tuple, optional): The offsets, cells and moves of Map.csr_adjacency, so that loading skips building them.
+    """
+    height, width = cells.shape
+    flags = (HAS_NEIGHBOURS if neighbours is not None else 0) | (HAS_ADJACENCY if adjacency is not None else 0)
+    with open(map_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, flags, width, height))
+        f.write(np.asarray(cells, dtype=np.uint8).tobytes())
+        if neighbours is not None:
+            f.write(neighbours.astype(np.uint8).tobytes())
+        if adjacency is not None:
+            offsets, cells, moves = adjacency
+            f.write(bytes(-f.tell() % 4))
+            f.write(offsets.astype('<i4').tobytes())
+            f.write(cells.astype('<i4').tobytes())
+            f.write(moves.astype(np.int8).tobytes())
+
+def load_binary(map_path):
+    """
+        Maps a binary level in memory, without reading or copying the cells. The character codes are
+        mapped copy-on-write: the game writes them as entities move, which copies the pages it changes
+        in memory and never changes the file.
+
+        Args:
+        map_path (str): The binary file.
+
+        Returns:
+        tuple: The (height, width) uint8 character codes, the read-only neighbour bitmasks (None if not stored)
+        and CSR adjacency (offsets, cells, moves as in Map.csr_adjacency, None if not stored).
+    """
+    with open(map_path, 'rb') as f:
+        magic, version, flags, width, height = HEADER.unpack(f.read(HEADER.size))
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f'{map_path} is not a version {VERSION} binary level')
+
+    n_cells = width * height
+    grid = np.memmap(map_path, dtype=np.uint8, mode='c', offset=HEADER.size, shape=(height, width))
+    offset = HEADER.size + n_cells
+    neighbours = None
+    if flags & HAS_NEIGHBOURS:
+        neighbours = np.memmap(map_path, dtype=np.uint8, mode='r', offset=offset, shape=(height, width))
+        offset += n_cells
+    adjacency = None
+    if flags & HAS_ADJACENCY:
+        offset += -offset % 4
+        offsets = np.memmap(map_path, dtype='<i4', mode='r', offset=offset, shape=(n_cells + 1,))
+        n_adjacent = int(offsets[-1])
+        offset += offsets.nbytes
+        cells = np.memmap(map_path, dtype='<i4', mode='r', offset=offset, shape=(n_adjacent,))
+        moves = np.memmap(map_path, dtype=np.int8, mode='r', offset=offset + cells.nbytes, shape=(n_adjacent,))
+        adjacency = offsets, cells, moves
+    return grid, neighbours, adjacency
+
+def convert(map_path, out_path=None, neighbours=True, adjacency=True):
+    """
+        Converts a text level to the binary format.
+
+        Args:
+        map_path (str): The text map file.
+        out_path (str, optional): The binary file, map_path with BINARY_SUFFIX by default.
+        neighbours (bool, optional): Also store the neighbour bitmasks.
+        adjacency (bool, optional): Also store the CSR adjacency.
+
+        Returns:
+        Path: The binary file.
+    """
+    from map import Map
+
+    map = Map(map_path)
+    out_path = Path(out_path) if out_path is not None else Path(map_path).with_suffix(BINARY_SUFFIX)
+    save_binary(map.cells, out_path, map.neighbours if neighbours else None,
+                (map.adj_offsets, map.adj_cells, map.adj_moves) if adjacency else None)
+    return out_path
+
+
+if __name__ == '__main__':
+    import argparse
+    import shutil
+
+    from map import map_files
+
+    parser = argparse.ArgumentParser(description='Convert text levels to the binary level format')
+    parser.add_argument('folder', help='folder containing the text levels')
+    parser.add_argument('out', help='output folder')
+    parser.add_argument('--no-neighbours', action='store_true', help='do not store the neighbour bitmasks')
+    parser.add_argument('--no-adjacency', action='store_true', help='do not store the adjacency of the cells')
+    args = parser.parse_args()
+
+    Path(args.out).mkdir(parents=True, exist_ok=True)
+    for name in map_files(args.folder):
+        map_path = Path(args.folder, name)
+        out_path = Path(args.out, name).with_suffix(BINARY_SUFFIX)
+        convert(map_path, out_path, neighbours=not args.no_neighbours, adjacency=not args.no_adjacency)
+        if map_path.with_suffix('.json').exists(): # entity counts
+            shutil.copy(map_path.with_suffix('.json'), out_path.with_suffix('.json'))
+        print(f'{map_path} -> {out_path}')
@@ -0,0 +1,505 @@
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+
+from config import *
+from map import Map, entity_counts
+from distances import DistanceTable
+from pacman import Game
+
+STAY = len(MOVES) # move code of (0, 0), after the codes of MOVES
+SYMBOLS = {symbol: np.uint8(ord(symbol)) for symbol in '-#&!W@'}
+
+class LockstepGames():
+    """
+        A class to play many headless games of the same level at once, in lockstep.
+
+        The state of the B games is held in stacked numpy arrays (the symbols of the cells, the
+        positions of the player and the enemies, which prizes, powers and enemies are left, the power
+        mode) and each frame advances all the games together: move validation, collisions and scoring
+        are vectorized over the games, the enemies of a game still move one after the other. Positions
+        are flat cell numbers (y * width + x) and moves are codes, the index in MOVES or STAY.
+
+        The rules are those of Map.update_map and Game.a_star, including the cell symbols that block
+        the enemies. Enemies move as with PRECOMPUTE_DISTANCES (first move of a shortest path). The
+        player picks its target as Map.closest_to_eat does, with tunable avoidance weights, but moves
+        greedily to the neighbour minimizing the distance to the target plus the danger of the cell,
+        instead of running an A* search. A game ends when it is won or lost (one life) or after
+        max_ticks frames. See cross_check() to compare the rules with the scalar engine.
+
+        Attributes:
+        n_games (int): Number of games B.
+        width (int): The width of the map.
+        table (DistanceTable): Distances and next moves of the level.
+        danger_weight (float): Weight of the enemy-avoidance penalty (DANGER_WEIGHT in the game).
+        scared_bonus (float): Divisor of the squared distance to scared enemies (SCARED_BONUS in the game).
+        sym (numpy array): The (B, cells) uint8 symbols of the cells, as in Map.cells.
+        occupied (numpy array): The (B, cells) number of moving entities (player and enemies) on each cell.
+        player (numpy array): The (B,) cell of the player.
+        enemy (numpy array): The (B, E) cell of each enemy, in ID order.
+        alive (numpy array): The (B, E) enemies not eaten.
+        scared (numpy array): The (B, E) scared enemies.
+        idle (numpy array): The (B, I) cell of the house, the prizes then the powers.
+        idle_left (numpy array): The (B, I) idle entities not eaten (the house is never eaten).
+        powered (numpy array): The (B,) games in power mode.
+        score (numpy array): The (B,) scores.
+        status (numpy array): The (B,) status codes of the last frame.
+        done (numpy array): The (B,) games over.
+        ticks (numpy array): The (B,) number of frames played.
+        history (list): The (B,) player move codes of each frame, None unless record is True.
+
+        Methods:
+        __init__(maps, table, danger_weight, scared_bonus, record): Stacks the state of games placed on Map objects.
+        from_seeds(map_path, seeds, **kwargs): Places the games as Game does for each seed.
+        run(max_ticks): Plays all the games.
+        frame(): Advances all the games by one frame.
+        player_moves(): Chooses the move of the player of each game.
+        step_player(codes, act): Moves the player of some games (Map.update_map).
+        step_agent(k, codes, act): Moves the k-th enemy of some games (Map.update_map).
+        results(): Summarizes the games.
+    """
+    def __init__(self, maps, table=None, danger_weight=DANGER_WEIGHT, scared_bonus=SCARED_BONUS, record=False):
+        """
+            Stacks the state of games placed on Map objects (all on the same level, with the same entity counts).
+
+            Args:
+            maps (list of Map): The games, with their entities placed.
+            table (DistanceTable, optional): Distances and next moves of the level, computed if not given.
+            danger_weight (float, optional): Weight of the enemy-avoidance penalty.
+            scared_bonus (float, optional): Divisor of the squared distance to scared enemies.
+            record (bool, optional): Keep the player moves of every frame (see cross_check).
+        """
+        first = maps[0]
+        self.n_games = len(maps)
+        self.width = first.width
+        self.table = table if table is not None else DistanceTable(first.walkable)
+        self.danger_weight = danger_weight
+        self.scared_bonus = scared_bonus
+        self.eps = 1e-6
+        self.dur = POWER_TICKS
+        self.enemy_frame = ENEMY_FRAME
+        self.t = 0
+
+        # target cell of each move code from each cell, and whether it passes Map.is_valid's terrain checks
+        n_cells = first.height * first.width
+        cells = np.arange(n_cells)
+        self.step = np.empty((n_cells, STAY + 1), dtype=np.int64)
+        self.open = np.empty((n_cells, STAY + 1), dtype=bool)
+        masks = first.neighbours.ravel()
+        for k, (dx, dy) in enumerate(MOVES + ((0, 0),)):
+            self.step[:, k] = cells + dy * self.width + dx
+            reachable = masks >> k & 1 if k < STAY else first.walkable.ravel()
+            target = np.where(reachable, self.step[:, k], 0)
+            self.open[:, k] = reachable.astype(bool) & (target % self.width > 0) & (target // self.width > 0)
+        self.table_index = self.table.index.ravel()
+
+        def cells_of(map, category):
+            return [map.entities[index].pos[1] * self.width + map.entities[index].pos[0]
+                    for index in map.get_entity_category(category)]
+
+        self.sym = np.stack([map.cells.ravel() for map in maps])
+        self.player = np.array([cells_of(map, 'player')[0] for map in maps])
+        self.psym = np.full(self.n_games, SYMBOLS['@'])
+        self.house = np.array([cells_of(map, 'house')[0] for map in maps])
+        self.enemy = np.array([cells_of(map, 'enemy') for map in maps], dtype=np.int64).reshape(self.n_games, -1)
+        self.n_prizes = len(first.get_entity_category('prize'))
+        self.idle = np.array([cells_of(map, 'house') + cells_of(map, 'prize') + cells_of(map, 'power') for map in maps])
+        self.idle_sym = np.array([ord('H')] + [ord('.')] * self.n_prizes + [ord('O')] * (self.idle.shape[1] - 1 - self.n_prizes), dtype=np.uint8)
+        self.idle_left = np.ones(self.idle.shape, dtype=bool)
+        self.alive = np.ones(self.enemy.shape, dtype=bool)
+        self.scared = np.zeros(self.enemy.shape, dtype=bool)
+
+        rows = np.arange(self.n_games)[:, None]
+        self.occupied = np.zeros((self.n_games, n_cells), dtype=np.int16)
+        np.add.at(self.occupied, (rows, self.enemy), 1)
+        np.add.at(self.occupied, (rows[:, 0], self.player), 1)
+        self.idle_at = np.full((self.n_games, n_cells), -1, dtype=np.int16) # idle slot of each cell
+        self.idle_at[rows, self.idle] = np.arange(self.idle.shape[1])
+
+        self.powered = np.zeros(self.n_games, dtype=bool)
+        self.time = np.zeros(self.n_games, dtype=np.int64)
+        self.score = np.zeros(self.n_games, dtype=np.int64)
+        self.status = np.full(self.n_games, OK)
+        self.done = np.zeros(self.n_games, dtype=bool)
+        self.ticks = np.zeros(self.n_games, dtype=np.int64)
+        self.history = [] if record else None
+        self.max_ticks = None
+
+    @classmethod
+    def from_seeds(cls, map_path, seeds, **kwargs):
+        """
+            Places the entities of one game per seed, as Game does with rng=np.random.RandomState(seed).
+
+            Args:
+            map_path (str): The level.
+            seeds (list of int): Seeds of the entity placement.
+            **kwargs: Arguments of __init__.
+
+            Returns:
+            LockstepGames: The games.
+        """
+        counts = entity_counts(map_path)
+        maps = []
+        for seed in seeds:
+            map = Map(map_path, rng=np.random.RandomState(seed))
+            map.add_entities(**counts)
+            maps.append(map)
+        kwargs.setdefault('table', DistanceTable.load(map_path, maps[0].walkable))
+        games = cls(maps, **kwargs)
+        games.seeds = list(seeds)
+        return games
+
+    def run(self, max_ticks):
+        """
+            Plays all the games until they are over or max_ticks frames were played.
+
+            Args:
+            max_ticks (int): Number of frames after which the games stop.
+        """
+        self.max_ticks = max_ticks
+        while self.t < max_ticks and not self.done.all():
+            self.frame()
+
+    def frame(self):
+        """
+            Advances all the games that are not over by one frame, as one iteration of Game.a_star.
+        """
+        active = ~self.done
+        self.t += 1
+        self.ticks[active] = self.t
+        listed = self.alive & ~self.scared # enemy IDs are listed before the player moves
+
+        codes = self.player_moves()
+        if self.history is not None:
+            self.history.append(codes)
+        self.step_player(codes, active)
+        self.score[active] += np.select([self.status == SCORE, self.status == POWER, self.status == EAT], [1, 5, 10])[active]
+
+        # same frames as Game.a_star's counter, the won games skip the enemies
+        if (self.t - 1) % self.enemy_frame == 0:
+            turn = active & (self.status != WON)
+            moving = turn.copy()
+            codes = self.plan(self.player)
+            for k in range(self.enemy.shape[1]):
+                lost = self.step_agent(k, codes[:, k], moving & listed[:, k])
+                self.status[lost] = LOST
+                moving[lost] = False # an enemy catching the player ends the enemies' turn
+            listed = self.alive & self.scared
+            codes = self.plan(self.house)
+            for k in range(self.enemy.shape[1]):
+                lost = self.step_agent(k, codes[:, k], turn & listed[:, k])
+                self.status[lost] = LOST
+
+        self.done |= active & ((self.status == WON) | (self.status == LOST))
+
+    def plan(self, target):
+        """
+            Gets the first move of a shortest path from each enemy to a target cell of its game.
+
+            Args:
+            target (numpy array): The (B,) target cells.
+
+            Returns:
+            numpy array: The (B, E) move codes.
+        """
+        k = self.table.next_hop[self.table_index[self.enemy], self.table_index[target][:, None]]
+        return np.where(k < 0, STAY, k)
+
+    def danger_at(self, cells):
+        """
+            Computes the danger of cells, as Map.danger_field from the enemies that are not scared.
+
+            Args:
+            cells (numpy array): The (B, n) cells.
+
+            Returns:
+            numpy array: The (B, n) danger of the cells.
+        """
+        x, y = cells % self.width, cells // self.width
+        ex, ey = self.enemy % self.width, self.enemy // self.width
+        hunting = self.alive & ~self.scared
+        danger = np.zeros(cells.shape)
+        for k in range(self.enemy.shape[1]): # summed in ID order, as in Map.danger_field
+            dist = (x - ex[:, k, None]) ** 2 + (y - ey[:, k, None]) ** 2
+            danger += np.where(hunting[:, k, None], self.danger_weight / (self.eps + dist), 0)
+        return danger
+
+    def player_moves(self):
+        """
+            Chooses the move of the player of each game: the target is chosen as in Map.closest_to_eat,
+            then the player moves to the open neighbour minimizing its distance to the target plus its danger.
+
+            Returns:
+            numpy array: The (B,) move codes.
+        """
+        # prizes, powers then scared enemies, so that argmin breaks ties as TargetIndex does
+        targets = np.concatenate([self.idle[:, 1:], self.enemy], axis=1)
+        left = np.concatenate([self.idle_left[:, 1:], self.alive & self.scared], axis=1)
+        moves = self.step[self.player]
+        danger = self.danger_at(np.concatenate([targets, moves[:, :STAY]], axis=1))
+        w = self.width
+
+        px, py = self.player % w, self.player // w
+        dist = (targets % w - px[:, None]) ** 2 + (targets // w - py[:, None]) ** 2
+        dist = np.where(np.arange(targets.shape[1]) >= self.idle.shape[1] - 1, dist / self.scared_bonus, dist)
+        score = np.where(left, dist + danger[:, :targets.shape[1]], np.inf)
+        target = targets[np.arange(self.n_games), score.argmin(axis=1)]
+
+        steps = self.table.dist[self.table_index[moves[:, :STAY]], self.table_index[target][:, None]].astype(float)
+        cost = np.where(self.open[self.player, :STAY] & (steps >= 0), steps + danger[:, targets.shape[1]:], np.inf)
+        codes = cost.argmin(axis=1)
+        return np.where(np.isinf(cost.min(axis=1)) | ~left.any(axis=1), STAY, codes)
+
+    def show_idles(self, b):
+        """
+            Shows the house, prizes and powers left on the cells without moving entity (Map.show_idles).
+        """
+        cells = self.idle[b]
+        show = self.idle_left[b] & (self.occupied[b[:, None], cells] == 0)
+        rows = np.broadcast_to(b[:, None], cells.shape)
+        self.sym[rows[show], cells[show]] = np.broadcast_to(self.idle_sym, cells.shape)[show]
+
+    def move(self, b, old, new, symbol):
+        """
+            Moves an entity from old to new in games b (Map.move).
+        """
+        self.sym[b, old] = SYMBOLS['-']
+        self.occupied[b, old] -= 1
+        self.occupied[b, new] += 1
+        self.sym[b, new] = symbol
+
+    def power(self, b):
+        """
+            Turns the enemies of games b into scared enemies (Map.power).
+        """
+        self.powered[b] = True
+        self.time[b] = self.t
+        turned = self.alive[b] & ~self.scared[b]
+        rows = np.broadcast_to(b[:, None], turned.shape)
+        self.sym[rows[turned], self.enemy[b][turned]] = SYMBOLS['&']
+        self.scared[b] |= turned
+
+    def check_power(self, b):
+        """
+            Ends the power mode of games b if it expired (end of Map.update_map).
+        """
+        b = b[self.powered[b] & (self.t - self.time[b] > self.dur)]
+        self.powered[b] = False
+        turned = self.alive[b] & self.scared[b]
+        rows = np.broadcast_to(b[:, None], turned.shape)
+        self.sym[rows[turned], self.enemy[b][turned]] = SYMBOLS['#']
+        self.scared[b] &= ~turned
+
+    def step_player(self, codes, act):
+        """
+            Moves the player of some games (Map.update_map for the player) and sets their status.
+
+            Args:
+            codes (numpy array): The (B,) move codes.
+            act (numpy array): The (B,) games whose player moves.
+        """
+        b = np.flatnonzero(act)
+        old, code = self.player[b], codes[b]
+        new = self.step[old, code]
+        self.status[b] = OK
+        valid = self.open[old, code]
+        b, old, new = b[valid], old[valid], new[valid]
+        self.show_idles(b)
+
+        here = self.alive[b] & (self.enemy[b] == new[:, None])
+        lost = (here & ~self.scared[b]).any(axis=1)
+        lb = b[lost]
+        self.psym[lb] = SYMBOLS['!']
+        self.sym[lb, new[lost]] = SYMBOLS['!']
+        self.status[lb] = LOST
+
+        eaten = here & self.scared[b] & ~lost[:, None]
+        eat = eaten.any(axis=1)
+        eb, k = b[eat], eaten[eat].argmax(axis=1) # lowest ID first
+        self.alive[eb, k] = False
+        self.occupied[eb, new[eat]] -= 1
+        self.move(eb, old[eat], new[eat], self.psym[eb])
+        self.player[eb] = new[eat]
+        self.status[eb] = EAT
+
+        rest = ~lost & ~eat
+        slot = self.idle_at[b, new]
+        left = (slot >= 0) & self.idle_left[b, np.maximum(slot, 0)]
+        prize = rest & left & (slot >= 1) & (slot <= self.n_prizes)
+        power = rest & left & (slot > self.n_prizes)
+        rest &= ~prize & ~power
+
+        pb = b[prize]
+        self.move(pb, old[prize], new[prize], self.psym[pb])
+        self.player[pb] = new[prize]
+        self.idle_left[pb, slot[prize]] = False
+        won = ~self.idle_left[pb, 1:1 + self.n_prizes].any(axis=1)
+        wb = pb[won]
+        self.psym[wb] = SYMBOLS['W']
+        self.sym[wb, self.player[wb]] = SYMBOLS['W']
+        self.status[pb] = np.where(won, WON, SCORE)
+
+        pb = b[power]
+        self.idle_left[pb, slot[power]] = False
+        self.move(pb, old[power], new[power], self.psym[pb])
+        self.player[pb] = new[power]
+        self.power(pb)
+        self.status[pb] = POWER
+
+        rb = b[rest]
+        self.move(rb, old[rest], new[rest], self.psym[rb])
+        self.player[rb] = new[rest]
+        self.check_power(rb)
+
+    def step_agent(self, k, codes, act):
+        """
+            Moves the k-th enemy of some games (Map.update_map for an enemy or a scared enemy).
+
+            Args:
+            k (int): The enemy, in ID order.
+            codes (numpy array): The (B,) move codes.
+            act (numpy array): The (B,) games whose k-th enemy moves.
+
+            Returns:
+            numpy array: The games where the enemy caught the player.
+        """
+        b = np.flatnonzero(act)
+        old, code = self.enemy[b, k], codes[b]
+        new = self.step[old, code]
+        scared = self.scared[b, k]
+        valid = self.open[old, code] & (self.sym[b, new] != np.where(scared, SYMBOLS['&'], SYMBOLS['#']))
+        b, old, new, scared = b[valid], old[valid], new[valid], scared[valid]
+        self.show_idles(b)
+
+        caught = new == self.player[b]
+        lb = b[caught & ~scared]
+        self.psym[lb] = SYMBOLS['!']
+        self.sym[lb, self.player[lb]] = SYMBOLS['!']
+
+        eb = b[caught & scared] # a scared enemy running into the player is eaten
+        self.alive[eb, k] = False
+        self.occupied[eb, old[caught & scared]] -= 1
+
+        mb, old, new = b[~caught], old[~caught], new[~caught]
+        home = self.scared[mb, k] & (new == self.house[mb])
+        hb = mb[home]
+        self.sym[hb, old[home]] = SYMBOLS['#']
+        self.scared[hb, k] = False
+        self.move(mb, old, new, np.where(self.scared[mb, k], SYMBOLS['&'], SYMBOLS['#']))
+        self.enemy[mb, k] = new
+        self.check_power(mb)
+        return lb
+
+    def results(self):
+        """
+            Summarizes the games, as Game.result does.
+
+            Returns:
+            list: The outcome, score and number of frames of each game.
+        """
+        results = []
+        for b in range(self.n_games):
+            if not self.done[b] or self.ticks[b] == self.max_ticks:
+                outcome, ticks = 'timeout', self.ticks[b]
+            else: # Game notices that a game is over at the start of the next frame
+                outcome, ticks = 'won' if self.status[b] == WON else 'lost', self.ticks[b] + 1
+            results.append({'outcome': outcome, 'score': int(self.score[b]), 'ticks': int(ticks)})
+        return results
+
+
+class ReplayGame(Game):
+    """
+        A headless game whose player plays given moves, with one life and enemies moving as LockstepGames' do.
+    """
+    def __init__(self, map_folder, moves, table, **kwargs):
+        self.moves = iter(moves)
+        self.table = table
+        super().__init__(map_folder, headless=True, **kwargs)
+        self.lives = 1
+
+    def load(self):
+        super().load()
+        self.map.distances = self.table
+        self.planner = None
+
+    def player_move(self, player_id, player, enemy_pos):
+        return next(self.moves)
+
+def cross_check(map_path, seeds, max_ticks=1000):
+    """
+        Plays games with LockstepGames, then replays each of them with the scalar engine (Game and
+        Map.update_map) fed with the same player moves, and compares the outcome, score, number of
+        frames, symbols of the cells and entities left.
+
+        Args:
+        map_path (str): The level.
+        seeds (list of int): Seeds of the entity placement.
+        max_ticks (int, optional): Number of frames after which the games stop.
+
+        Returns:
+        list of str: The differences found, empty if both engines agree.
+    """
+    games = LockstepGames.from_seeds(map_path, seeds, record=True)
+    games.run(max_ticks)
+    history = np.array(games.history).reshape(-1, games.n_games)
+    n_prizes = games.n_prizes
+    map_path = Path(map_path)
+
+    errors = []
+    for b, (seed, result) in enumerate(zip(seeds, games.results())):
+        moves = [MOVES[code] if code < STAY else (0, 0) for code in history[:, b]]
+        game = ReplayGame(map_path.parent, moves, games.table, max_ticks=max_ticks,
+                          levels=[map_path.name], rng=np.random.RandomState(seed))
+        scalar = game.a_star()
+        if any(scalar[key] != result[key] for key in result):
+            errors.append(f'seed {seed}: {result} != {scalar}')
+            continue
+
+        map = game.map
+        if not np.array_equal(map.cells.ravel(), games.sym[b]):
+            errors.append(f'seed {seed}: cell symbols differ')
+        ids = map.get_entity_category('prize') + map.get_entity_category('power')
+        left = [str(2 + games.enemy.shape[1] + i) for i in range(games.idle.shape[1] - 1) if games.idle_left[b, 1 + i]]
+        if ids != left:
+            errors.append(f'seed {seed}: prizes and powers left differ')
+        for k in range(games.enemy.shape[1]):
+            entity = map.entities.get(str(2 + k))
+            actual = (entity.pos, entity.category) if entity else None
+            expected = None
+            if games.alive[b, k]:
+                cell = int(games.enemy[b, k])
+                expected = ((cell % games.width, cell // games.width), 'scared' if games.scared[b, k] else 'enemy')
+            if actual != expected:
+                errors.append(f'seed {seed}: enemy {k} is {actual}, expected {expected}')
+    return errors
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Play many games of a level in lockstep, e.g. to tune the avoidance weights')
+    parser.add_argument('map', help='the level')
+    parser.add_argument('--games', type=int, default=1000, help='number of games (seeds 0 to games - 1)')
+    parser.add_argument('--max-ticks', type=int, default=2000, help='stop a game after this many frames')
+    parser.add_argument('--danger-weight', type=float, nargs='+', default=[DANGER_WEIGHT], help='weights of the enemy-avoidance penalty')
+    parser.add_argument('--scared-bonus', type=float, nargs='+', default=[SCARED_BONUS], help='divisors of the squared distance to scared enemies')
+    parser.add_argument('--check', action='store_true', help='compare the rules with the scalar engine instead')
+    args = parser.parse_args()
+
+    if args.check:
+        errors = cross_check(args.map, range(args.games), args.max_ticks)
+        print('\n'.join(errors) or f'{args.games} games: lockstep and scalar engines agree')
+        raise SystemExit(1 if errors else 0)
+
+    print(f'{"weight":>8}{"bonus":>8}{"won":>6}{"lost":>6}{"timeout":>8}{"score":>8}{"ticks":>8}{"time":>8}')
+    for danger_weight in args.danger_weight:
+        for scared_bonus in args.scared_bonus:
+            start = perf_counter()
+            games = LockstepGames.from_seeds(args.map, range(args.games), danger_weight=danger_weight, scared_bonus=scared_bonus)
+            games.run(args.max_ticks)
+            results = games.results()
+            counts = [sum(r['outcome'] == outcome for r in results) for outcome in ('won', 'lost', 'timeout')]
+            print(f'{danger_weight:>8g}{scared_bonus:>8g}' + ''.join(f'{n:>6}' for n in counts[:2]) + f'{counts[2]:>8}'
+                  + f'{np.mean([r["score"] for r in results]):>8.1f}{np.mean([r["ticks"] for r in results]):>8.1f}'
+                  + f'{perf_counter() - start:>7.2f}s')
@@ -1,7 +1,41 @@
+import json
+import os
+from pathlib import Path
+
 import numpy as np
 from time import time
 
 from config import *
+from targets import TargetIndex, TARGET_CATEGORIES
+from level_format import load_binary
+
+def map_files(folder):
+    """
+        Gets the map files of a folder (other files, such as entity counts, are skipped).
+
+        Args:
+        folder (str): The folder.
+
+        Returns:
+        list: The sorted names of the text (.txt) and binary (BINARY_SUFFIX) levels of the folder.
+    """
+    return sorted(name for name in os.listdir(folder) if name.endswith(('.txt', BINARY_SUFFIX)))
+
+def entity_counts(map_path):
+    """
+        Reads the entity counts of a map, stored in the .json file of the same name (see generate.py).
+
+        Args:
+        map_path (str): The map file.
+
+        Returns:
+        dict: The arguments of Map.add_entities, empty if the map has no counts file.
+    """
+    counts_path = Path(map_path).with_suffix('.json')
+    if not counts_path.exists():
+        return {}
+    with open(counts_path) as f:
+        return json.load(f)
 
 class Entity():
     """
@@ -56,93 +90,329 @@ class Map():
         A class to represent the game map and its operations.
 
         Attributes:
-        map (numpy array): The game map.
+        cells (numpy array): The uint8 character codes of the symbols of the cells (see rows and symbol to display them).
+        walkable (numpy array): The cells that are not walls.
+        neighbours (numpy array): For each cell, a uint8 bitmask of its walkable neighbours (bit k for MOVES[k]).
+        adj_offsets (numpy array): CSR offsets of the neighbours of each flat cell ID y * width + x (see csr_adjacency).
+        adj_cells (numpy array): CSR neighbour cell IDs.
+        adj_moves (numpy array): Index in MOVES of the move to each neighbour in adj_cells.
         width (int): The width of the map.
         height (int): The height of the map.
         player_id (str): The ID of the player entity.
         entities (dict): The dictionary of entities on the map.
         entities_counter (int): Counter for assigning unique IDs to entities.
         powered (bool): Indicates if power mode is active.
-        dur (int): Duration of the power mode.
+        dur (int): Duration of the power mode, in clock units.
+        clock (callable): Returns the current time (time.time by default, or a frame counter).
+        rng (numpy RandomState): Random generator placing the entities (the global numpy one by default).
+        distances (DistanceTable): Precomputed distances of the level, None if not computed.
+        categories (dict): Index of the entity IDs of each category, kept in ID order.
+        positions (dict): Index of the entity IDs at each position.
+        dirty (set): Positions whose symbol changed since the last render.
+        targets (TargetIndex): Spatial index of the prizes, powers and scared enemies.
+        free (numpy array): Flat indices of the cells where entities can be placed, the first n_free are valid.
+        n_free (int): Number of valid cells in free.
+        swaps (list): The swaps of free cells made by add_entity, undone by restore.
 
         Methods:
-        __init__(map_path): Initializes the map with the specified map file.
+        __init__(map_path, clock, dur, rng): Initializes the map with the specified map file.
         load_map(map_path): Loads the map from a file.
-        add_entity(category, symbol, id): Adds a new entity to the map.
-        closest_to_eat(player_id, avoid_category, eps): Finds the closest entity to eat.
+        neighbour_masks(walkable): Computes the walkable neighbours bitmask of each cell.
+        csr_adjacency(neighbours): Builds the adjacency of the cells in compressed sparse row form.
+        rows(): Gets the symbols of the cells, row by row.
+        symbol(x, y): Gets the symbol of a cell.
+        add_entity(category, symbol): Adds a new entity to the map.
+        add_entities(n_enemies, n_prizes, n_powers): Places all the entities of a level.
+        remove_entity(entity_id): Removes an entity from the map.
+        snapshot(): Records the state of the level.
+        restore(state): Restores a state recorded with snapshot().
+        closest_to_eat(player_id, avoid_category, eps, danger): Finds the closest entity to eat.
+        danger_field(avoid_pos, eps): Builds the enemy-avoidance penalty of every cell.
         update_map(entity_id, move): Updates the map based on the entity's move.
         show_idles(): Shows idle entities on the map.
         power(): Activates the power mode.
         reactivate(scared_id): Reactivates a scared entity to enemy.
         reactivate_enemies(): Reactivates all scared entities to enemies.
         get_entity_category(category): Gets all entities of a specific category.
+        entities_at(pos, category): Gets the entities at a position.
         lost(player_pos, enemy_pos): Checks if the player has lost.
         won(): Sets the game state to won.
         move(entity_id, current_pos, new_pos): Moves an entity on the map.
+        set_cell(x, y, symbol): Sets the symbol of a cell.
         is_valid(entity_id, move): Checks if a move is valid.
         get_player(): Gets the player entity.
         get_house(): Gets the house entity.
     """
-    def __init__(self, map_path=None):
+    def __init__(self, map_path=None, clock=time, dur=POWER_DURATION, rng=None):
         self.load_map(map_path=map_path)
         self.player_id = None
         self.entities = {} 
         self.entities_counter = 0 # for ID
+        self.categories = {} # category -> {id: None}, ordered by ID
+        self.positions = {} # pos -> [id, ...]
+        self.dirty = set()
+        self.targets = TargetIndex(self)
         self.powered = False
-        self.dur = POWER_DURATION
+        self.dur = dur
+        self.clock = clock
+        self.rng = rng if rng is not None else np.random
+        self.distances = None
+        self.n_free = len(self.free)
+        self.swaps = [] # swaps of free cells made by add_entity, undone by restore
 
     def load_map(self, map_path: str):
         """
-            Loads the map from a file.
+            Loads the map from a text file, or from a binary level (see level_format.py). A binary level
+            is memory-mapped: the character codes are used as the cells without copying them, and the
+            layout is read from the file when stored.
 
             Args:
             map_path (str): The path to the map file.
         """
-        with open(map_path, 'r') as f:
-            map = []
-            height = 0
-            for l in f:
-                line = l.strip()
-                if line:
-                    width = len(line)
-                    height += 1
-                    map.append(list(line))
+        adjacency = None
+        if str(map_path).endswith(BINARY_SUFFIX):
+            self.cells, neighbours, adjacency = load_binary(map_path)
+            self.height, self.width = self.cells.shape
+            self.walkable = self.cells != WALL
+            self.neighbours = neighbours if neighbours is not None else self.neighbour_masks(self.walkable)
+        else:
+            with open(map_path, 'rb') as f:
+                lines = [line.strip() for line in f]
+            self.cells = np.array([np.frombuffer(line, dtype=np.uint8) for line in lines if line])
+            self.height, self.width = self.cells.shape
+            self.walkable = self.cells != WALL
+            self.neighbours = self.neighbour_masks(self.walkable)
+
+        if adjacency is None:
+            adjacency = self.csr_adjacency(self.neighbours)
+        self.adj_offsets, self.adj_cells, self.adj_moves = adjacency
+        self.free = np.flatnonzero(self.cells == EMPTY).astype(np.int64) # cells where entities can be placed
+
+    @staticmethod
+    def neighbour_masks(walkable):
+        """
+            Computes the bitmask of the walkable neighbours of each cell (bit k for MOVES[k]).
 
-        self.map = np.array(map, dtype='<U1')
-        self.width = width
-        self.height = height
+            Args:
+            walkable (numpy array): The cells that are not walls.
 
-    def add_entity(self, category, symbol, id=None):
+            Returns:
+            numpy array: The uint8 bitmasks.
+        """
+        height, width = walkable.shape
+        padded = np.pad(walkable, 1) # cells outside the map are walls
+        neighbours = np.zeros((height, width), dtype=np.uint8)
+        for k, (dx, dy) in enumerate(MOVES):
+            neighbours |= padded[1 + dy:1 + dy + height, 1 + dx:1 + dx + width].astype(np.uint8) << k
+        return neighbours
+
+    @staticmethod
+    def csr_adjacency(neighbours):
         """
-            Adds a new entity to the map.
+            Builds the adjacency of the cells in compressed sparse row form, over flat cell IDs (y * width + x).
+
+            The neighbours of cell c are adj_cells[adj_offsets[c]:adj_offsets[c + 1]], in MOVES order,
+            and adj_moves holds the index in MOVES of the move to each of them. The arrays are read-only.
+
+            Args:
+            neighbours (numpy array): The neighbour bitmasks of the cells (see neighbour_masks).
+
+            Returns:
+            tuple: The int32 offsets (one per cell, plus one), the int32 neighbour cells and the int8 moves.
+        """
+        width = neighbours.shape[1]
+        masks = neighbours.ravel()
+        has = [(masks >> k & 1).astype(bool) for k in range(len(MOVES))]
+        offsets = np.zeros(len(masks) + 1, dtype=np.int32)
+        for bits in has:
+            offsets[1:] += bits
+        np.cumsum(offsets, out=offsets)
+
+        # fill the row of each cell move by move, so that neighbours are in MOVES order
+        adjacent = np.empty(offsets[-1], dtype=np.int32)
+        moves = np.empty(offsets[-1], dtype=np.int8)
+        fill = offsets[:-1].copy()
+        cells = np.arange(len(masks), dtype=np.int32)
+        for k, (dx, dy) in enumerate(MOVES):
+            at = fill[has[k]]
+            adjacent[at] = cells[has[k]] + (dy * width + dx)
+            moves[at] = k
+            fill += has[k]
+        for array in (offsets, adjacent, moves):
+            array.setflags(write=False)
+        return offsets, adjacent, moves
+
+    def rows(self):
+        """
+            Gets the symbols of the cells, row by row, to display the map.
+
+            Returns:
+            list: The rows, as strings.
+        """
+        return [row.tobytes().decode('ascii') for row in self.cells]
+
+    def symbol(self, x, y):
+        """
+            Gets the symbol of a cell.
+
+            Args:
+            x (int): The column of the cell.
+            y (int): The row of the cell.
+
+            Returns:
+            str: The symbol.
+        """
+        return chr(self.cells.item(y, x))
+
+    def add_entity(self, category, symbol):
+        """
+            Adds a new entity to the map, with the next ID.
 
             Args:
             category (str): The category of the entity.
             symbol (str): The symbol representing the entity.
-            id (str, optional): The ID of the entity.
 
             Returns:
             int: Status code indicating success.
         """
         while True:
-            x, y = np.random.randint(self.width), np.random.randint(self.height)
-            if self.map[y, x] == '-':
+            # draw a free cell and swap it out of the valid ones
+            i = self.rng.randint(self.n_free)
+            cell = self.free[i]
+            self.n_free -= 1
+            self.free[i], self.free[self.n_free] = self.free[self.n_free], cell
+            self.swaps.append(i)
+            y, x = divmod(int(cell), self.width)
+            if self.cells.item(y, x) == EMPTY: # may be taken if entities moved since the level started
                 break
-        self.map[y, x] = symbol
+        self.set_cell(x, y, symbol)
 
         entity = Entity((x, y), symbol, category)
-        if id:
-            index = id
         index = str(self.entities_counter)
         self.entities_counter += 1
         self.entities[index] = entity
+        self._index(index)
 
         if category == 'player':
             self.player_id = index
 
         return OK
     
-    def closest_to_eat(self, player_id, avoid_category=None, eps=1e-6):
+    def add_entities(self, n_enemies=N_ENEMIES, n_prizes=N_PRIZES, n_powers=N_POWERS):
+        """
+            Places the player, the house, the enemies, the prizes and the powers at random.
+
+            Args:
+            n_enemies (int, optional): Number of enemies.
+            n_prizes (int, optional): Number of prizes.
+            n_powers (int, optional): Number of power-ups.
+        """
+        self.add_entity('player', '@')
+        self.add_entity('house', 'H')
+        for _ in range(n_enemies):
+            self.add_entity('enemy', '#')
+        for _ in range(n_prizes):
+            self.add_entity('prize', '.')
+        for _ in range(n_powers):
+            self.add_entity('power', 'O')
+
+    def snapshot(self):
+        """
+            Records the state of the level: the entities, the power mode and the free cells. The cells are
+            not copied: walkable cells are '-' in the empty level, so restore() empties those that are not
+            (including the symbols left behind by removed entities) and redraws the entities. The layout
+            (walls, neighbours, distances) does not change.
+
+            Returns:
+            dict: The state, to pass to restore().
+        """
+        return {
+            'entities': [(index, e.pos, e.symbol, e.category) for index, e in self.entities.items()],
+            'entities_counter': self.entities_counter,
+            'player_id': self.player_id,
+            'powered': self.powered,
+            'time': getattr(self, 'time', None),
+            'n_free': self.n_free,
+            'swaps': len(self.swaps),
+        }
+
+    def restore(self, state):
+        """
+            Restores a state recorded with snapshot() (e.g. to restart a level without reading it again).
+            The walkable cells that are not empty are emptied, then those of the restored entities show their symbol
+            (the last one in ID order where several share a cell), and the free cells taken since the
+            snapshot are put back in their order.
+
+            Args:
+            state (dict): The state.
+        """
+        ys, xs = np.nonzero(self.walkable & (self.cells != EMPTY)) # entities, and removed entities' symbols
+        for x, y in zip(xs.tolist(), ys.tolist()):
+            self.set_cell(x, y, '-')
+        self.entities = {}
+        self.categories = {}
+        self.positions = {}
+        self.targets = TargetIndex(self)
+        for index, pos, symbol, category in state['entities']:
+            self.entities[index] = Entity(pos, symbol, category)
+            self._index(index)
+            self.set_cell(pos[0], pos[1], symbol)
+        self.entities_counter = state['entities_counter']
+        self.player_id = state['player_id']
+        self.powered = state['powered']
+        self.time = state['time']
+        while len(self.swaps) > state['swaps']: # undo the swaps of add_entity, last first
+            self.n_free += 1
+            i, last = self.swaps.pop(), self.n_free - 1
+            self.free[i], self.free[last] = self.free[last], self.free[i]
+        self.n_free = state['n_free']
+
+    def remove_entity(self, entity_id):
+        """
+            Removes an entity from the map (the map cell is left as is).
+
+            Args:
+            entity_id (str): The ID of the entity to remove.
+        """
+        self._unindex(entity_id)
+        del self.entities[entity_id]
+
+    def _index(self, entity_id):
+        """
+            Adds an entity to the category and position indexes.
+
+            Args:
+            entity_id (str): The ID of the entity.
+        """
+        entity = self.entities[entity_id]
+        ids = self.categories.setdefault(entity.category, {})
+        if ids and int(entity_id) < int(next(reversed(ids))):
+            # keep the ID order of a full scan of entities (only happens when enemies change category)
+            ids[entity_id] = None
+            self.categories[entity.category] = dict.fromkeys(sorted(ids, key=int))
+        else:
+            ids[entity_id] = None
+        self.positions.setdefault(entity.pos, []).append(entity_id)
+        if entity.category in TARGET_CATEGORIES:
+            self.targets.add(entity_id, entity.pos)
+
+    def _unindex(self, entity_id):
+        """
+            Removes an entity from the category and position indexes.
+
+            Args:
+            entity_id (str): The ID of the entity.
+        """
+        entity = self.entities[entity_id]
+        del self.categories[entity.category][entity_id]
+        occupants = self.positions[entity.pos]
+        occupants.remove(entity_id)
+        if not occupants:
+            del self.positions[entity.pos]
+        if entity.category in TARGET_CATEGORIES:
+            self.targets.remove(entity_id, entity.pos)
+
+    def closest_to_eat(self, player_id, avoid_category=None, eps=1e-6, danger=None):
         """
             Finds the best to eat for the player, avoiding specific categories if provided (check report for details)
 
@@ -150,40 +420,47 @@ class Map():
             player_id (str): The ID of the player entity.
             avoid_category (str, optional): The category of entities to avoid.
             eps (float, optional): A small value to prevent division by zero.
+            danger (numpy array, optional): Danger field of the entities to avoid, built from avoid_category if not provided.
 
             Returns:
-            tuple: The ID and the closest entity to eat.
+            tuple: The ID and the closest entity to eat, (None, None) if there is nothing to eat.
         """
         player = self.entities[player_id]
 
-        categories = ['prize', 'power', 'scared']
-        ids = [] 
-        for category in categories:
-            ids += self.get_entity_category(category)
-
-        avoid_ids = self.get_entity_category(avoid_category)
-
-        index = ids[0]
-        closest = self.entities[index]
-        dist_to_closest = player.dist(closest)
-        for avoid_id in avoid_ids:
-                avoid_entity = self.entities[avoid_id]
-                dist_to_closest += 20 / (avoid_entity.dist(closest) + eps)
-
-        for id in ids:
-            other = self.entities[id]
-            dist_to_other = player.dist(other)
-            if other.category == 'scared':
-                dist_to_other /= 10
-            for avoid_id in avoid_ids:
-                avoid_entity = self.entities[avoid_id]
-                dist_to_other += 20 / (avoid_entity.dist(other) + eps)
-            if dist_to_other < dist_to_closest:
-                index = id
-                closest = other
-                dist_to_closest = dist_to_other
-        return index, closest
+        if danger is None:
+            avoid_pos = [self.entities[avoid_id].pos for avoid_id in self.get_entity_category(avoid_category)]
+            danger = self.danger_field(avoid_pos, eps)
+
+        index = self.targets.closest(player.pos, danger)
+        if index is None:
+            return None, None
+        return index, self.entities[index]
         
+    def danger_field(self, avoid_pos, eps=1e-6):
+        """
+            Builds the danger field of a set of positions: the penalty DANGER_WEIGHT / (eps + squared distance)
+            summed over all positions, for every cell of the map at once. The positions are taken by chunks
+            of about DANGER_CHUNK / cells, so that memory stays proportional to the cells with many enemies.
+
+            Args:
+            avoid_pos (list of positions): The positions to avoid (e.g. the enemies).
+            eps (float, optional): A small value to prevent division by zero.
+
+            Returns:
+            numpy array: A (height, width) float array, read as danger[y, x].
+        """
+        if not avoid_pos:
+            return np.zeros((self.height, self.width))
+        pos = np.asarray(avoid_pos)
+        ys, xs = np.ogrid[:self.height, :self.width]
+        danger = np.zeros((self.height, self.width))
+        step = max(1, DANGER_CHUNK // danger.size)
+        for i in range(0, len(pos), step):
+            chunk = pos[i:i + step]
+            dist = (xs - chunk[:, 0, None, None]) ** 2 + (ys - chunk[:, 1, None, None]) ** 2
+            danger += (DANGER_WEIGHT / (eps + dist)).sum(axis=0)
+        return danger
+
     def update_map(self, entity_id, move):
         """
             Updates the map based on the entity's move.
@@ -219,51 +496,40 @@ class Map():
 
             player_pos = self.entities[self.player_id].pos
             if new_pos == player_pos:
-                del self.entities[entity_id]
+                self.remove_entity(entity_id)
                 return EAT
             
-            for index in self.get_entity_category('house'):
-                house = self.entities[index]
-                if new_pos == house.pos:
-                    self.reactivate(entity_id)
+            if self.entities_at(new_pos, 'house'):
+                self.reactivate(entity_id)
 
-            else:
-                self.move(entity_id, current_pos, new_pos)
+            self.move(entity_id, current_pos, new_pos)
 
             
         if entity.category == 'player':
-            for index in self.get_entity_category('enemy'):
-                enemy = self.entities[index]
-                if self.lost(new_pos, enemy.pos):
-                    return LOST
-            for index in self.get_entity_category('scared'):
-                scared = self.entities[index]
-                if new_pos == scared.pos:
-                    del self.entities[index]
-                    self.move(entity_id, current_pos, new_pos)
-                    return EAT
-            
+            if self.entities_at(new_pos, 'enemy'):
+                self.lost(new_pos, new_pos)
+                return LOST
 
-            for index in self.get_entity_category('prize'):
-                prize = self.entities[index]
-                if new_pos == prize.pos:
-                    self.move(entity_id, current_pos, new_pos)
-                    del self.entities[index]
-                    if not self.get_entity_category('prize'):
-                        return self.won()
-                    return SCORE
-            
-                            
-            for index in self.get_entity_category('power'):
-                power = self.entities[index]
-                if new_pos == power.pos:
-                    del self.entities[index]
-                    self.move(entity_id, current_pos, new_pos)
-                    return self.power()
+            for index in self.entities_at(new_pos, 'scared'):
+                self.remove_entity(index)
+                self.move(entity_id, current_pos, new_pos)
+                return EAT
+
+            for index in self.entities_at(new_pos, 'prize'):
+                self.move(entity_id, current_pos, new_pos)
+                self.remove_entity(index)
+                if not self.categories.get('prize'):
+                    return self.won()
+                return SCORE
+
+            for index in self.entities_at(new_pos, 'power'):
+                self.remove_entity(index)
+                self.move(entity_id, current_pos, new_pos)
+                return self.power()
         
             self.move(entity_id, current_pos, new_pos)
 
-        if self.powered and time() - self.time > self.dur:
+        if self.powered and self.clock() - self.time > self.dur:
             self.reactivate_enemies()
 
         return OK
@@ -278,13 +544,10 @@ class Map():
             idle_ids += self.get_entity_category(category)
         for idle_id in idle_ids:
             idle = self.entities[idle_id]
-            occupied = False
-            for entity_id, entity in self.entities.items():
-                if entity.pos == idle.pos and entity_id != idle_id:
-                    occupied = True
+            occupied = len(self.positions[idle.pos]) > 1
             if not occupied:
                 x, y = idle.pos
-                self.map[y, x] = idle.symbol
+                self.set_cell(x, y, idle.symbol)
 
     def power(self):
         """
@@ -294,14 +557,16 @@ class Map():
             int: Status code indicating the activation of power mode.
         """
         self.powered = True
-        self.time = time()
+        self.time = self.clock()
         enemy_ids = self.get_entity_category('enemy')
         for enemy_id in enemy_ids:
             enemy = self.entities[enemy_id]
             scared = Entity(enemy.pos, '&', category='scared')
             x, y = enemy.pos
-            self.map[y, x] = '&'
+            self.set_cell(x, y, '&')
+            self._unindex(enemy_id)
             self.entities[enemy_id] = scared
+            self._index(enemy_id)
         return POWER
     
     def reactivate(self, scared_id):
@@ -314,8 +579,10 @@ class Map():
         scared = self.entities[scared_id]
         enemy = Entity(scared.pos, '#', category='enemy')
         x, y = scared.pos
-        self.map[y, x] = '#'
+        self.set_cell(x, y, '#')
+        self._unindex(scared_id)
         self.entities[scared_id] = enemy
+        self._index(scared_id)
     
     def reactivate_enemies(self):
         """
@@ -330,8 +597,10 @@ class Map():
             scared = self.entities[scared_id]
             enemy = Entity(scared.pos, '#', category='enemy')
             x, y = scared.pos
-            self.map[y, x] = '#'
+            self.set_cell(x, y, '#')
+            self._unindex(scared_id)
             self.entities[scared_id] = enemy
+            self._index(scared_id)
         return NORMAL
 
     def get_entity_category(self, category):
@@ -344,11 +613,23 @@ class Map():
             Returns:
             list: List of entity IDs in the specified category.
         """
-        entities = []
-        for k, v in self.entities.items():
-            if v.category == category:
-                entities.append(k)
-        return entities
+        return list(self.categories.get(category, ()))
+
+    def entities_at(self, pos, category=None):
+        """
+            Gets the entities at a position.
+
+            Args:
+            pos (tuple): The position.
+            category (str, optional): Only keep entities of this category.
+
+            Returns:
+            list: List of entity IDs at the position, in ID order.
+        """
+        ids = sorted(self.positions.get(pos, ()), key=int)
+        if category is None:
+            return ids
+        return [index for index in ids if self.entities[index].category == category]
 
     def lost(self, player_pos, enemy_pos):
         """
@@ -364,7 +645,7 @@ class Map():
         if player_pos == enemy_pos:
             self.entities[self.player_id].symbol = '!'
             x, y = player_pos
-            self.map[y, x] = '!'
+            self.set_cell(x, y, '!')
             return True
         return False
     
@@ -378,7 +659,7 @@ class Map():
         self.entities[self.player_id].symbol = 'W'
         _, player = self.get_player()
         x, y = player.pos
-        self.map[y, x] = 'W'
+        self.set_cell(x, y, 'W')
         return WON
         
     def move(self, entity_id, current_pos, new_pos):
@@ -392,11 +673,32 @@ class Map():
         """
         entity = self.entities[entity_id]
         x, y = current_pos
-        self.map[y, x] = '-'
+        self.set_cell(x, y, '-')
+        occupants = self.positions[current_pos]
+        occupants.remove(entity_id)
+        if not occupants:
+            del self.positions[current_pos]
         self.entities[entity_id].pos = new_pos
+        self.positions.setdefault(new_pos, []).append(entity_id)
+        if entity.category in TARGET_CATEGORIES:
+            self.targets.move(entity_id, current_pos, new_pos)
         x, y = new_pos
-        self.map[y, x] = entity.symbol
+        self.set_cell(x, y, entity.symbol)
         
+    def set_cell(self, x, y, symbol):
+        """
+            Sets the symbol of a cell, marking it for the next render if it changed.
+
+            Args:
+            x (int): The column of the cell.
+            y (int): The row of the cell.
+            symbol (str): The new symbol.
+        """
+        code = ord(symbol)
+        if self.cells.item(y, x) != code:
+            self.cells[y, x] = code
+            self.dirty.add((x, y))
+
     def is_valid(self, entity_id, move):
         """
             Checks if a move is valid.
@@ -415,13 +717,13 @@ class Map():
         new_pos = x + delta_x, y + delta_y
 
         is_within_map = new_pos[0] > 0 and new_pos[0] < self.width and new_pos[1] > 0 and new_pos[1] < self.height
-        is_case_valid = self.map[new_pos[1], new_pos[0]] != '%'
+        is_case_valid = self.walkable[new_pos[1], new_pos[0]]
 
         if entity.category == 'enemy':
-            is_case_valid &= self.map[new_pos[1], new_pos[0]] != entity.symbol
+            is_case_valid &= self.cells.item(new_pos[1], new_pos[0]) != ord(entity.symbol)
 
         if entity.category == 'scared':
-            is_case_valid &= self.map[new_pos[1], new_pos[0]] != entity.symbol
+            is_case_valid &= self.cells.item(new_pos[1], new_pos[0]) != ord(entity.symbol)
 
         return is_within_map and is_case_valid, new_pos
     
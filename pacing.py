@@ -0,0 +1,96 @@
+from time import sleep, perf_counter
+
+from config import *
+
+class FrameScheduler():
+    """
+        A class to run the game loop at a fixed frame rate.
+
+        Frames are due every period seconds from the first one. After the work of a frame, the
+        scheduler only sleeps until the next deadline, so the frame period no longer depends on the
+        time spent in pathfinding. A frame that ends after its deadline is an overrun: it is recorded,
+        the next frame starts right away and the following deadlines are counted from it (lost frames
+        are not caught up). The frame after an overrun is degraded, the game loop may then cut corners
+        (skip rendering, reuse the previous enemy moves), at most max_degraded frames in a row.
+
+        Attributes:
+        period (float): Duration of a frame, in seconds.
+        max_degraded (int): Maximum number of degraded frames in a row.
+        frames (int): Number of frames played.
+        overruns (list of tuple): The frame number and lateness (in seconds) of each overrun.
+        degraded (bool): Whether the current frame is degraded.
+        streak (int): Number of degraded frames in a row, up to the current one.
+        n_degraded (int): Number of degraded frames.
+
+        Methods:
+        __init__(period, max_degraded, clock, sleep): Initializes the scheduler.
+        start_frame(): Starts a frame.
+        end_frame(): Sleeps until the next deadline.
+        summary(): Summarizes the overruns.
+    """
+    def __init__(self, period=SLEEP, max_degraded=MAX_DEGRADED_FRAMES, clock=perf_counter, sleep=sleep):
+        """
+            Initializes the scheduler.
+
+            Args:
+            period (float, optional): Duration of a frame, in seconds.
+            max_degraded (int, optional): Maximum number of degraded frames in a row.
+            clock (function, optional): Current time in seconds.
+            sleep (function, optional): Waits a number of seconds.
+        """
+        self.period = period
+        self.max_degraded = max_degraded
+        self.clock = clock
+        self.sleep = sleep
+        self.deadline = None
+        self.open = False
+        self.late = False
+        self.frames = 0
+        self.overruns = []
+        self.degraded = False
+        self.streak = 0
+        self.n_degraded = 0
+
+    def start_frame(self):
+        """
+            Starts a frame, degraded if the previous one overran. Game.a_star calls it before rendering
+            and end_frame() after the frame is played, level changes included; a frame started again
+            before end_frame() is called keeps the deadline of the open one.
+        """
+        if self.deadline is None:
+            self.deadline = self.clock()
+        if not self.open:
+            self.deadline += self.period
+        self.open = True
+        self.degraded = self.late and self.streak < self.max_degraded
+        self.streak = self.streak + 1 if self.degraded else 0
+        self.n_degraded += self.degraded
+
+    def end_frame(self):
+        """
+            Sleeps until the deadline of the current frame, or records an overrun if it has passed.
+
+            Returns:
+            float: Time slept, in seconds (0 after an overrun).
+        """
+        self.frames += 1
+        self.open = False
+        now = self.clock()
+        remaining = self.deadline - now
+        self.late = remaining < 0
+        if self.late:
+            self.overruns.append((self.frames, -remaining))
+            self.deadline = now
+            return 0
+        self.sleep(remaining)
+        return remaining
+
+    def summary(self):
+        """
+            Summarizes the overruns.
+
+            Returns:
+            dict: The number of frames, overruns and degraded frames, and the maximum lateness in seconds.
+        """
+        return {'frames': self.frames, 'overruns': len(self.overruns), 'degraded': self.n_degraded,
+                'max_late': max((late for _, late in self.overruns), default=0)}
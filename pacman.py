@@ -1,12 +1,20 @@
 import numpy as np
 import curses
-from time import sleep
+from time import sleep, perf_counter
 import os
 from pathlib import Path
 
 from config import *
 from pathfinding import *
 from map import *
+from distances import DistanceTable
+from render import CursesRenderer, AnsiRenderer
+from incremental import IncrementalPlanner
+from hierarchical import HierarchicalPlanner
+from profiler import Profiler
+from pacing import FrameScheduler
+from heuristics import HEURISTICS
+from parallel import ParallelPlanner
 
 class Game:
     """
@@ -21,32 +29,81 @@ class Game:
         score (int): Current score.
         enemy_frame (int): Number of frames between enemy updates.
         lives (int): Number of lives remaining.
+        renderer (Renderer): Draws the frames, created on the first print_map call.
+        headless (bool): Run without rendering nor sleeping, power duration is counted in frames.
+        max_ticks (int): Number of frames after which a headless game stops (None for no limit).
+        ticks (int): Number of frames played.
+        counter (int): Frames since the enemies last moved.
+        path_time (float): Time spent in path_to_prize, in seconds.
+        rng (numpy RandomState): Random generator placing the entities (None for the global numpy one).
+        planner (IncrementalPlanner or HierarchicalPlanner): The player's planner kept across frames (None unless INCREMENTAL_PLAYER or HIERARCHICAL_PLAYER).
+        empty_level (dict): Snapshot of the current level before its entities were placed.
+        profiler (Profiler): Times the phases of each frame (disabled unless PROFILE or --profile).
+        scheduler (FrameScheduler): Paces the frames (None in headless mode or unless ADAPTIVE_PACING).
+        last_moves (dict): The last planned move of each enemy and scared enemy, reused by degraded frames.
+        heuristic (Heuristic): The heuristic of the searches of the level (None unless SEARCH_HEURISTIC).
+        parallel (ParallelPlanner): Plans the enemies of a frame on a pool of workers (None unless PARALLEL_AGENTS).
+        path_cache (PathCache): The moves of the enemies and scared enemies already planned on the current level (None if PATH_CACHE_BYTES is 0).
+        player_cache (PathCache): The same for the player, whose queries rarely repeat (None if PLAYER_CACHE_BYTES is 0).
+        log (ReplayWriter): Records the moves of every frame (None unless recording), power duration is then counted in frames.
 
         Methods:
-        __init__(map_folder): Initializes the game with the specified map folder.
+        __init__(map_folder, headless, max_ticks, levels, rng, profiler, log): Initializes the game with the specified map folder.
         a_star(stdscr): Runs the main game loop with A* pathfinding.
+        degraded(): Whether the current frame cuts corners to catch up after an overrun.
+        step(): Plays one frame.
+        finish(outcome): Ends the game and the replay log.
+        player_move(player_id, player, enemy_pos): Finds the move of the player.
+        record(moves): Writes moves of the current frame to the replay log.
+        first_move(start_pos, end_pos, avoid_pos, danger, cache): Finds the first move of the A* path.
+        plan_agents(target_pos, start_positions, avoid_pos): Finds the first moves of several agents.
+        close(): Stops the planning workers.
+        result(outcome): Summarizes a finished headless game.
         print_map(stdscr, opt, offset): Prints the current state of the map.
+        status_line(): Gets the status line displayed below the map.
         load(): Loads the current level map and initializes entities.
+        respawn(): Restarts the current level with new entities, without reading it again.
         game_over(stdscr): Displays the game over screen.
         you_won(stdscr): Displays the you won screen.
     """
 
-    def __init__(self, map_folder: str):
+    def __init__(self, map_folder: str, headless=HEADLESS, max_ticks=None, levels=None, rng=None, profiler=None, log=None):
         """
         Initializes the game with the specified map folder.
 
         Args:
         map_folder (str): The folder containing map files for the levels.
+        headless (bool, optional): Run without rendering nor sleeping, as fast as possible.
+        max_ticks (int, optional): Number of frames after which a headless game stops.
+        levels (list of str, optional): Map files of map_folder to play, all of them by default.
+        rng (numpy RandomState, optional): Random generator placing the entities.
+        profiler (Profiler, optional): Times the phases of each frame.
+        log (ReplayWriter, optional): Records the game (see replay.py), rng should then be seeded with its seed.
         """
         self.map_folder = map_folder
-        self.levels = np.sort(os.listdir(self.map_folder))
+        self.levels = np.sort(map_files(self.map_folder) if levels is None else levels)
         self.n_levels = len(self.levels)
         self.level = 1
+        self.headless = headless
+        self.max_ticks = max_ticks
+        self.ticks = 0
+        self.path_time = 0
+        self.rng = rng
+        self.log = log
+        if log is not None:
+            log.begin(self)
+        self.parallel = ParallelPlanner() if PARALLEL_AGENTS else None
+        self.path_cache = PathCache() if PATH_CACHE_BYTES else None
+        self.player_cache = PathCache(PLAYER_CACHE_BYTES) if PLAYER_CACHE_BYTES else None
         self.load()
         self.status = OK
         self.score = 0
         self.enemy_frame = ENEMY_FRAME
         self.lives = LIVES
+        self.renderer = None
+        self.profiler = profiler if profiler is not None else Profiler()
+        self.scheduler = FrameScheduler() if ADAPTIVE_PACING and not headless else None
+        self.counter = 0 # to update enemy position
 
     def a_star(self, stdscr=None):
         """
@@ -54,32 +111,82 @@ class Game:
 
             Args:
             stdscr: The curses window object.
+
+            Returns:
+            dict: The result of the game (headless mode only, see result()).
         """
-        counter = 0 # to update enemy position
+        prof = self.profiler
+        scheduler = self.scheduler
 
         while True:
-            self.print_map(stdscr)
-
-            if self.status == WON:
-                self.level += 1
-                if self.level == self.n_levels + 1:
+            if self.headless and self.max_ticks is not None and self.ticks >= self.max_ticks:
+                return self.finish('timeout') # before a frame is started, no empty frame is profiled
+            prof.begin_frame()
+            if scheduler is not None:
+                scheduler.start_frame()
+            if not self.headless and not self.degraded(): # the cells changed meanwhile stay dirty until the next render
+                with prof.phase('render'):
+                    self.print_map(stdscr)
+
+            outcome = self.step()
+            if outcome is not None:
+                result = self.finish(outcome)
+                if self.headless:
+                    return result
+                if outcome == 'won':
                     self.level = 'END'
                     self.you_won(stdscr)
-                self.load()
-
-            if self.status == LOST:
-                self.lives -= 1
-                if self.lives == 0:
+                else:
                     self.level = 'LOST'
                     self.game_over(stdscr)
-                if self.score < 100: self.score = 0
-                else: self.score -= 100
+
+            if not self.headless:
+                with prof.phase('sleep'):
+                    if scheduler is not None:
+                        scheduler.end_frame()
+                    else:
+                        sleep(SLEEP)
+
+    def degraded(self):
+        """
+            Whether the current frame cuts corners to catch up after an overrun (see FrameScheduler).
+        """
+        return self.scheduler is not None and self.scheduler.degraded
+
+    def step(self):
+        """
+            Plays one frame: moves on to the next level or restarts the level after a lost life if needed,
+            then moves the player and, every enemy_frame frames, the enemies and scared enemies.
+
+            Returns:
+            str: 'won' or 'lost' if the game is over, None otherwise.
+        """
+        prof = self.profiler
+        degraded = self.degraded()
+        self.ticks += 1
+        if self.log is not None:
+            self.log.next_frame()
+
+        if self.status == WON:
+            self.level += 1
+            if self.level == self.n_levels + 1:
+                self.level -= 1
+                return 'won'
+            with prof.phase('load'):
                 self.load()
-            
 
-            player_id, player = self.map.get_player()
-            _, closest_prize = self.map.closest_to_eat(player_id, avoid_category='enemy')
+        if self.status == LOST:
+            self.lives -= 1
+            if self.lives == 0:
+                return 'lost'
+            if self.score < 100: self.score = 0
+            else: self.score -= 100
+            with prof.phase('load'):
+                self.respawn()
 
+        player_id, player = self.map.get_player()
+
+        with prof.phase('target'):
             enemies = []
             enemy_ids = self.map.get_entity_category('enemy')
             for enemy_id in enemy_ids:
@@ -88,60 +195,203 @@ class Game:
             enemy_pos = []
             for enemy in enemies:
                 enemy_pos.append(enemy.pos)
-            
-            # calculate path to prize while avoiding enemies
-            path = path_to_prize(player.pos, closest_prize.pos, self.map, avoid_pos=enemy_pos)[1:] 
-            if path: # only use first move of the provided path
-                move = path[0]
-            else:
-                move = (0, 0)
 
+        move = self.player_move(player_id, player, enemy_pos)
+        self.record([move])
+
+        with prof.phase('update'):
             self.status = self.map.update_map(player_id, move)
 
-            if self.status == WON: continue
+        if self.status == WON: return
+
+        if self.status == SCORE: self.score += 1
+        if self.status == POWER: self.score += 5
+        if self.status == EAT: self.score += 10
+
+        # update enemies
+        if self.counter % self.enemy_frame == 0:
+
+            # chase down the player
+            with prof.phase('enemies'):
+                if degraded:
+                    enemy_moves = [self.last_moves.get(enemy_id, (0, 0)) for enemy_id in enemy_ids]
+                else:
+                    enemy_moves = self.plan_agents(player.pos, [enemy.pos for enemy in enemies])
+                    self.last_moves.update(zip(enemy_ids, enemy_moves))
+            self.record(enemy_moves)
+            for enemy_id, enemy_move in zip(enemy_ids, enemy_moves):
+                with prof.phase('update'):
+                    enemy_status = self.map.update_map(enemy_id, enemy_move)
 
-            if self.status == SCORE: self.score += 1
-            if self.status == POWER: self.score += 5
-            if self.status == EAT: self.score += 10
+                if enemy_status == LOST:
+                    self.status = LOST
+                    break
 
-            # update enemies
-            if counter % self.enemy_frame == 0:
+            # send scared enemies to the house
+            scareds = []
+            scared_ids = self.map.get_entity_category('scared')
+            for scared_id in scared_ids:
+                scareds.append(self.map.entities[scared_id])
 
-                for enemy_id, enemy in zip(enemy_ids, enemies):
-                    # chase down the player
-                    path_to_player = path_to_prize(enemy.pos, player.pos, self.map)[1:]
-                    if path_to_player:
-                        enemy_move = path_to_player[0]
+            if scareds:
+                with prof.phase('scared'):
+                    if degraded:
+                        scared_moves = [self.last_moves.get(scared_id, (0, 0)) for scared_id in scared_ids]
                     else:
-                        enemy_move = (0, 0)
-                    enemy_status = self.map.update_map(enemy_id, enemy_move)
-
-                    if enemy_status == LOST:
-                        self.status = LOST
-                        break
-
-                # send scared enemies to the house
-                scareds = []
-                scared_ids = self.map.get_entity_category('scared')
-                for scared_id in scared_ids:
-                    scareds.append(self.map.entities[scared_id])
-
-                for scared_id, scared in zip(scared_ids, scareds):
-                    house = self.map.get_house()
-                    path_to_house = path_to_prize(scared.pos, house.pos, self.map, avoid_pos=[player.pos])[1:]
-                    scared_move = (0, 0)
-                    if path_to_house:
-                        scared_move = path_to_house[0]
+                        house = self.map.get_house()
+                        scared_moves = self.plan_agents(house.pos, [scared.pos for scared in scareds], avoid_pos=[player.pos])
+                        self.last_moves.update(zip(scared_ids, scared_moves))
+            else:
+                scared_moves = []
+            self.record(scared_moves)
+            for scared_id, scared_move in zip(scared_ids, scared_moves):
+                with prof.phase('update'):
                     scared_status = self.map.update_map(scared_id, scared_move)
 
-                    if scared_status == LOST:
-                        self.status = LOST
+                if scared_status == LOST:
+                    self.status = LOST
+
+            self.counter = 0
+
+        self.counter += 1
+
+    def finish(self, outcome):
+        """
+            Ends the game: writes the final state to the replay log, if any.
+
+            Args:
+            outcome (str): How the game ended ('won', 'lost', 'timeout' or 'stopped').
+
+            Returns:
+            dict: The result of the game (see result()).
+        """
+        if self.log is not None:
+            self.log.end(self, outcome)
+        return self.result(outcome)
 
-                    
-                counter = 0
+    def player_move(self, player_id, player, enemy_pos):
+        """
+            Chooses the target of the player and finds the first move towards it while avoiding the enemies.
 
-            counter +=1 
-            sleep(SLEEP)
+            Args:
+            player_id (str): The ID of the player.
+            player (Entity): The player.
+            enemy_pos (list of positions): The positions of the enemies.
+
+            Returns:
+            tuple: The move of the player.
+        """
+        prof = self.profiler
+        with prof.phase('target'):
+            # enemy penalty of every cell, shared by target selection and the player search
+            danger = self.map.danger_field(enemy_pos)
+
+            _, closest_prize = self.map.closest_to_eat(player_id, avoid_category='enemy', danger=danger)
+
+        # calculate path to prize while avoiding enemies
+        with prof.phase('player'):
+            if closest_prize is None: # nothing left to eat
+                move = (0, 0)
+            elif self.planner is not None:
+                start = perf_counter()
+                if HIERARCHICAL_PLAYER:
+                    move = self.planner.next_move(player.pos, closest_prize.pos, danger)
+                else: # the incremental planner only updates the costs around the enemies that moved
+                    move = self.planner.next_move(player.pos, closest_prize.pos, enemy_pos)
+                self.path_time += perf_counter() - start
+            else:
+                move = self.first_move(player.pos, closest_prize.pos, avoid_pos=enemy_pos, danger=danger, cache=self.player_cache)
+        return move
+
+    def record(self, moves):
+        """
+            Writes moves of the current frame to the replay log, if any.
+
+            Args:
+            moves (list of tuple): The moves, in the order they are applied.
+        """
+        if self.log is not None:
+            self.log.moves(moves)
+
+    def first_move(self, start_pos, end_pos, avoid_pos=None, danger=None, cache=None):
+        """
+            Finds the first move of the A* path from start_pos to end_pos (see path_to_prize, or search with SEARCH_HEURISTIC).
+
+            Args:
+            start_pos (tuple): The starting position on the map.
+            end_pos (tuple): The target position on the map.
+            avoid_pos (list of positions, optional): Positions to avoid during pathfinding.
+            danger (numpy array, optional): Danger field of the positions to avoid.
+            cache (PathCache, optional): The cache of the moves already planned.
+
+            Returns:
+            tuple: The first move, (0, 0) if already there or end_pos cannot be reached.
+        """
+        start = perf_counter()
+        move = plan_move(start_pos, end_pos, self.map, avoid_pos, danger, self.heuristic, cache=cache)
+        self.path_time += perf_counter() - start
+        return move
+
+    def plan_agents(self, target_pos, start_positions, avoid_pos=None):
+        """
+            Finds the first move towards target_pos of several agents (enemies or scared enemies).
+
+            With a distance table (PRECOMPUTE_DISTANCES) each move is a lookup, with BATCHED_AGENTS
+            all agents share one search from target_pos, otherwise each agent runs its own A* search,
+            on the planning workers with PARALLEL_AGENTS, unless its move is in the path cache. Only the
+            A* search avoids avoid_pos.
+
+            Args:
+            target_pos (tuple): The position all the agents head to.
+            start_positions (list of positions): The positions of the agents.
+            avoid_pos (list of positions, optional): Positions to avoid during pathfinding.
+
+            Returns:
+            list: The first move of each agent.
+        """
+        if self.map.distances is not None:
+            return [self.map.distances.next_move(pos, target_pos) for pos in start_positions]
+        if BATCHED_AGENTS:
+            start = perf_counter()
+            moves = first_moves(target_pos, start_positions, self.map)
+            self.path_time += perf_counter() - start
+            return moves
+        if self.parallel is not None:
+            start = perf_counter()
+            cache = self.path_cache
+            if cache is None:
+                moves = self.parallel.plan(target_pos, start_positions, avoid_pos, self.heuristic)
+            else: # only the moves not cached are sent to the workers
+                keys = [cache.key(pos, target_pos, avoid_pos) for pos in start_positions]
+                moves = [cache.get(key) for key in keys]
+                missing = [i for i, move in enumerate(moves) if move is None]
+                planned = self.parallel.plan(target_pos, [start_positions[i] for i in missing], avoid_pos, self.heuristic)
+                for i, move in zip(missing, planned):
+                    moves[i] = move
+                    cache.put(keys[i], move)
+            self.path_time += perf_counter() - start
+            return moves
+        return [self.first_move(pos, target_pos, avoid_pos=avoid_pos, cache=self.path_cache) for pos in start_positions]
+
+    def close(self):
+        """
+            Stops the planning workers, if any.
+        """
+        if self.parallel is not None:
+            self.parallel.close()
+
+    def result(self, outcome):
+        """
+            Summarizes a finished headless game.
+
+            Args:
+            outcome (str): How the game ended ('won', 'lost' or 'timeout').
+
+            Returns:
+            dict: The outcome, score, level reached, lives left, deaths, number of frames played and time spent in path_to_prize.
+        """
+        return {'outcome': outcome, 'score': self.score, 'level': self.level, 'lives': self.lives,
+                'deaths': LIVES - self.lives, 'ticks': self.ticks, 'path_time': self.path_time}
 
 
     def print_map(self, stdscr=None, opt='', offset=0):
@@ -153,33 +403,52 @@ class Game:
             opt (str): Additional string to display (optional).
             offset (int): Offset for the map display (optional).
         """
-        if stdscr:
-            stdscr.clear()
-            stdscr.addstr(0, 0, opt)
-            for y, line in enumerate(self.map.map):
-                line_str = ''.join(line) if isinstance(line, np.ndarray) else line
-                stdscr.addstr(y + offset, 0, line_str)
-            stdscr.addstr(y + offset + 1, 0, f'LEVEL: {self.level} \t SCORE: {self.score} \t {self.lives}UP')
-            stdscr.refresh()
-        else:
-            for line in self.map.map:
-                print(''.join(line))
-            print(f'LEVEL: {self.level} \t SCORE: {self.score} \t {self.lives}UP')
+        if self.renderer is None:
+            self.renderer = CursesRenderer(stdscr) if stdscr else AnsiRenderer()
+        self.renderer.draw(self.map, self.status_line(), opt, offset)
+
+    def status_line(self):
+        """
+            Gets the status line displayed below the map.
+        """
+        return f'LEVEL: {self.level} \t SCORE: {self.score} \t {self.lives}UP'
 
     def load(self):
         """
             Loads the current level map and initializes entities.
         """
         map_path = Path(self.map_folder, self.levels[self.level - 1])
-        self.map = Map(map_path)
-        self.map.add_entity('player', '@')
-        self.map.add_entity('house', 'H')
-        for _ in range(N_ENEMIES):
-            self.map.add_entity('enemy', '#')
-        for _ in range(N_PRIZES):
-            self.map.add_entity('prize', '.')
-        for _ in range(N_POWERS):
-            self.map.add_entity('power', 'O')
+        if self.headless or self.log is not None: # power mode lasts a number of frames instead of seconds
+            self.map = Map(map_path, clock=lambda: self.ticks, dur=POWER_TICKS, rng=self.rng)
+        else:
+            self.map = Map(map_path, rng=self.rng)
+        if PRECOMPUTE_DISTANCES:
+            self.map.distances = DistanceTable.load(map_path, self.map.walkable)
+        self.heuristic = HEURISTICS[SEARCH_HEURISTIC](self.map) if SEARCH_HEURISTIC else None
+        for cache in (self.path_cache, self.player_cache): # the moves depend on the walls of the level
+            if cache is not None:
+                cache.clear()
+        if self.parallel is not None:
+            self.parallel.set_map(self.map, SEARCH_HEURISTIC)
+        self.counts = entity_counts(map_path)
+        self.empty_level = self.map.snapshot()
+        self.last_moves = {}
+        self.map.add_entities(**self.counts)
+        if HIERARCHICAL_PLAYER:
+            self.planner = HierarchicalPlanner(self.map)
+        else:
+            self.planner = IncrementalPlanner(self.map) if INCREMENTAL_PLAYER else None
+
+    def respawn(self):
+        """
+            Restarts the current level after a lost life: the level is restored from memory
+            and the entities are placed again at random.
+        """
+        self.map.restore(self.empty_level)
+        self.map.add_entities(**self.counts)
+        self.last_moves = {}
+        if not HIERARCHICAL_PLAYER: # the abstract graph only depends on the walls
+            self.planner = IncrementalPlanner(self.map) if INCREMENTAL_PLAYER else None
 
     def game_over(self, stdscr=None):
         """
@@ -209,8 +478,52 @@ class Game:
 
 
 if __name__ == '__main__':
-    game = Game('maps/levels')
-    if CURSES == False:
-        game.a_star()
-    else:
-        curses.wrapper(game.a_star)
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Pac-Man A*-based game solver')
+    parser.add_argument('--headless', action='store_true', default=HEADLESS, help='run as fast as possible without display')
+    parser.add_argument('--max-ticks', type=int, default=HEADLESS_MAX_TICKS, help='stop a headless game after this many frames (0 for no limit)')
+    parser.add_argument('--seed', type=int, default=None, help='seed of the entity placement')
+    parser.add_argument('--maps', default='maps/levels', help='folder containing the levels')
+    parser.add_argument('--profile', action='store_true', default=PROFILE, help='time the phases of each frame')
+    parser.add_argument('--trace', default=None, help='write a Chrome trace of the frames to this file')
+    parser.add_argument('--record', default=None, help='append a replay log of the game to this file (see replay.py)')
+    args = parser.parse_args()
+
+    rng = log = None
+    if args.record:
+        from replay import ReplayWriter
+
+        seed = args.seed if args.seed is not None else int.from_bytes(os.urandom(4), 'little')
+        rng = np.random.RandomState(seed)
+        log = ReplayWriter(args.record, seed)
+    elif args.seed is not None:
+        np.random.seed(args.seed)
+
+    profiler = Profiler(enabled=args.profile or args.trace is not None, trace=args.trace is not None)
+    game = Game(args.maps, headless=args.headless, max_ticks=args.max_ticks or None, rng=rng, profiler=profiler, log=log)
+    try:
+        if game.headless:
+            print(game.a_star())
+        elif CURSES == False:
+            game.a_star()
+        else:
+            curses.wrapper(game.a_star)
+    except KeyboardInterrupt: # the end screens wait forever
+        pass
+    finally:
+        game.close()
+        if log is not None:
+            if not log.ended:
+                game.finish('stopped')
+            log.close()
+        if profiler.enabled:
+            print(profiler.report())
+            if game.path_cache is not None:
+                print('path cache:', game.path_cache.stats())
+            if game.player_cache is not None:
+                print('player cache:', game.player_cache.stats())
+        if game.scheduler is not None and game.scheduler.overruns:
+            print(game.scheduler.summary())
+        if args.trace:
+            profiler.dump_trace(args.trace)
@@ -0,0 +1,223 @@
+import os
+import sys
+import sysconfig
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from config import *
+import pathfinding
+from pathfinding import plan_move
+from heuristics import HEURISTICS
+from map import Map
+
+# layout arrays read by the searches, copied to shared memory
+ARRAYS = ('walkable', 'adj_offsets', 'adj_cells', 'adj_moves')
+
+def free_threaded():
+    """
+        Whether the interpreter runs Python threads in parallel (free-threaded build with the GIL disabled).
+    """
+    return bool(sysconfig.get_config_var('Py_GIL_DISABLED')) and not getattr(sys, '_is_gil_enabled', lambda: True)()
+
+def share_layout(map):
+    """
+        Copies the layout arrays of a map read by the searches to a new shared memory block.
+
+        Args:
+        map (Map): The map.
+
+        Returns:
+        tuple: The block (to unlink when the level is over) and its spec, what workers need to attach it.
+    """
+    arrays = [np.ascontiguousarray(getattr(map, name)) for name in ARRAYS]
+    block = shared_memory.SharedMemory(create=True, size=max(sum(a.nbytes for a in arrays), 1))
+    layout = []
+    offset = 0
+    for name, array in zip(ARRAYS, arrays):
+        np.ndarray(array.shape, array.dtype, buffer=block.buf, offset=offset)[...] = array
+        layout.append((name, array.shape, array.dtype.str, offset))
+        offset += array.nbytes
+    spec = {'name': block.name, 'width': map.width, 'height': map.height, 'layout': layout}
+    block.close() # the parent does not read it
+    return block, spec
+
+class SharedLayout():
+    """
+        The layout of a level as the searches read it, from a shared memory block, in a worker process.
+        The arrays are read-only: every search of a frame sees the same map.
+
+        Attributes:
+        width (int): The width of the map.
+        height (int): The height of the map.
+        walkable, adj_offsets, adj_cells, adj_moves (numpy array): As in Map.
+        distances (DistanceTable): Always None, the searches compute what they need.
+        heuristics (dict): The heuristics of the searches built on this layout, by name.
+    """
+    danger_field = Map.danger_field
+
+    def __init__(self, spec):
+        try:
+            self.block = shared_memory.SharedMemory(name=spec['name'], track=False)
+        except TypeError: # before Python 3.13: registered again with the resource tracker shared with the game
+            self.block = shared_memory.SharedMemory(name=spec['name'])
+        self.width = spec['width']
+        self.height = spec['height']
+        for name, shape, dtype, offset in spec['layout']:
+            array = np.ndarray(tuple(shape), np.dtype(dtype), buffer=self.block.buf, offset=offset)
+            array.setflags(write=False)
+            setattr(self, name, array)
+        self.distances = None
+        self.heuristics = {}
+
+    def close(self):
+        for name in ARRAYS:
+            delattr(self, name)
+        self.heuristics.clear()
+        self.block.close()
+
+# layout of the current level in a worker process
+layouts = {}
+
+def attach(spec):
+    """
+        Gets the layout of a level in a worker process, attaching its block on the first call.
+
+        Args:
+        spec (dict): The spec returned by share_layout.
+
+        Returns:
+        SharedLayout: The layout.
+    """
+    layout = layouts.get(spec['name'])
+    if layout is None:
+        for old in list(layouts): # levels are played one after the other
+            layouts.pop(old).close()
+        layout = layouts[spec['name']] = SharedLayout(spec)
+    return layout
+
+def plan_chunk(map, target_pos, start_positions, avoid_pos, heuristic, weight):
+    """
+        Plans the first moves of some agents towards the same target, in a worker.
+
+        Args:
+        map (Map or dict): The map (thread workers), or the spec of its shared layout (process workers).
+        target_pos (tuple): The position the agents head to.
+        start_positions (list of positions): The positions of the agents.
+        avoid_pos (list of positions): Positions to avoid during pathfinding.
+        heuristic (Heuristic or str): The heuristic of the searches, or its name in a process worker (None for path_to_prize).
+        weight (float): Weight of the heuristic.
+
+        Returns:
+        tuple: The moves, and the number of searches run and nodes expanded by the worker for them.
+    """
+    if isinstance(map, dict):
+        map = attach(map)
+        if heuristic is not None:
+            if heuristic not in map.heuristics:
+                map.heuristics[heuristic] = HEURISTICS[heuristic](map)
+            heuristic = map.heuristics[heuristic]
+    counters = pathfinding.counters # those of the worker thread or process
+    searches, expanded = counters['searches'], counters['expanded']
+    danger = map.danger_field(avoid_pos) if avoid_pos else None # shared by the searches of the chunk
+    moves = [plan_move(pos, target_pos, map, danger=danger, heuristic=heuristic, weight=weight) for pos in start_positions]
+    return moves, counters['searches'] - searches, counters['expanded'] - expanded
+
+class ParallelPlanner():
+    """
+        A class to plan the moves of several agents at once on a pool of workers.
+
+        The searches of the agents of a frame only read the walls of the level and the positions of the
+        agents, so they are independent. Each worker plans a contiguous chunk of the agents and the moves
+        are returned in the order of the agents, so that the game applies them in the usual order and
+        plays exactly as with sequential planning.
+
+        The searches hold the GIL, so by default the workers are processes, and the layout of each level
+        is copied once to a shared memory block that they attach read-only. On a free-threaded build of
+        Python, the workers are threads reading the map directly.
+
+        Attributes:
+        kind (str): 'process' or 'thread'.
+        workers (int): Number of workers.
+        executor (Executor): The pool.
+        spec (dict): The shared layout of the current level (process workers).
+
+        Methods:
+        __init__(workers, kind): Starts the pool.
+        set_map(map, heuristic): Moves on to a new level.
+        plan(target_pos, start_positions, avoid_pos): Plans the first moves of several agents.
+        close(): Stops the pool and frees the shared layout.
+    """
+    def __init__(self, workers=PLANNING_WORKERS, kind=PLANNING_POOL):
+        """
+            Starts the pool.
+
+            Args:
+            workers (int, optional): Number of workers, the number of CPUs by default.
+            kind (str, optional): 'process', 'thread', or 'auto' for threads on free-threaded builds only.
+        """
+        self.kind = kind if kind != 'auto' else 'thread' if free_threaded() else 'process'
+        self.workers = workers or os.cpu_count()
+        pool = ThreadPoolExecutor if self.kind == 'thread' else ProcessPoolExecutor
+        self.executor = pool(max_workers=self.workers)
+        self.map = None
+        self.heuristic = None
+        self.block = None
+        self.spec = None
+
+    def set_map(self, map, heuristic=None):
+        """
+            Moves on to a new level.
+
+            Args:
+            map (Map): The map of the level.
+            heuristic (str, optional): Name of the heuristic of the searches (see HEURISTICS), None for path_to_prize.
+        """
+        self.map = map
+        self.heuristic = heuristic
+        if self.kind == 'process':
+            self.release()
+            self.block, self.spec = share_layout(map)
+
+    def plan(self, target_pos, start_positions, avoid_pos=None, heuristic=None):
+        """
+            Plans the first moves of several agents towards the same target.
+
+            Args:
+            target_pos (tuple): The position all the agents head to.
+            start_positions (list of positions): The positions of the agents.
+            avoid_pos (list of positions, optional): Positions to avoid during pathfinding.
+            heuristic (Heuristic, optional): The heuristic of the level, used by thread workers.
+
+            Returns:
+            list: The first move of each agent.
+        """
+        if not start_positions:
+            return []
+        if self.kind == 'process':
+            map, heuristic = self.spec, self.heuristic
+        else:
+            map = self.map
+        size = -(-len(start_positions) // self.workers)
+        futures = [self.executor.submit(plan_chunk, map, target_pos, start_positions[i:i + size], avoid_pos, heuristic, SEARCH_WEIGHT)
+                   for i in range(0, len(start_positions), size)]
+        moves = []
+        for future in futures: # the workers count in their own thread or process
+            chunk, searches, expanded = future.result()
+            moves += chunk
+            pathfinding.counters['searches'] += searches
+            pathfinding.counters['expanded'] += expanded
+        return moves
+
+    def release(self):
+        if self.block is not None:
+            self.block.unlink()
+            self.block = self.spec = None
+
+    def close(self):
+        """
+            Stops the pool and frees the shared layout.
+        """
+        self.executor.shutdown()
+        self.release()
@@ -1,6 +1,42 @@
+import heapq
+import sys
+import threading
+from collections import OrderedDict
+from itertools import count
+
+import numpy as np
+
 from config import *
+from heuristics import Manhattan, DangerCost
+
+class Counters():
+    """
+        Counters read and incremented like a dict, with separate values in each thread, so that searches
+        run by worker threads (see parallel.py) never update them concurrently. A planner adds the counts
+        of its workers to the counters of the thread that called it.
+    """
+    def __init__(self, *names):
+        self.names = names
+        self.local = threading.local()
+
+    def values(self):
+        values = getattr(self.local, 'values', None)
+        if values is None:
+            values = self.local.values = dict.fromkeys(self.names, 0)
+        return values
+
+    def __getitem__(self, name):
+        return self.values()[name]
+
+    def __setitem__(self, name, value):
+        self.values()[name] = value
+
+# number of searches run and of nodes expanded by path_to_prize, for benchmarks
+counters = Counters('searches', 'expanded')
 
 class Node():
+    __slots__ = ('parent', 'pos', 'move', 'g', 'h', 'f')
+
     def __init__(self, parent=None, pos=None, move=None):
         self.parent = parent
         self.pos = pos
@@ -17,8 +53,397 @@ class Node():
     def __eq__(self, other):
         return self.pos == other.pos
 
-def path_to_prize(start_pos, end_pos, map, avoid_pos=None):
+def path_to_prize(start_pos, end_pos, map, avoid_pos=None, danger=None):
+    """
+        Find the path from start_pos to end_pos on the map, avoiding positions in list avoid_pos if provided.
+
+        Heap-based A*: the open list is a binary heap with lazy deletion, closed cells are kept in a set
+        and only the best g found so far for each cell is pushed. Ties on f are broken by insertion order,
+        so the moves are the same as the ones returned by legacy_path_to_prize. Cells are flat integer
+        IDs and their neighbours are read from the map's CSR adjacency (see Map.csr_adjacency).
+
+        Args:
+        start_pos (tuple): The starting position on the map.
+        end_pos (tuple): The target position on the map.
+        map (Map): The map object containing the layout.
+        avoid_pos (list of positions, optional): Positions to avoid during pathfinding.
+        danger (numpy array, optional): Danger field of the positions to avoid (see Map.danger_field),
+            built from avoid_pos if not provided.
+
+        Returns:
+        list: A list of moves representing the path from start_pos to end_pos.
+    """
+    width = map.width
+    offsets, adjacent, adjacent_moves = map.adj_offsets, map.adj_cells, map.adj_moves
+    end_x, end_y = end_pos
+    start = start_pos[1] * width + start_pos[0]
+    end = end_y * width + end_x
+    if danger is None and avoid_pos:
+        danger = map.danger_field(avoid_pos)
+    if danger is not None:
+        danger = danger.ravel()
+
+    # cells are flat IDs, entries are (f, insertion order, cell); the first entry of a cell
+    # popped is the last one pushed, so its g is best_g[cell]
+    open_heap = [(0, 0, start)]
+    closed = set()
+    best_g = {start: 0}
+    parent = {start: None} # cell -> index in MOVES of the move reaching it
+    steps = [dy * width + dx for dx, dy in MOVES]
+    tie = count(1)
+    counters['searches'] += 1
+
+    while open_heap:
+        _, _, cell = heapq.heappop(open_heap)
+        if cell in closed: # stale entry
+            continue
+        closed.add(cell)
+
+        if cell == end:
+            counters['expanded'] += len(closed)
+            path = []
+            while parent[cell] is not None:
+                k = parent[cell]
+                path.append(MOVES[k])
+                cell -= steps[k]
+            path.append(None)
+            return path[::-1]
+
+        g = best_g[cell] + 1
+        for j in range(offsets.item(cell), offsets.item(cell + 1)):
+            child = adjacent.item(j)
+            if child in closed or best_g.get(child, g + 1) <= g:
+                continue
+            best_g[child] = g
+            parent[child] = adjacent_moves.item(j)
+
+            ny, nx = divmod(child, width)
+            h = ((nx - end_x) ** 2) + ((ny - end_y) ** 2)
+            if danger is not None:
+                h += danger.item(child)
+            heapq.heappush(open_heap, (g + h, next(tie), child))
+
+    counters['expanded'] += len(closed)
+
+def search(start_pos, end_pos, map, heuristic=None, cost=None, weight=1):
+    """
+        Find the cheapest path from start_pos to end_pos with A*, given a heuristic and a cost model.
+
+        The search engine is the one of path_to_prize, but the estimate of the cost left and the cost
+        of each move are pluggable (see heuristics.py). With an admissible heuristic and weight 1, the
+        path is a cheapest one. With weight w > 1 (weighted A*, f = g + w * h), the search expands
+        fewer cells and the path costs at most w times the cheapest one.
+
+        Args:
+        start_pos (tuple): The starting position on the map.
+        end_pos (tuple): The target position on the map.
+        map (Map): The map object containing the layout.
+        heuristic (Heuristic, optional): Estimates the cost left, Manhattan distance by default.
+        cost (callable, optional): The cost of moving into a cell (flat ID), e.g. DangerCost, 1 by default.
+        weight (float, optional): Weight of the heuristic.
+
+        Returns:
+        list: A list of moves representing the path from start_pos to end_pos, as path_to_prize.
+    """
+    width = map.width
+    offsets, adjacent, adjacent_moves = map.adj_offsets, map.adj_cells, map.adj_moves
+    start = start_pos[1] * width + start_pos[0]
+    end = end_pos[1] * width + end_pos[0]
+    estimate = (heuristic if heuristic is not None else Manhattan(map)).to(end)
+
+    open_heap = [(0, 0, start)]
+    closed = set()
+    best_g = {start: 0}
+    parent = {start: None}
+    steps = [dy * width + dx for dx, dy in MOVES]
+    tie = count(1)
+    counters['searches'] += 1
+
+    while open_heap:
+        _, _, cell = heapq.heappop(open_heap)
+        if cell in closed:
+            continue
+        closed.add(cell)
+
+        if cell == end:
+            counters['expanded'] += len(closed)
+            path = []
+            while parent[cell] is not None:
+                k = parent[cell]
+                path.append(MOVES[k])
+                cell -= steps[k]
+            path.append(None)
+            return path[::-1]
+
+        g_cell = best_g[cell]
+        for j in range(offsets.item(cell), offsets.item(cell + 1)):
+            child = adjacent.item(j)
+            if child in closed:
+                continue
+            g = g_cell + (cost(child) if cost is not None else 1)
+            if best_g.get(child, g + 1) <= g:
+                continue
+            best_g[child] = g
+            parent[child] = adjacent_moves.item(j)
+            heapq.heappush(open_heap, (g + weight * estimate(child), next(tie), child))
+
+    counters['expanded'] += len(closed)
+
+def path_cost(start_pos, path, map, cost=None):
+    """
+        Computes the cost of a path returned by search or path_to_prize.
+
+        Args:
+        start_pos (tuple): The starting position of the path.
+        path (list): The moves of the path.
+        map (Map): The map object containing the layout.
+        cost (callable, optional): The cost of moving into a cell (flat ID), 1 by default.
+
+        Returns:
+        float: The sum of the costs of the moves.
+    """
+    x, y = start_pos
+    total = 0
+    for dx, dy in path[1:]:
+        x, y = x + dx, y + dy
+        total += cost(y * map.width + x) if cost is not None else 1
+    return total
+
+def distance_field(target_pos, map, goals=None):
+    """
+        Breadth-first search from target_pos: the number of moves from every reachable cell to target_pos.
+
+        Args:
+        target_pos (tuple): The position the distances are measured to.
+        map (Map): The map object containing the layout.
+        goals (list of positions, optional): Stop as soon as all these positions are reached.
+
+        Returns:
+        dict: The distance of each reached cell, keyed by flat cell ID (y * width + x).
     """
+    width = map.width
+    offsets, adjacent = map.adj_offsets, map.adj_cells
+    target = target_pos[1] * width + target_pos[0]
+    field = {target: 0}
+    remaining = {y * width + x for x, y in goals} - {target} if goals is not None else None
+    frontier = [target]
+    d = 0
+    while frontier and remaining != set():
+        d += 1
+        next_frontier = []
+        for cell in frontier:
+            for j in range(offsets.item(cell), offsets.item(cell + 1)):
+                child = adjacent.item(j)
+                if child not in field:
+                    field[child] = d
+                    next_frontier.append(child)
+                    if remaining:
+                        remaining.discard(child)
+        frontier = next_frontier
+    counters['searches'] += 1
+    counters['expanded'] += len(field)
+    return field
+
+class PathCache():
+    """
+        A bounded LRU cache of the first moves found by plan_move, keyed by the start, the target and the
+        positions to avoid. Scared enemies all head to the house and enemies often ask for the same
+        (position, player position) pair from one frame to the next, so many searches repeat.
+
+        The moves only depend on the walls of the level besides the key, so the cache is cleared when a
+        level is loaded. With quantum 1 the positions to avoid are kept as they are, and a cached move is
+        the one the search would return. With a larger quantum, they are rounded down to squares of
+        quantum by quantum cells: more queries share an entry, but the move is the one of the first query.
+
+        Attributes:
+        max_bytes (int): Memory limit of the entries, estimated from the size of their keys.
+        quantum (int): Size of the squares the positions to avoid are rounded to.
+        entries (OrderedDict): The cached moves by key, least recently used first.
+        sizes (dict): The estimated memory of each entry, by key, subtracted when it is evicted.
+        bytes (int): Estimated memory used by the entries.
+        hits, misses, evictions, invalidations (int): Counters, kept across levels.
+
+        Methods:
+        __init__(max_bytes, quantum): Creates an empty cache.
+        key(start_pos, end_pos, avoid_pos): Builds the key of a query.
+        get(key): Gets a cached move.
+        put(key, move): Caches a move, evicting the least recently used ones over the memory limit.
+        clear(): Invalidates every entry, when a level is loaded.
+        stats(): Gets the counters and the size of the cache.
+    """
+    # memory of an entry besides its key: the OrderedDict link and hash table slot
+    ENTRY_OVERHEAD = 100
+
+    def __init__(self, max_bytes=PATH_CACHE_BYTES, quantum=PATH_CACHE_QUANTUM):
+        """
+            Creates an empty cache.
+
+            Args:
+            max_bytes (int, optional): Memory limit of the entries, in bytes.
+            quantum (int, optional): Size of the squares the positions to avoid are rounded to.
+        """
+        self.max_bytes = max_bytes
+        self.quantum = quantum
+        self.entries = OrderedDict()
+        self.sizes = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def key(self, start_pos, end_pos, avoid_pos=None):
+        """
+            Builds the key of a query.
+
+            Args:
+            start_pos (tuple): The starting position.
+            end_pos (tuple): The target position.
+            avoid_pos (list of positions, optional): Positions to avoid during pathfinding.
+
+            Returns:
+            tuple: The key.
+        """
+        if not avoid_pos:
+            avoid = ()
+        elif self.quantum == 1:
+            avoid = tuple((int(x), int(y)) for x, y in avoid_pos) # in order, as the danger field sums them
+        else:
+            q = self.quantum
+            avoid = tuple(sorted({(int(x) // q, int(y) // q) for x, y in avoid_pos}))
+        return (int(start_pos[0]), int(start_pos[1])), (int(end_pos[0]), int(end_pos[1])), avoid
+
+    def get(self, key):
+        """
+            Gets a cached move, marking it as the most recently used.
+
+            Args:
+            key (tuple): The key of the query.
+
+            Returns:
+            tuple: The move, None if not cached.
+        """
+        move = self.entries.get(key)
+        if move is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return move
+
+    def put(self, key, move):
+        """
+            Caches a move, evicting the least recently used ones over the memory limit.
+
+            Args:
+            key (tuple): The key of the query.
+            move (tuple): The move.
+        """
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return
+        size = self.ENTRY_OVERHEAD + sys.getsizeof(key) + sum(sys.getsizeof(part) for part in key) + 16 * len(key[2])
+        if size > self.max_bytes:
+            return
+        self.entries[key] = move
+        self.sizes[key] = size
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            old, _ = self.entries.popitem(last=False)
+            self.bytes -= self.sizes.pop(old)
+            self.evictions += 1
+
+    def clear(self):
+        """
+            Invalidates every entry, when a level is loaded.
+        """
+        if self.entries:
+            self.invalidations += 1
+        self.entries.clear()
+        self.sizes.clear()
+        self.bytes = 0
+
+    def stats(self):
+        """
+            Gets the counters and the size of the cache.
+
+            Returns:
+            dict: The hits, misses, evictions, invalidations, hit rate, number of entries and estimated bytes.
+        """
+        queries = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'invalidations': self.invalidations, 'hit_rate': self.hits / queries if queries else 0.0,
+                'entries': len(self.entries), 'bytes': self.bytes}
+
+def plan_move(start_pos, end_pos, map, avoid_pos=None, danger=None, heuristic=None, weight=SEARCH_WEIGHT, cache=None):
+    """
+        Finds the first move of a path from start_pos to end_pos: with path_to_prize, or with search if a
+        heuristic is given, the danger then counting as a move cost. The danger must be the one of avoid_pos
+        when a cache is given.
+
+        Args:
+        start_pos (tuple): The starting position on the map.
+        end_pos (tuple): The target position on the map.
+        map (Map): The map object containing the layout.
+        avoid_pos (list of positions, optional): Positions to avoid during pathfinding.
+        danger (numpy array, optional): Danger field of the positions to avoid, built from avoid_pos if not provided.
+        heuristic (Heuristic, optional): The heuristic of search.
+        weight (float, optional): Weight of the heuristic of search.
+        cache (PathCache, optional): Moves already planned on this level, checked before searching.
+
+        Returns:
+        tuple: The first move, (0, 0) if already there or end_pos cannot be reached.
+    """
+    if cache is not None:
+        key = cache.key(start_pos, end_pos, avoid_pos)
+        move = cache.get(key)
+        if move is None:
+            move = plan_move(start_pos, end_pos, map, avoid_pos, danger, heuristic, weight)
+            cache.put(key, move)
+        return move
+    if heuristic is not None:
+        if danger is None and avoid_pos:
+            danger = map.danger_field(avoid_pos)
+        cost = DangerCost(danger) if danger is not None else None
+        path = search(start_pos, end_pos, map, heuristic, cost, weight)
+    else:
+        path = path_to_prize(start_pos, end_pos, map, avoid_pos=avoid_pos, danger=danger)
+    if path and len(path) > 1: # only use first move of the provided path
+        return path[1]
+    return (0, 0)
+
+def first_moves(target_pos, start_positions, map):
+    """
+        Find the first move of a shortest path to target_pos for several agents with a single search
+        from target_pos (see distance_field), instead of one search per agent.
+
+        Args:
+        target_pos (tuple): The position all the agents head to.
+        start_positions (list of positions): The positions of the agents.
+        map (Map): The map object containing the layout.
+
+        Returns:
+        list: The first move of each agent, (0, 0) if already there or target_pos cannot be reached.
+    """
+    field = distance_field(target_pos, map, goals=start_positions)
+    width = map.width
+    offsets, adjacent, adjacent_moves = map.adj_offsets, map.adj_cells, map.adj_moves
+    moves = []
+    for x, y in start_positions:
+        cell = y * width + x
+        d = field.get(cell)
+        best = (0, 0)
+        if d:
+            for j in range(offsets.item(cell), offsets.item(cell + 1)):
+                if field.get(adjacent.item(j)) == d - 1:
+                    best = MOVES[adjacent_moves.item(j)]
+                    break
+        moves.append(best)
+    return moves
+
+def legacy_path_to_prize(start_pos, end_pos, map, avoid_pos=None):
+    """
+        Reference list-based A*, kept to check path_to_prize against (see regression()).
         Find the path from start_pos to end_pos on the map, avoiding positions in list avoid_pos if provided.
         
         Args:
@@ -120,16 +545,71 @@ def adjacent_nodes(node, map): # could pass only adjacent cases
     width = map.width
     nodes = []
     x, y = node.pos[0], node.pos[1]
-    if x > 0 and map.map[y, x-1] != '%':
+    if x > 0 and map.cells[y, x-1] != WALL:
         nodes.append(Node(parent=node, pos=(x-1, y), move=(-1, 0)))
 
-    if x < width and map.map[y, x+1] != '%':
+    if x + 1 < width and map.cells[y, x+1] != WALL:
         nodes.append(Node(parent=node, pos=(x+1, y), move=(1, 0)))
 
-    if y > 0 and map.map[y-1, x] != '%':
+    if y > 0 and map.cells[y-1, x] != WALL:
         nodes.append(Node(parent=node, pos=(x, y-1), move=(0, -1)))
 
-    if y < height and map.map[y+1, x] != '%':
+    if y + 1 < height and map.cells[y+1, x] != WALL:
         nodes.append(Node(parent=node, pos=(x, y+1), move=(0, 1)))
 
     return nodes
+
+
+def regression(map_folders=('maps/levels', 'maps/test_maps'), n_queries=50, seed=0):
+    """
+        Check that path_to_prize returns the same moves as legacy_path_to_prize on every map.
+
+        Args:
+        map_folders (tuple of str): Folders containing the maps to check.
+        n_queries (int): Number of random (start, end, avoid_pos) queries per map.
+        seed (int): Seed of the random generator drawing the queries.
+
+        Returns:
+        int: Number of queries where both implementations disagree.
+    """
+    from pathlib import Path
+    from map import Map, map_files
+
+    rng = np.random.default_rng(seed)
+    mismatches = 0
+    for folder in map_folders:
+        for name in map_files(folder):
+            failed = check_map(Map(Path(folder, name)), rng, n_queries)
+            print(f'{Path(folder, name)}: {n_queries - failed}/{n_queries} identical')
+            mismatches += failed
+    return mismatches
+
+def check_map(map, rng, n_queries=50):
+    """
+        Compares path_to_prize with legacy_path_to_prize on random queries on one map (see regression()).
+
+        Args:
+        map (Map): The map.
+        rng (numpy Generator): Draws the (start, end, avoid_pos) queries.
+        n_queries (int): Number of queries.
+
+        Returns:
+        int: Number of queries where both implementations disagree.
+    """
+    ys, xs = np.nonzero(map.walkable)
+    cells = [(int(x), int(y)) for x, y in zip(xs, ys)]
+    failed = 0
+    for _ in range(n_queries):
+        start, end = (cells[i] for i in rng.integers(len(cells), size=2))
+        n_avoid = int(rng.integers(0, N_ENEMIES + 1))
+        avoid_pos = [cells[i] for i in rng.integers(len(cells), size=n_avoid)] or None
+        expected = legacy_path_to_prize(start, end, map, avoid_pos=avoid_pos)
+        if path_to_prize(start, end, map, avoid_pos=avoid_pos) != expected:
+            failed += 1
+    return failed
+
+
+if __name__ == '__main__':
+    import sys
+
+    sys.exit(1 if regression() else 0)
@@ -0,0 +1,147 @@
+import json
+from contextlib import nullcontext
+from time import perf_counter
+
+import numpy as np
+
+from config import *
+import pathfinding
+import targets
+
+NO_PHASE = nullcontext() # shared by all phases when profiling is disabled
+
+class Phase():
+    """
+        A context manager timing one phase of a frame.
+    """
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, self.start, perf_counter())
+
+class Profiler():
+    """
+        A class to time the phases of the game loop frame by frame.
+
+        Phases are timed with `with profiler.phase(name):`. Each frame records the time of each phase,
+        the number of nodes expanded by the searches and the number of targets scanned by the target
+        selection. When disabled, phase() returns a shared no-op context manager and nothing is recorded.
+
+        Attributes:
+        enabled (bool): Whether phases are timed.
+        frames (list of dict): Time of each phase (and 'frame' for the whole frame) and counters of each frame.
+        events (list of dict): Chrome trace events, kept only if trace is True.
+
+        Methods:
+        __init__(enabled, trace): Initializes the profiler.
+        phase(name): Times a phase of the current frame.
+        begin_frame(): Ends the current frame and starts a new one.
+        end_frame(): Records the current frame.
+        summary(): Computes the percentiles of each phase.
+        report(): Formats the summary.
+        dump_trace(path): Writes the Chrome trace (chrome://tracing, Perfetto).
+    """
+    def __init__(self, enabled=PROFILE, trace=False):
+        self.enabled = enabled
+        self.trace = trace
+        self.frames = []
+        self.events = []
+        self.current = None
+        self.origin = perf_counter()
+
+    def phase(self, name):
+        """
+            Times a phase of the current frame.
+
+            Args:
+            name (str): The name of the phase.
+
+            Returns:
+            context manager: Times the code run inside it.
+        """
+        if not self.enabled:
+            return NO_PHASE
+        return Phase(self, name)
+
+    def record(self, name, start, end):
+        if self.current is None:
+            return
+        self.current[name] = self.current.get(name, 0) + end - start
+        if self.trace:
+            self.events.append({'name': name, 'ph': 'X', 'pid': 0, 'tid': 0,
+                                'ts': (start - self.origin) * 1e6, 'dur': (end - start) * 1e6})
+
+    def begin_frame(self):
+        """
+            Ends the current frame (if any) and starts a new one.
+        """
+        if not self.enabled:
+            return
+        self.end_frame()
+        self.current = {}
+        self.frame_start = perf_counter()
+        self.expanded = pathfinding.counters['expanded']
+        self.scanned = targets.counters['scanned']
+
+    def end_frame(self):
+        if self.current is None:
+            return
+        end = perf_counter()
+        self.current['frame'] = end - self.frame_start
+        self.current['expanded'] = pathfinding.counters['expanded'] - self.expanded
+        self.current['scanned'] = targets.counters['scanned'] - self.scanned
+        self.frames.append(self.current)
+        if self.trace:
+            ts = (self.frame_start - self.origin) * 1e6
+            self.events.append({'name': 'frame', 'ph': 'X', 'pid': 0, 'tid': 1, 'ts': ts, 'dur': (end - self.frame_start) * 1e6})
+            self.events.append({'name': 'counters', 'ph': 'C', 'pid': 0, 'ts': ts,
+                                'args': {'expanded': self.current['expanded'], 'scanned': self.current['scanned']}})
+        self.current = None
+
+    def summary(self):
+        """
+            Computes the mean and percentiles of each phase and counter over the frames.
+
+            Returns:
+            dict: For each phase or counter, its mean, p50, p95 and p99 (times in seconds, 0 for frames without the phase).
+        """
+        self.end_frame()
+        names = sorted({name for frame in self.frames for name in frame})
+        stats = {}
+        for name in names:
+            values = np.array([frame.get(name, 0) for frame in self.frames])
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            stats[name] = {'mean': values.mean(), 'p50': p50, 'p95': p95, 'p99': p99}
+        return stats
+
+    def report(self):
+        """
+            Formats the summary as a table, times in milliseconds.
+
+            Returns:
+            str: The table.
+        """
+        summary = self.summary() # ends the current frame, counted below
+        lines = [f'{len(self.frames)} frames', f'{"":<10}{"mean":>10}{"p50":>10}{"p95":>10}{"p99":>10}']
+        for name, stats in summary.items():
+            scale = 1 if name in ('expanded', 'scanned') else 1e3
+            lines.append(f'{name:<10}' + ''.join(f'{stats[k] * scale:>10.3f}' for k in ('mean', 'p50', 'p95', 'p99')))
+        return '\n'.join(lines)
+
+    def dump_trace(self, path):
+        """
+            Writes the Chrome trace of the recorded frames.
+
+            Args:
+            path (str): The JSON file.
+        """
+        self.end_frame()
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, f)
@@ -0,0 +1,165 @@
+import sys
+from abc import ABC, abstractmethod
+
+from config import *
+
+class Renderer(ABC):
+    """
+        A class to draw the map in the terminal, redrawing only the cells that changed.
+
+        The whole board is drawn on the first frame and whenever the map object changes (new level,
+        game over screen...). Afterwards only the cells in Map.dirty and the status line are written.
+
+        Attributes:
+        diff (bool): Draw only the changed cells, or the whole board every frame.
+        frames (int): Number of frames drawn.
+        frame_bytes (int): Number of bytes written for the last frame.
+        total_bytes (int): Number of bytes written since the renderer was created.
+
+        Methods:
+        __init__(diff): Initializes the renderer.
+        draw(map, status, opt, offset): Draws a frame.
+        full(map, status, opt, offset): Writes the whole board (abstract).
+        cells(map, positions, status, offset): Writes some cells of the board (abstract).
+    """
+    def __init__(self, diff=DIFF_RENDER):
+        self.diff = diff
+        self.frames = 0
+        self.frame_bytes = 0
+        self.total_bytes = 0
+        self.last_map = None
+
+    def draw(self, map, status, opt='', offset=0):
+        """
+            Draws a frame.
+
+            Args:
+            map (Map): The map to draw.
+            status (str): The status line displayed below the map.
+            opt (str): Additional string to display (optional).
+            offset (int): Offset for the map display (optional).
+        """
+        if not self.diff or map is not self.last_map:
+            written = self.full(map, status, opt, offset)
+        else:
+            written = self.cells(map, sorted(map.dirty), status, offset)
+        map.dirty.clear()
+        self.last_map = map
+
+        self.frames += 1
+        self.frame_bytes = written
+        self.total_bytes += written
+
+    @abstractmethod
+    def full(self, map, status, opt, offset):
+        """
+            Writes the whole board.
+
+            Args:
+            map (Map): The map to draw.
+            status (str): The status line displayed below the map.
+            opt (str): Additional string to display.
+            offset (int): Offset for the map display.
+
+            Returns:
+            int: Number of bytes written.
+        """
+
+    @abstractmethod
+    def cells(self, map, positions, status, offset):
+        """
+            Writes some cells of the board and the status line.
+
+            Args:
+            map (Map): The map to draw.
+            positions (list): The (x, y) positions of the cells to write.
+            status (str): The status line displayed below the map.
+            offset (int): Offset for the map display.
+
+            Returns:
+            int: Number of bytes written.
+        """
+
+class CursesRenderer(Renderer):
+    """
+        A renderer writing to a curses window. Byte counts are the characters handed to curses.
+    """
+    def __init__(self, stdscr, diff=DIFF_RENDER):
+        super().__init__(diff)
+        self.stdscr = stdscr
+
+    def full(self, map, status, opt, offset):
+        self.stdscr.clear()
+        self.stdscr.addstr(0, 0, opt)
+        written = len(opt)
+        for y, line in enumerate(map.rows()):
+            self.stdscr.addstr(y + offset, 0, line)
+            written += len(line)
+        self.stdscr.addstr(map.height + offset, 0, status)
+        self.stdscr.clrtoeol()
+        self.stdscr.refresh()
+        return written + len(status)
+
+    def cells(self, map, positions, status, offset):
+        for x, y in positions:
+            self.stdscr.addch(y + offset, x, map.symbol(x, y))
+        self.stdscr.addstr(map.height + offset, 0, status)
+        self.stdscr.clrtoeol()
+        self.stdscr.refresh()
+        return len(positions) + len(status)
+
+class AnsiRenderer(Renderer):
+    """
+        A renderer writing ANSI escape sequences to a text stream (stdout by default),
+        moving the cursor to each changed cell.
+    """
+    def __init__(self, stream=None, diff=DIFF_RENDER):
+        super().__init__(diff)
+        self.stream = stream if stream is not None else sys.stdout
+
+    def full(self, map, status, opt, offset):
+        lines = map.rows()
+        if self.diff:
+            # clear the screen once, later frames are drawn over it
+            out = f'\x1b[2J\x1b[H{opt}\x1b[{offset + 1};1H' + '\n'.join(lines) + f'\n{status}\x1b[K\n'
+        else:
+            out = '\n'.join(lines) + f'\n{status}\n'
+        return self.write(out)
+
+    def cells(self, map, positions, status, offset):
+        out = [f'\x1b[{y + offset + 1};{x + 1}H{map.symbol(x, y)}' for x, y in positions]
+        out.append(f'\x1b[{map.height + offset + 1};1H{status}\x1b[K\n')
+        return self.write(''.join(out))
+
+    def write(self, out):
+        """
+            Writes a frame to the stream.
+
+            Args:
+            out (str): The frame.
+
+            Returns:
+            int: Number of bytes written.
+        """
+        self.stream.write(out)
+        self.stream.flush()
+        return len(out.encode())
+
+class MessageRenderer(Renderer):
+    """
+        A renderer building frame messages for the game server (server.py) instead of drawing them.
+        The last frame is kept in message: the whole board ('full') or the changed cells ('delta').
+        Byte counts are the characters of the cells and status line.
+    """
+    def __init__(self, diff=True):
+        super().__init__(diff)
+        self.message = None
+
+    def full(self, map, status, opt, offset):
+        rows = map.rows()
+        self.message = {'type': 'full', 'rows': rows, 'status': status}
+        return sum(len(row) for row in rows) + len(status)
+
+    def cells(self, map, positions, status, offset):
+        self.message = {'type': 'delta', 'cells': [[x, y, map.symbol(x, y)] for x, y in positions], 'status': status}
+        return len(positions) + len(status)
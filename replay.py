@@ -0,0 +1,363 @@
+import hashlib
+import json
+import struct
+
+import numpy as np
+
+from config import *
+from pacman import Game
+
+MAGIC = b'PACR'
+VERSION = 1
+HEADER = struct.Struct('<BIH') # version, seed, length of the JSON metadata
+END = struct.Struct('<BiHBI16s') # outcome, score, level, lives, frames, digest of the final state
+OUTCOMES = ('won', 'lost', 'timeout', 'stopped')
+STAY = (0, 0)
+CODES = MOVES + (STAY,) # a move is stored as its index in CODES
+MOVE_CODES = {move: code for code, move in enumerate(CODES)}
+N_CODES = len(CODES)
+
+# first byte of a record: END_TAG, the number of moves of a frame (LONG_FRAME: the number follows
+# as uint16), or RUN_TAG | (n - 1) for n frames where every entity repeats its previous move
+END_TAG = 0
+LONG_FRAME = 0x7F
+RUN_TAG = 0x80
+MAX_RUN = 0x80
+
+# settings the moves of a game depend on, besides the seed and levels
+SETTINGS = ('ENEMY_FRAME', 'LIVES', 'POWER_TICKS', 'N_ENEMIES', 'N_PRIZES', 'N_POWERS')
+
+def state_digest(game):
+    """
+        Hashes the state of a game: cells, entities, power mode, score, lives, level and frames played.
+
+        Args:
+        game (Game): The game.
+
+        Returns:
+        bytes: The 16-byte digest.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(game.map.cells.tobytes())
+    for entity_id in sorted(game.map.entities, key=int):
+        entity = game.map.entities[entity_id]
+        h.update(f'{entity_id}:{entity.category}:{entity.pos[0]},{entity.pos[1]};'.encode())
+    h.update(f'{game.map.powered}:{game.score}:{game.lives}:{game.level}:{game.ticks}'.encode())
+    return h.digest()
+
+class ReplayWriter():
+    """
+        A class to record games in a replay log.
+
+        A game is a header (seed, map folder, levels and settings) followed by one record per frame with
+        the moves of the player, the enemies and the scared enemies, in the order they are applied, and an
+        end record with the outcome and a digest of the final state. Each move is stored as the difference
+        (modulo 5) with the move in the same place of the previous frame, three per byte, and runs of frames
+        where every difference is 0 (the player keeps going, the enemies did not move) take one byte. Games
+        are appended to the log, and records are written as the game runs.
+
+        Attributes:
+        seed (int): Seed of the entity placement of the game.
+        frames (int): Number of frames recorded.
+        ended (bool): Whether the end record was written.
+
+        Methods:
+        __init__(path, seed): Opens the log.
+        begin(game): Writes the header of a game.
+        next_frame(): Starts a frame.
+        moves(moves): Records moves of the current frame.
+        end(game, outcome): Writes the end record.
+        close(): Closes the log.
+    """
+    def __init__(self, path, seed):
+        """
+            Opens the log, appending to it if it exists.
+
+            Args:
+            path (str): The log file.
+            seed (int): Seed of the entity placement, the game must use RandomState(seed).
+        """
+        self.file = open(path, 'ab')
+        self.seed = seed
+        self.frames = 0
+        self.ended = False
+        self.previous = []
+        self.current = None
+        self.run = 0
+
+    def begin(self, game):
+        """
+            Writes the header of a game.
+
+            Args:
+            game (Game): The game, before its first level is loaded.
+        """
+        meta = json.dumps({'folder': str(game.map_folder), 'levels': [str(level) for level in game.levels],
+                           'settings': {name: globals()[name] for name in SETTINGS}}).encode()
+        self.file.write(MAGIC + HEADER.pack(VERSION, self.seed, len(meta)) + meta)
+
+    def next_frame(self):
+        if self.current is not None:
+            self.write_frame(self.current)
+        self.current = []
+
+    def moves(self, moves):
+        self.current.extend(MOVE_CODES[tuple(move)] for move in moves)
+
+    def write_frame(self, codes):
+        previous = self.previous
+        deltas = [(code - (previous[i] if i < len(previous) else 0)) % N_CODES for i, code in enumerate(codes)]
+        self.previous = codes
+        self.frames += 1
+        if not any(deltas):
+            self.run += 1
+            if self.run == MAX_RUN:
+                self.flush_run()
+            return
+        self.flush_run()
+        n = len(deltas)
+        head = bytes([n]) if n < LONG_FRAME else bytes([LONG_FRAME]) + struct.pack('<H', n)
+        deltas += [0] * (-n % 3)
+        packed = bytes(deltas[i] + N_CODES * deltas[i + 1] + N_CODES ** 2 * deltas[i + 2] for i in range(0, n, 3))
+        self.file.write(head + packed)
+
+    def flush_run(self):
+        if self.run:
+            self.file.write(bytes([RUN_TAG | (self.run - 1)]))
+            self.run = 0
+
+    def end(self, game, outcome):
+        """
+            Writes the end record of a game.
+
+            Args:
+            game (Game): The game.
+            outcome (str): How the game ended (see OUTCOMES).
+        """
+        if self.current is not None:
+            self.write_frame(self.current)
+            self.current = None
+        self.flush_run()
+        self.file.write(bytes([END_TAG]) + END.pack(OUTCOMES.index(outcome), game.score, game.level, game.lives,
+                                                     self.frames, state_digest(game)))
+        self.file.flush()
+        self.ended = True
+
+    def close(self):
+        self.file.close()
+
+class ReplayReader():
+    """
+        A class to read one game of a replay log, frame by frame, without loading the log in memory.
+
+        Attributes:
+        seed (int): Seed of the entity placement.
+        meta (dict): The map folder, levels and settings of the game.
+        frames (int): Number of frames read.
+        end (dict): The outcome, score, level, lives, frames and digest of the final state, once read
+        (None until then, or if the log stops before the end of the game).
+
+        Methods:
+        __init__(file): Reads the header of a game.
+        next_frame(): Moves to the next frame.
+        move(): Gets the next move of the current frame.
+        read_end(): Reads the end record.
+    """
+    def __init__(self, file):
+        """
+            Reads the header of a game.
+
+            Args:
+            file (file): The log, opened in binary mode at the start of a game.
+        """
+        self.file = file
+        magic = file.read(len(MAGIC))
+        if magic != MAGIC:
+            raise ValueError('not the start of a game in a replay log')
+        version, self.seed, size = HEADER.unpack(file.read(HEADER.size))
+        if version != VERSION:
+            raise ValueError(f'replay log version {version}, expected {VERSION}')
+        self.meta = json.loads(file.read(size))
+        self.frames = 0
+        self.end = None
+        self.previous = []
+        self.current = []
+        self.explicit = None
+        self.run = 0
+
+    def next_frame(self):
+        """
+            Moves to the next frame.
+
+            Returns:
+            bool: False at the end of the game.
+        """
+        self.previous, self.current = self.current, []
+        self.explicit = None
+        if self.run:
+            self.run -= 1
+        else:
+            tag = self.file.read(1)
+            if not tag:
+                return False
+            tag = tag[0]
+            if tag == END_TAG:
+                self.read_end_record()
+                return False
+            if tag & RUN_TAG:
+                self.run = tag & ~RUN_TAG
+            else:
+                n = tag if tag < LONG_FRAME else struct.unpack('<H', self.file.read(2))[0]
+                deltas = []
+                for byte in self.file.read((n + 2) // 3):
+                    deltas += [byte % N_CODES, byte // N_CODES % N_CODES, byte // N_CODES ** 2]
+                previous = self.previous
+                self.explicit = [((previous[i] if i < len(previous) else 0) + deltas[i]) % N_CODES for i in range(n)]
+        self.frames += 1
+        return True
+
+    def move(self):
+        """
+            Gets the next move of the current frame.
+
+            Returns:
+            tuple: The move.
+        """
+        i = len(self.current)
+        if self.explicit is not None:
+            if i >= len(self.explicit):
+                raise ValueError(f'frame {self.frames}: the game asks for more moves than recorded')
+            code = self.explicit[i]
+        else:
+            code = self.previous[i] if i < len(self.previous) else 0
+        self.current.append(code)
+        return CODES[code]
+
+    def read_end_record(self):
+        outcome, score, level, lives, frames, digest = END.unpack(self.file.read(END.size))
+        self.end = {'outcome': OUTCOMES[outcome], 'score': score, 'level': level, 'lives': lives,
+                    'frames': frames, 'digest': digest}
+
+    def read_end(self):
+        """
+            Reads the end record, once the game is over.
+
+            Returns:
+            dict: The end record, None if the log stops before it.
+        """
+        if self.end is None and not self.run:
+            tag = self.file.read(1)
+            if tag and tag[0] == END_TAG:
+                self.read_end_record()
+            elif tag:
+                raise ValueError(f'the game ended after {self.frames} frames, before the end of the log')
+        if self.run:
+            raise ValueError(f'the game ended after {self.frames} frames, before the end of the log')
+        return self.end
+
+class LogReplay(Game):
+    """
+        A headless game playing the moves of a replay log instead of planning them: no target selection
+        and no search, only the rules of the game.
+    """
+    def __init__(self, reader):
+        """
+            Args:
+            reader (ReplayReader): The log, at the start of a game.
+        """
+        settings = reader.meta['settings']
+        changed = [name for name in SETTINGS if settings[name] != globals()[name]]
+        if changed:
+            raise ValueError(f'game recorded with other settings: {", ".join(changed)}')
+        self.reader = reader
+        super().__init__(reader.meta['folder'], headless=True, levels=reader.meta['levels'],
+                         rng=np.random.RandomState(reader.seed))
+
+    def player_move(self, player_id, player, enemy_pos):
+        return self.reader.move()
+
+    def plan_agents(self, target_pos, start_positions, avoid_pos=None):
+        return [self.reader.move() for _ in start_positions]
+
+    def play(self):
+        """
+            Plays the frames of the log.
+
+            Returns:
+            str: How the game ended, 'won' or 'lost', None if the log stops before the end of the game.
+        """
+        while self.reader.next_frame():
+            outcome = self.step()
+            if outcome is not None:
+                return outcome
+        return None
+
+def verify(reader):
+    """
+        Replays a game of a log and compares its final state with the recorded one.
+
+        Args:
+        reader (ReplayReader): The log, at the start of a game.
+
+        Returns:
+        dict: The seed, levels, frames, recorded outcome and result of the replay, and the fields of the
+        final state that differ ('incomplete' if the log has no end record, or where the replay diverged).
+    """
+    game = LogReplay(reader)
+    try:
+        outcome = game.play()
+        end = reader.read_end()
+    except ValueError as e: # the game no longer follows the log
+        return {'seed': reader.seed, 'levels': len(reader.meta['levels']), 'frames': reader.frames,
+                'recorded': None, 'replayed': game.result('stopped'), 'mismatch': [str(e)]}
+    summary = {'seed': reader.seed, 'levels': len(reader.meta['levels']), 'frames': reader.frames,
+               'recorded': end['outcome'] if end else None, 'replayed': game.result(outcome or 'timeout')}
+    if end is None:
+        summary['mismatch'] = ['incomplete']
+        return summary
+
+    if outcome is None and end['outcome'] in ('timeout', 'stopped'): # the log stops while the game goes on
+        outcome = end['outcome']
+    state = {'outcome': outcome, 'score': game.score, 'level': game.level, 'lives': game.lives,
+             'frames': reader.frames, 'digest': state_digest(game)}
+    summary['mismatch'] = [name for name in state if state[name] != end[name]]
+    return summary
+
+def read_games(path):
+    """
+        Reads the games of a replay log one after the other.
+
+        Args:
+        path (str): The log file.
+
+        Yields:
+        ReplayReader: Each game, to be read to its end before moving to the next one.
+    """
+    with open(path, 'rb') as f:
+        while f.peek(1)[:1]:
+            reader = ReplayReader(f)
+            yield reader
+            while reader.end is None and reader.next_frame(): # skip what was not read
+                pass
+            if reader.end is None:
+                return
+
+
+if __name__ == '__main__':
+    import argparse
+    from time import perf_counter
+
+    parser = argparse.ArgumentParser(description='Replay the games of a replay log headless and check their final state')
+    parser.add_argument('log', help='replay log (written with pacman.py --record)')
+    args = parser.parse_args()
+
+    failures = 0
+    for i, reader in enumerate(read_games(args.log)):
+        start = perf_counter()
+        summary = verify(reader)
+        elapsed = perf_counter() - start
+        failures += bool(summary['mismatch'])
+        status = 'ok' if not summary['mismatch'] else 'MISMATCH ' + ', '.join(summary['mismatch'])
+        print(f'game {i}: seed {summary["seed"]}, {summary["frames"]} frames, {summary["recorded"]} '
+              f'({summary["frames"] / max(elapsed, 1e-9):.0f} frames/s): {status}')
+    raise SystemExit(1 if failures else 0)
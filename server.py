@@ -0,0 +1,589 @@
+import asyncio
+import json
+import os
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import count
+from time import perf_counter
+
+import numpy as np
+
+from config import *
+from pacman import Game
+from render import AnsiRenderer, MessageRenderer
+
+# messages a resync replaces with the whole board, the others are never dropped
+FRAMES = ('full', 'delta')
+
+# games of the sessions run by this process (a worker, or the server itself without workers)
+games = {}
+
+def open_session(session_id, folder, levels, seed, max_ticks):
+    """
+        Starts the game of a session in the current process.
+
+        Args:
+        session_id (int): The ID of the session.
+        folder (str): The folder containing the levels.
+        levels (list of str): The level files, all the levels of the folder if None.
+        seed (int): Seed of the entity placement.
+        max_ticks (int): Number of frames after which the game stops (None for no limit).
+
+        Returns:
+        dict: The first frame, the whole board.
+    """
+    game = Game(folder, headless=True, max_ticks=max_ticks, levels=levels, rng=np.random.RandomState(seed))
+    renderer = MessageRenderer()
+    renderer.draw(game.map, game.status_line())
+    games[session_id] = (game, renderer)
+    return renderer.message
+
+def step_session(session_id):
+    """
+        Plays one frame of the game of a session.
+
+        Args:
+        session_id (int): The ID of the session.
+
+        Returns:
+        tuple: The frame (the changed cells, or the whole board after a new level) and the result of
+        the game if it is over (see Game.result), None otherwise.
+    """
+    game, renderer = games[session_id]
+    if game.max_ticks is not None and game.ticks >= game.max_ticks:
+        outcome = 'timeout'
+    else:
+        outcome = game.step()
+    renderer.draw(game.map, game.status_line())
+    return renderer.message, game.result(outcome) if outcome is not None else None
+
+def close_session(session_id):
+    game, _ = games.pop(session_id, (None, None))
+    if game is not None:
+        game.close()
+
+class Board():
+    """
+        A copy of the board of a session, kept up to date from its frames.
+
+        The server keeps one per session to send the whole board to new clients and to clients that fell
+        behind, and the client draws it with the terminal renderers (it has the rows, symbol, dirty and
+        height members they read from a Map).
+
+        Attributes:
+        map (numpy array): The (height, width) cell symbols.
+        dirty (set): Cells changed since the last drawing.
+        status (str): The status line.
+
+        Methods:
+        __init__(rows, status): Initializes the board from whole rows.
+        apply(message): Applies a delta frame.
+        frame(): Gets the whole board as a frame.
+        rows(): Gets the symbols of the cells, row by row.
+        symbol(x, y): Gets the symbol of a cell.
+    """
+    def __init__(self, rows, status=''):
+        self.map = np.array([list(row) for row in rows])
+        self.height, self.width = self.map.shape
+        self.dirty = set()
+        self.status = status
+
+    def apply(self, message):
+        for x, y, symbol in message['cells']:
+            self.map[y, x] = symbol
+            self.dirty.add((x, y))
+        self.status = message['status']
+
+    def frame(self):
+        return {'type': 'full', 'rows': self.rows(), 'status': self.status}
+
+    def rows(self):
+        return [''.join(line) for line in self.map]
+
+    def symbol(self, x, y):
+        return str(self.map[y, x])
+
+def encode(message):
+    # results hold numpy integers
+    return (json.dumps(message, default=lambda value: value.item()) + '\n').encode()
+
+class Client():
+    """
+        A connection to the server.
+
+        Messages are queued and written by a separate task, so a slow client never blocks the sessions. When
+        a frame finds queue_size messages waiting, the frames queued are replaced by the whole board of every
+        session watched. The other messages (replies, ends of games) are never dropped: they stay queued,
+        after the boards, even past queue_size.
+
+        Attributes:
+        writer (StreamWriter): The connection.
+        queue (Queue): The encoded messages waiting to be sent, with whether they are frames.
+        queue_size (int): Number of messages waiting from which frames are dropped.
+        sessions (set): The sessions watched.
+        resyncs (int): Number of times the queue overflowed.
+    """
+    def __init__(self, writer, queue_size=CLIENT_QUEUE):
+        self.writer = writer
+        self.queue = asyncio.Queue()
+        self.queue_size = queue_size
+        self.sessions = set()
+        self.resyncs = 0
+
+    def send(self, line, frame=False):
+        """
+            Queues a message.
+
+            Args:
+            line (bytes): The encoded message.
+            frame (bool, optional): Whether it is a frame (see FRAMES), which a resync can replace.
+        """
+        if frame and self.queue.qsize() >= self.queue_size:
+            self.resync() # the boards sent include this frame
+        else:
+            self.queue.put_nowait((line, frame))
+
+    def resync(self):
+        self.resyncs += 1
+        kept = []
+        while not self.queue.empty():
+            line, frame = self.queue.get_nowait()
+            if not frame:
+                kept.append(line)
+        boards = [session for session in self.sessions if session.board is not None][:self.queue_size]
+        for session in boards:
+            self.queue.put_nowait((encode(dict(session.board.frame(), session=session.id)), True))
+        for line in kept:
+            self.queue.put_nowait((line, False))
+
+    async def write_loop(self):
+        while True:
+            line, _ = await self.queue.get()
+            self.writer.write(line)
+            await self.writer.drain()
+
+class Session():
+    """
+        A game hosted by the server, ticking on its own schedule.
+
+        A frame is due every period seconds from the start of the session. The frames are played by the
+        worker process the session is pinned to (its game lives there), so the pathfinding never stalls the
+        event loop; without workers they are played in the event loop. Lateness is measured when a frame
+        starts, and frames lost after a late one are not caught up (as in FrameScheduler).
+
+        Attributes:
+        id (int): The ID of the session.
+        params (dict): The folder, levels, seed and max_ticks of the game.
+        period (float): Duration of a frame, in seconds.
+        board (Board): The current board.
+        watchers (set): The clients receiving the frames.
+        ticks (int): Number of frames played.
+        lags (deque): Lateness of the last frames, in seconds.
+        result (dict): The result of the game once over (see Game.result), or its error if it failed.
+        task (Task): The task playing the game.
+    """
+    def __init__(self, session_id, params, period, executor):
+        self.id = session_id
+        self.params = params
+        self.period = period
+        self.executor = executor
+        self.board = None
+        self.watchers = set()
+        self.ticks = 0
+        self.lags = deque(maxlen=10000)
+        self.result = None
+        self.task = None
+
+    async def call(self, function, *args):
+        if self.executor is None:
+            return function(*args)
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    async def run(self):
+        """
+            Plays the game until it is over. If the game cannot be loaded or a frame fails (a missing
+            folder, a broken level, a worker that died), the session ends with the outcome 'error'.
+        """
+        loop = asyncio.get_running_loop()
+        p = self.params
+        try:
+            self.publish(await self.call(open_session, self.id, p['folder'], p['levels'], p['seed'], p['max_ticks']))
+            deadline = loop.time()
+            while self.result is None:
+                deadline += self.period
+                delay = deadline - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                lag = max(0, loop.time() - deadline)
+                self.lags.append(lag)
+                if lag > self.period:
+                    deadline = loop.time()
+                message, self.result = await self.call(step_session, self.id)
+                self.ticks += 1
+                self.publish(message)
+        except Exception as e: # not CancelledError, the server is closing
+            self.result = {'outcome': 'error', 'error': repr(e), 'ticks': self.ticks}
+        finally:
+            if self.result is not None:
+                self.publish({'type': 'end', 'result': self.result})
+            await self.call(close_session, self.id)
+
+    def publish(self, message):
+        """
+            Updates the board and sends a frame to the watchers.
+
+            Args:
+            message (dict): The frame.
+        """
+        if message['type'] == 'full':
+            self.board = Board(message['rows'], message['status'])
+        elif message['type'] == 'delta':
+            self.board.apply(message)
+            self.board.dirty.clear() # nothing is drawn from the server's board
+        line = encode(dict(message, session=self.id))
+        for client in self.watchers:
+            client.send(line, message['type'] in FRAMES)
+
+    def info(self):
+        return {'session': self.id, 'ticks': self.ticks, 'watchers': len(self.watchers),
+                'running': self.result is None, **self.params}
+
+class GameServer():
+    """
+        A server hosting many game sessions in one event loop, and streaming their frames over TCP.
+
+        Clients send and receive JSON messages, one per line. Requests:
+        {"cmd": "create", "folder": ..., "levels": [...], "seed": 0, "max_ticks": null, "period": 0.1}
+            starts a session and answers {"type": "created", "session": id}.
+        {"cmd": "watch", "session": id} streams the frames of a session: the whole board first
+            ({"type": "full", "rows": [...], "status": ...}), then the cells changed by each frame
+            ({"type": "delta", "cells": [[x, y, symbol], ...], "status": ...}), and {"type": "end", "result": ...}
+            (the outcome of the result is 'error', with the exception in "error", if the game failed).
+        {"cmd": "unwatch", "session": id} stops streaming a session.
+        {"cmd": "list"} answers {"type": "sessions", "sessions": [...]}.
+        {"cmd": "stats"} answers {"type": "stats", ...}: the frames played and the lateness percentiles.
+        Every message sent about a session carries its ID in "session".
+
+        Sessions are pinned round-robin to single-process pools, so the game of a session stays in one
+        worker while the workers play frames of different sessions in parallel. Once a game is over and
+        no client watches it, its session is dropped and only its result is kept (the last
+        FINISHED_SESSIONS of them), which a watch request still gets.
+
+        Attributes:
+        sessions (dict): The sessions running, or over and still watched, by ID.
+        results (OrderedDict): The results of the dropped sessions, by ID, oldest first.
+        executors (list): The worker pools, one process each (empty to play the frames in the event loop).
+        clients (set): The connected clients.
+
+        Methods:
+        __init__(workers): Initializes the server.
+        start(host, port): Starts listening.
+        create(folder, levels, seed, max_ticks, period): Starts a session.
+        retire(session): Drops a session once its game is over and no client watches it.
+        stats(): Frames played and lateness of the frames.
+        close(): Stops the sessions and the workers.
+    """
+    def __init__(self, workers=None):
+        """
+            Args:
+            workers (int, optional): Number of worker processes playing the frames, the number of CPUs by
+            default (0 to play them in the event loop).
+        """
+        if workers is None:
+            workers = os.cpu_count()
+        self.executors = [ProcessPoolExecutor(max_workers=1) for _ in range(workers)]
+        self.sessions = {}
+        self.results = OrderedDict()
+        self.finished_ticks = 0 # frames played by the dropped sessions
+        self.tasks = set()
+        self.clients = set()
+        self.ids = count()
+        self.server = None
+
+    async def start(self, host=SERVER_HOST, port=SERVER_PORT):
+        """
+            Starts listening.
+
+            Args:
+            host (str, optional): The address.
+            port (int, optional): The port, 0 for any free port.
+
+            Returns:
+            int: The port.
+        """
+        self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    def create(self, folder='maps/levels', levels=None, seed=0, max_ticks=None, period=SLEEP):
+        """
+            Starts a session.
+
+            Returns:
+            Session: The session.
+        """
+        session_id = next(self.ids)
+        executor = self.executors[session_id % len(self.executors)] if self.executors else None
+        params = {'folder': folder, 'levels': levels, 'seed': seed, 'max_ticks': max_ticks}
+        session = Session(session_id, params, period, executor)
+        self.sessions[session_id] = session
+        task = session.task = asyncio.create_task(session.run())
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        task.add_done_callback(lambda _: self.retire(session))
+        return session
+
+    def retire(self, session):
+        """
+            Drops a session once its game is over and no client watches it, keeping only its result.
+
+            Args:
+            session (Session): The session.
+        """
+        if not session.task.done() or session.watchers or self.sessions.pop(session.id, None) is None:
+            return
+        self.finished_ticks += session.ticks
+        if session.result is not None:
+            self.results[session.id] = session.result
+            while len(self.results) > FINISHED_SESSIONS:
+                self.results.popitem(last=False)
+
+    def stats(self):
+        """
+            Gets the frames played and the lateness of the frames.
+
+            Returns:
+            dict: Number of sessions kept (and still running), frames played by every session since the
+            server started, lateness percentiles in seconds over the last frames of the sessions kept,
+            and number of client resyncs.
+        """
+        lags = np.array([lag for session in self.sessions.values() for lag in session.lags])
+        p50, p95, p99 = np.percentile(lags, [50, 95, 99]) if len(lags) else (0, 0, 0)
+        return {'sessions': len(self.sessions), 'running': sum(s.result is None for s in self.sessions.values()),
+                'ticks': self.finished_ticks + sum(s.ticks for s in self.sessions.values()), 'workers': len(self.executors),
+                'lag_p50': p50, 'lag_p95': p95, 'lag_p99': p99,
+                'resyncs': sum(client.resyncs for client in self.clients)}
+
+    async def handle(self, reader, writer):
+        client = Client(writer)
+        self.clients.add(client)
+        write_task = asyncio.create_task(client.write_loop())
+        try:
+            while line := await reader.readline():
+                try:
+                    reply = self.request(client, json.loads(line))
+                except (KeyError, ValueError, TypeError) as e:
+                    reply = {'type': 'error', 'error': repr(e)}
+                if reply is not None:
+                    client.send(encode(reply), reply['type'] in FRAMES)
+        except ConnectionError: # client gone
+            pass
+        finally:
+            for session in client.sessions:
+                session.watchers.discard(client)
+                self.retire(session)
+            self.clients.discard(client)
+            write_task.cancel()
+            writer.close()
+
+    def request(self, client, request):
+        cmd = request['cmd']
+        if cmd == 'create':
+            session = self.create(request.get('folder', 'maps/levels'), request.get('levels'), request.get('seed', 0),
+                                  request.get('max_ticks'), request.get('period', SLEEP))
+            return {'type': 'created', 'session': session.id}
+        if cmd == 'watch':
+            if request['session'] in self.results:
+                return {'type': 'end', 'session': request['session'], 'result': self.results[request['session']]}
+            session = self.sessions[request['session']]
+            session.watchers.add(client)
+            client.sessions.add(session)
+            if session.result is not None:
+                return {'type': 'end', 'session': session.id, 'result': session.result}
+            if session.board is not None: # otherwise the first frame is on its way
+                return dict(session.board.frame(), session=session.id)
+            return None
+        if cmd == 'unwatch':
+            session = self.sessions.get(request['session'])
+            if session is not None:
+                session.watchers.discard(client)
+                client.sessions.discard(session)
+                self.retire(session)
+            return None
+        if cmd == 'list':
+            return {'type': 'sessions', 'sessions': [session.info() for session in self.sessions.values()]}
+        if cmd == 'stats':
+            return dict(self.stats(), type='stats')
+        raise ValueError(f'unknown command {cmd}')
+
+    async def close(self):
+        """
+            Stops the sessions, the clients and the workers.
+        """
+        if self.server is not None:
+            self.server.close()
+        for task in list(self.tasks):
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        for client in list(self.clients):
+            client.writer.close()
+        for executor in self.executors:
+            executor.shutdown(cancel_futures=True)
+
+async def request(reader, writer, message, reply_type):
+    """
+        Sends a request and waits for its answer, skipping frames received meanwhile.
+    """
+    writer.write(encode(message))
+    await writer.drain()
+    while True:
+        reply = json.loads(await reader.readline())
+        if reply['type'] in (reply_type, 'error'):
+            return reply
+
+async def watch(host, port, session=None, create=None):
+    """
+        A stand-in client: draws the frames of a session in the terminal until the game is over.
+
+        Args:
+        host (str): The address of the server.
+        port (int): Its port.
+        session (int, optional): The session to watch.
+        create (dict, optional): The parameters of a new session to watch (see GameServer).
+
+        Returns:
+        dict: The result of the game.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    if session is None:
+        session = (await request(reader, writer, dict(create or {}, cmd='create'), 'created'))['session']
+    writer.write(encode({'cmd': 'watch', 'session': session}))
+    renderer = AnsiRenderer()
+    board = None
+    try:
+        while line := await reader.readline():
+            message = json.loads(line)
+            if message['type'] == 'full':
+                board = Board(message['rows'], message['status'])
+            elif message['type'] == 'delta':
+                if board is None: # the whole board is on its way
+                    continue
+                board.apply(message)
+            elif message['type'] == 'end':
+                return message['result']
+            else:
+                continue
+            renderer.draw(board, board.status)
+    finally:
+        writer.close()
+
+async def load_client(host, port, session, counts):
+    """
+        Watches a session without drawing it, counting the frames received.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(encode({'cmd': 'watch', 'session': session}))
+    try:
+        while line := await reader.readline():
+            kind = json.loads(line)['type']
+            counts[kind] = counts.get(kind, 0) + 1
+    finally:
+        writer.close()
+
+async def load_test(n_sessions, workers=None, duration=10, period=SLEEP, folder='maps/levels', levels=None):
+    """
+        Measures how many sessions the server keeps on schedule: n_sessions sessions, each watched by
+        one client, run for duration seconds on a server listening on a free local port.
+
+        Args:
+        n_sessions (int): Number of sessions.
+        workers (int, optional): Number of worker processes, the number of CPUs by default.
+        duration (float, optional): Length of the test, in seconds.
+        period (float, optional): Duration of a frame of each session.
+        folder (str, optional): The folder containing the levels.
+        levels (list of str, optional): The levels to play.
+
+        Returns:
+        dict: The server stats (see GameServer.stats), with the frame rate achieved and expected, and the
+        number of frames received by the clients.
+    """
+    server = GameServer(workers)
+    port = await server.start(port=0)
+    counts = {}
+    clients = []
+    try:
+        for seed in range(n_sessions):
+            session = server.create(folder, levels, seed, period=period)
+            clients.append(asyncio.create_task(load_client(SERVER_HOST, port, session.id, counts)))
+        await asyncio.sleep(1) # workers start and levels load
+        start_ticks, start = server.stats()['ticks'], perf_counter()
+        for session in server.sessions.values():
+            session.lags.clear()
+        await asyncio.sleep(duration)
+        stats = server.stats()
+        elapsed = perf_counter() - start
+    finally:
+        for client in clients:
+            client.cancel()
+        await server.close()
+    stats.update(ticks_per_s=(stats['ticks'] - start_ticks) / elapsed, expected_per_s=n_sessions / period,
+                 received=sum(counts.values()))
+    return stats
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Host many game sessions and stream their frames over TCP')
+    parser.add_argument('--host', default=SERVER_HOST, help='address of the server')
+    parser.add_argument('--port', type=int, default=SERVER_PORT, help='port of the server')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve = commands.add_parser('serve', help='run the server')
+    serve.add_argument('--workers', type=int, default=None, help='worker processes playing the frames, one per CPU by default (0 to play them in the event loop)')
+
+    client = commands.add_parser('watch', help='draw a session in the terminal')
+    client.add_argument('--session', type=int, default=None, help='session to watch (a new one by default)')
+    client.add_argument('--maps', default='maps/levels', help='folder containing the levels of a new session')
+    client.add_argument('--seed', type=int, default=0, help='seed of the entity placement of a new session')
+    client.add_argument('--period', type=float, default=SLEEP, help='duration of a frame of a new session')
+    client.add_argument('--max-ticks', type=int, default=None, help='stop a new session after this many frames')
+
+    load = commands.add_parser('load-test', help='measure how many sessions stay on schedule')
+    load.add_argument('--sessions', type=int, nargs='+', default=[10, 50, 100, 200], help='numbers of sessions to try')
+    load.add_argument('--workers', type=int, default=None, help='worker processes, one per CPU by default')
+    load.add_argument('--duration', type=float, default=10, help='length of each test, in seconds')
+    load.add_argument('--period', type=float, default=SLEEP, help='duration of a frame')
+    load.add_argument('--maps', default='maps/levels', help='folder containing the levels')
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        async def main():
+            server = GameServer(args.workers)
+            port = await server.start(args.host, args.port)
+            print(f'listening on {args.host}:{port}')
+            try:
+                await server.server.serve_forever()
+            finally:
+                await server.close()
+        try:
+            asyncio.run(main())
+        except KeyboardInterrupt:
+            pass
+    elif args.command == 'watch':
+        create = {'folder': args.maps, 'seed': args.seed, 'period': args.period, 'max_ticks': args.max_ticks}
+        try:
+            print(asyncio.run(watch(args.host, args.port, args.session, create)))
+        except KeyboardInterrupt:
+            pass
+    else:
+        cores = min(args.workers if args.workers is not None else os.cpu_count(), os.cpu_count()) or 1
+        print(f'{"sessions":>8}{"frames/s":>10}{"expected":>10}{"lag p50":>10}{"lag p95":>10}{"lag p99":>10}{"resyncs":>8}')
+        best = 0
+        for n in args.sessions:
+            stats = asyncio.run(load_test(n, args.workers, args.duration, args.period, args.maps))
+            print(f'{n:>8}{stats["ticks_per_s"]:>10.1f}{stats["expected_per_s"]:>10.1f}'
+                  + ''.join(f'{stats[k] * 1e3:>8.1f}ms' for k in ('lag_p50', 'lag_p95', 'lag_p99'))
+                  + f'{stats["resyncs"]:>8}')
+            if stats['lag_p95'] < args.period:
+                best = max(best, n)
+        print(f'{best / cores:.1f} sessions per core on schedule (p95 lateness below one frame, {cores} cores)')
@@ -0,0 +1,207 @@
+from math import inf
+
+from config import *
+
+TARGET_CATEGORIES = ('prize', 'power', 'scared') # in the order closest_to_eat breaks ties
+
+# number of targets scored by TargetIndex, for profiling
+counters = {'scanned': 0}
+
+class TargetIndex():
+    """
+        A class to find the best target of the player (see Map.closest_to_eat) without scanning all targets.
+
+        Prizes, powers and scared enemies are kept in square buckets of TARGET_BUCKET cells. The search
+        visits the buckets ring by ring around the player and stops once no target in the next ring can
+        beat the best one found: a target scores its squared distance to the player (divided by
+        SCARED_BONUS for scared enemies) plus its danger, and the danger is never negative.
+
+        With mode 'maze', the distance is the number of moves instead of the straight-line distance,
+        found with a breadth-first search from the player that stops as soon as it cannot improve. If no
+        target can be reached from the player, the straight-line distance is used instead.
+
+        Attributes:
+        map (Map): The map of the targets.
+        size (int): Width and height of a bucket, in cells.
+        buckets (dict): The target IDs of each bucket.
+        mode (str): 'euclidean' or 'maze'.
+
+        Methods:
+        __init__(map, size, mode): Initializes an empty index.
+        add(entity_id, pos): Adds a target.
+        remove(entity_id, pos): Removes a target.
+        move(entity_id, current_pos, new_pos): Moves a target.
+        closest(player_pos, danger): Gets the best target of the player.
+    """
+    def __init__(self, map, size=TARGET_BUCKET, mode=TARGET_DISTANCE):
+        """
+            Initializes an empty index, filled by the map as its targets are placed.
+
+            Args:
+            map (Map): The map of the targets.
+            size (int, optional): Width and height of a bucket, in cells.
+            mode (str, optional): 'euclidean' or 'maze', how the distance to the player is measured.
+        """
+        self.map = map
+        self.size = size
+        self.mode = mode
+        self.buckets = {}
+
+    def bucket(self, pos):
+        """
+            Gets the bucket of a position.
+
+            Args:
+            pos (tuple): The position.
+
+            Returns:
+            tuple: The column and row of the bucket.
+        """
+        return (pos[0] // self.size, pos[1] // self.size)
+
+    def add(self, entity_id, pos):
+        """
+            Adds a target.
+
+            Args:
+            entity_id (str): The ID of the target.
+            pos (tuple): Its position.
+        """
+        self.buckets.setdefault(self.bucket(pos), set()).add(entity_id)
+
+    def remove(self, entity_id, pos):
+        """
+            Removes a target.
+
+            Args:
+            entity_id (str): The ID of the target.
+            pos (tuple): Its position.
+        """
+        key = self.bucket(pos)
+        ids = self.buckets[key]
+        ids.discard(entity_id)
+        if not ids:
+            del self.buckets[key]
+
+    def move(self, entity_id, current_pos, new_pos):
+        """
+            Moves a target.
+
+            Args:
+            entity_id (str): The ID of the target.
+            current_pos (tuple): Its current position.
+            new_pos (tuple): Its new position.
+        """
+        if self.bucket(current_pos) != self.bucket(new_pos):
+            self.remove(entity_id, current_pos)
+            self.add(entity_id, new_pos)
+
+    def score(self, entity_id, dist, danger):
+        """
+            Scores a target (the lower the better), ties broken as in a scan of prizes, powers then scared enemies.
+
+            Args:
+            entity_id (str): The ID of the target.
+            dist (int): Its squared distance to the player.
+            danger (numpy array): Danger field of the enemies.
+
+            Returns:
+            tuple: The score, the rank of the category and the ID number.
+        """
+        counters['scanned'] += 1
+        entity = self.map.entities[entity_id]
+        if entity.category == 'scared':
+            dist /= SCARED_BONUS
+        x, y = entity.pos
+        return (dist + danger.item(y, x), TARGET_CATEGORIES.index(entity.category), int(entity_id))
+
+    def closest(self, player_pos, danger):
+        """
+            Gets the best target of the player.
+
+            Args:
+            player_pos (tuple): The position of the player.
+            danger (numpy array): Danger field of the enemies.
+
+            Returns:
+            str: The ID of the best target, None if there is none.
+        """
+        if self.mode == 'maze':
+            best = self.closest_in_maze(player_pos, danger)
+            if best is not None:
+                return best
+            # no target can be reached from the player (e.g. walled off): use the straight-line distance
+
+        # targets may score down to their squared distance over SCARED_BONUS (scared enemies)
+        factor = SCARED_BONUS if self.map.categories.get('scared') else 1
+        px, py = player_pos
+        bx, by = self.bucket(player_pos)
+        n_rings = max(self.map.width, self.map.height) // self.size + 1
+        best, best_score = None, (inf,)
+        for r in range(n_rings + 1):
+            lower_bound = ((r - 1) * self.size + 1) ** 2 / factor if r else 0
+            if lower_bound > best_score[0]:
+                break
+            for key in self.ring(bx, by, r):
+                for entity_id in self.buckets.get(key, ()):
+                    x, y = self.map.entities[entity_id].pos
+                    score = self.score(entity_id, (px - x) ** 2 + (py - y) ** 2, danger)
+                    if score < best_score:
+                        best, best_score = entity_id, score
+        return best
+
+    def ring(self, bx, by, r):
+        """
+            Gets the buckets at Chebyshev distance r from a bucket, the ones a ring of the search visits.
+            Buckets outside the map are included, they are simply empty.
+
+            Args:
+            bx (int): The column of the bucket of the player.
+            by (int): Its row.
+            r (int): The distance, in buckets.
+
+            Returns:
+            list of tuple: The buckets of the ring, the bucket itself for r = 0.
+        """
+        if r == 0:
+            return [(bx, by)]
+        keys = [(bx + dx, by + dy) for dx in range(-r, r + 1) for dy in (-r, r)]
+        keys += [(bx + dx, by + dy) for dx in (-r, r) for dy in range(-r + 1, r)]
+        return keys
+
+    def closest_in_maze(self, player_pos, danger):
+        """
+            Gets the best target of the player, using the squared number of moves as distance.
+
+            Args:
+            player_pos (tuple): The position of the player.
+            danger (numpy array): Danger field of the enemies.
+
+            Returns:
+            str: The ID of the best target, None if no target can be reached.
+        """
+        targets = self.map.positions
+        factor = SCARED_BONUS if self.map.categories.get('scared') else 1
+        neighbours = self.map.neighbours
+        seen = {player_pos}
+        frontier = [player_pos]
+        best, best_score = None, (inf,)
+        d = 0
+        while frontier and d ** 2 / factor <= best_score[0]:
+            for pos in frontier:
+                for entity_id in targets.get(pos, ()):
+                    if self.map.entities[entity_id].category in TARGET_CATEGORIES:
+                        score = self.score(entity_id, d ** 2, danger)
+                        if score < best_score:
+                            best, best_score = entity_id, score
+            d += 1
+            next_frontier = []
+            for x, y in frontier:
+                mask = neighbours.item(y, x)
+                for k, move in enumerate(MOVES):
+                    pos = (x + move[0], y + move[1])
+                    if mask >> k & 1 and pos not in seen:
+                        seen.add(pos)
+                        next_frontier.append(pos)
+            frontier = next_frontier
+        return best
@@ -0,0 +1,556 @@
+import asyncio
+import io
+import json
+import re
+import tracemalloc
+from collections import Counter
+from multiprocessing import shared_memory
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+import pacman
+from config import DANGER_CHUNK, DANGER_CUTOFF, DANGER_WEIGHT, EAT, LOST, MOVES, OK, POWER, SCARED_BONUS, SCORE, SEARCH_WEIGHT, SLEEP, WON
+from distances import DistanceTable
+from generate import entity_counts_for, generate_maze, save_maze
+from heuristics import HEURISTICS
+from hierarchical import HPA_BOUND, HierarchicalPlanner
+from incremental import IncrementalPlanner
+from level_format import convert
+from map import Map
+from pacing import FrameScheduler
+from pacman import Game
+from profiler import NO_PHASE, Profiler
+from parallel import ParallelPlanner
+from pathfinding import PathCache, check_map, counters, distance_field, first_moves, path_cost, plan_move, search
+from replay import LONG_FRAME, ReplayWriter, read_games, state_digest, verify
+from render import AnsiRenderer
+from server import FRAMES, Board, Client, GameServer, Session, encode, watch
+import targets
+from targets import TARGET_CATEGORIES, TargetIndex
+from lockstep import cross_check
+
+MAPS = Path(__file__).parent / 'maps'
+
+def test_path_to_prize_matches_legacy():
+    assert check_map(Map(MAPS / 'levels' / 'map01.txt'), np.random.default_rng(0), n_queries=20) == 0
+
+def test_lockstep_matches_scalar_engine():
+    assert cross_check(MAPS / 'levels' / 'map01.txt', range(4), max_ticks=300) == []
+
+def test_restore_clears_scared_enemy_eaten_by_running_into_player():
+    level = Map(MAPS / 'test_maps' / 'simple_map.txt', clock=lambda: 0, rng=np.random.RandomState(0))
+    level.add_entities(n_enemies=1, n_prizes=1, n_powers=0)
+    state, cells = level.snapshot(), level.cells.copy()
+    level.power()
+    (scared_id,) = level.get_entity_category('scared')
+    house = level.entities[next(iter(level.get_entity_category('house')))].pos
+    status = None
+    for _ in range(100): # run the scared enemy into the player, around the house
+        (x, y), (px, py) = level.entities[scared_id].pos, level.entities[level.player_id].pos
+        moves = [m for m in MOVES if abs(x + m[0] - px) + abs(y + m[1] - py) < abs(x - px) + abs(y - py)]
+        move = next((m for m in moves if (x + m[0], y + m[1]) != house), moves[0])
+        status = level.update_map(scared_id, move)
+        if status != OK:
+            break
+    assert status == EAT
+    level.restore(state)
+    assert (level.cells == cells).all()
+
+def test_danger_field_memory_stays_linear_in_cells(tmp_path):
+    maze = generate_maze(201, 201, seed=0)
+    save_maze(maze, tmp_path / 'maze.txt')
+    level = Map(tmp_path / 'maze.txt', rng=np.random.RandomState(0))
+    level.add_entities(**entity_counts_for(maze, enemies=0.05))
+    enemy_pos = [level.entities[i].pos for i in level.get_entity_category('enemy')]
+    assert len(enemy_pos) * level.width * level.height > 8 * DANGER_CHUNK
+    tracemalloc.start()
+    try:
+        danger = level.danger_field(enemy_pos)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert peak < 4 * DANGER_CHUNK * danger.itemsize
+    ys, xs = np.mgrid[:level.height, :level.width]
+    expected = sum(DANGER_WEIGHT / (1e-6 + (xs - x) ** 2 + (ys - y) ** 2) for x, y in enemy_pos)
+    assert np.allclose(danger, expected)
+
+def check_indexes(level):
+    categories = {}
+    for index, entity in level.entities.items(): # full scan, in ID order
+        categories.setdefault(entity.category, []).append(index)
+    assert {c: list(ids) for c, ids in level.categories.items() if ids} == categories
+    positions = {}
+    for index, entity in level.entities.items():
+        positions.setdefault(entity.pos, set()).add(index)
+    assert {pos: set(ids) for pos, ids in level.positions.items()} == positions
+
+def test_entity_indexes_match_full_scan():
+    rng, ticks = np.random.RandomState(0), [0]
+    level = Map(MAPS / 'levels' / 'map01.txt', clock=lambda: ticks[0], dur=20, rng=rng)
+    table = DistanceTable(level.walkable)
+    empty = level.snapshot()
+    level.add_entities()
+    start = level.snapshot()
+    statuses = set()
+    for state in (start, empty):
+        check_indexes(level)
+        for ticks[0] in range(400):
+            _, target = level.closest_to_eat(level.player_id, 'enemy')
+            status = level.update_map(level.player_id, table.next_move(level.get_player()[1].pos, target.pos))
+            statuses.add(status)
+            for index in level.get_entity_category('enemy') + level.get_entity_category('scared'):
+                if status in (WON, LOST):
+                    break
+                if index in level.entities:
+                    status = level.update_map(index, MOVES[rng.randint(len(MOVES))])
+                    statuses.add(status)
+            check_indexes(level)
+            if status in (WON, LOST):
+                break
+        level.add_entity('prize', '.')
+        check_indexes(level)
+        level.restore(state)
+    check_indexes(level)
+    assert not level.entities
+    assert {EAT, POWER, SCORE, WON} <= statuses
+
+def test_binary_level_matches_text_level(tmp_path):
+    map_path = MAPS / 'levels' / 'map01.txt'
+    text = Map(map_path)
+    for adjacency in (True, False): # read from the file, or built at load time
+        binary = Map(convert(map_path, tmp_path / f'level_{adjacency}.pacb', adjacency=adjacency))
+        for name in ('cells', 'walkable', 'neighbours', 'free', 'adj_offsets', 'adj_cells', 'adj_moves'):
+            assert np.array_equal(getattr(binary, name), getattr(text, name)), name
+
+def test_incremental_planner_matches_search():
+    level = Map(MAPS / 'levels' / 'map01.txt')
+    rng = np.random.RandomState(0)
+    open_cells = [(int(x), int(y)) for y, x in zip(*np.nonzero(level.walkable))]
+    planner = IncrementalPlanner(level)
+    cost = lambda cell: planner.cost.item(cell)
+    ys, xs = np.mgrid[:level.height, :level.width]
+    enemies = [open_cells[i] for i in rng.randint(len(open_cells), size=4)]
+    start, target = open_cells[rng.randint(len(open_cells))], None
+    for _ in range(200):
+        if target in (None, start):
+            target = open_cells[rng.randint(len(open_cells))]
+        move = planner.next_move(start, target, enemies)
+
+        expected = np.ones((level.height, level.width))
+        for x, y in enemies:
+            penalty = DANGER_WEIGHT / (planner.eps + (xs - x) ** 2 + (ys - y) ** 2)
+            expected += np.where(penalty >= DANGER_CUTOFF, penalty, 0)
+        assert np.allclose(planner.cost[level.walkable], expected[level.walkable])
+        best = path_cost(start, search(start, target, level, cost=cost), level, cost)
+        assert planner.g[start] == pytest.approx(best)
+        next_pos = (start[0] + move[0], start[1] + move[1])
+        assert move in MOVES and level.walkable[next_pos[1], next_pos[0]]
+        rest = path_cost(next_pos, search(next_pos, target, level, cost=cost), level, cost)
+        assert cost(next_pos[1] * level.width + next_pos[0]) + rest == pytest.approx(best)
+
+        start = next_pos
+        enemies = [(x + dx, y + dy) if level.walkable[y + dy, x + dx] else (x, y)
+                   for (x, y), (dx, dy) in zip(enemies, (MOVES[k] for k in rng.randint(len(MOVES), size=len(enemies))))]
+
+def scan_closest_to_eat(level, danger, mode):
+    player = level.entities[level.player_id]
+    if mode == 'maze':
+        field = distance_field(player.pos, level)
+        dists = {}
+        for index in level.entities:
+            x, y = level.entities[index].pos
+            if y * level.width + x in field:
+                dists[index] = field[y * level.width + x] ** 2
+    ranked = []
+    for rank, category in enumerate(TARGET_CATEGORIES):
+        for index in level.get_entity_category(category):
+            if mode == 'maze' and index not in dists:
+                continue
+            dist = dists[index] if mode == 'maze' else player.dist(level.entities[index])
+            if category == 'scared':
+                dist /= SCARED_BONUS
+            x, y = level.entities[index].pos
+            ranked.append((dist + danger[y, x], rank, int(index), index))
+    if not ranked and mode == 'maze': # nothing reachable
+        return scan_closest_to_eat(level, danger, 'euclidean')
+    return min(ranked)[-1] if ranked else None
+
+def test_target_index_matches_scan(tmp_path):
+    save_maze(generate_maze(61, 41, loops=0.05, seed=1), tmp_path / 'maze.txt')
+    closet = generate_maze(21, 21, seed=2)
+    closet[1:4, 1:4] = '%'
+    closet[2, 2] = '-' # walled off: the player is moved there, where nothing can be reached
+    save_maze(closet, tmp_path / 'closet.txt')
+    map_paths = [MAPS / 'levels' / 'map01.txt', *sorted((MAPS / 'test_maps').glob('*.txt')), tmp_path / 'maze.txt', tmp_path / 'closet.txt']
+    for seed in range(40):
+        for mode in ('euclidean', 'maze'):
+            level = Map(map_paths[seed % len(map_paths)], rng=np.random.RandomState(seed))
+            level.targets = TargetIndex(level, size=1 + seed % 9, mode=mode)
+            n_open = int(level.walkable.sum())
+            level.add_entities(n_enemies=min(6, n_open // 8), n_prizes=min(20, n_open // 4), n_powers=min(3, n_open // 16))
+            if seed % 3 == 0:
+                level.power()
+            if map_paths[seed % len(map_paths)].name == 'closet.txt':
+                level.move(level.player_id, level.entities[level.player_id].pos, (2, 2))
+            for index in level.get_entity_category('prize')[::4]:
+                level.remove_entity(index)
+            for avoid in ('enemy', None):
+                avoid_pos = [level.entities[i].pos for i in level.get_entity_category(avoid)]
+                danger = level.danger_field(avoid_pos)
+                assert level.closest_to_eat(level.player_id, danger=danger)[0] == scan_closest_to_eat(level, danger, mode)
+
+def test_slow_client_keeps_replies_and_ends():
+    async def fill():
+        client = Client(writer=None, queue_size=4)
+        session = Session(0, {}, SLEEP, None)
+        session.watchers.add(client)
+        client.sessions.add(session)
+        session.publish({'type': 'full', 'rows': ['%-%', '%-%'], 'status': ''})
+        client.send(encode({'type': 'created', 'session': 1}))
+        for x in range(10):
+            session.publish({'type': 'delta', 'cells': [[1, x % 2, str(x)]], 'status': str(x)})
+        session.publish({'type': 'end', 'result': {'outcome': 'won'}})
+        return client, session, [json.loads(client.queue.get_nowait()[0]) for _ in range(client.queue.qsize())]
+    client, session, messages = asyncio.run(fill())
+    assert client.resyncs > 0
+    assert [m['type'] for m in messages if m['type'] not in FRAMES] == ['created', 'end']
+    assert messages[-1]['type'] == 'end'
+    board = None
+    for message in messages:
+        if message['type'] == 'full':
+            board = Board(message['rows'], message['status'])
+        elif message['type'] == 'delta':
+            board.apply(message)
+    assert board.frame() == session.board.frame() # the frames dropped were caught up with
+
+def test_server_sessions_end_or_fail():
+    async def run():
+        server = GameServer(workers=0)
+        port = await server.start(port=0)
+        try:
+            played = await asyncio.wait_for(watch('127.0.0.1', port, create={
+                'folder': str(MAPS / 'levels'), 'seed': 1, 'max_ticks': 60, 'period': 0}), 30)
+            failed = await asyncio.wait_for(watch('127.0.0.1', port, create={'folder': 'nope', 'period': 0}), 30)
+            await asyncio.sleep(0) # let the sessions be retired
+            return played, failed, dict(server.results), server.sessions
+        finally:
+            await server.close()
+    played, failed, results, sessions = asyncio.run(run())
+    game = Game(MAPS / 'levels', headless=True, max_ticks=60, rng=np.random.RandomState(1))
+    try:
+        expected = game.a_star()
+    finally:
+        game.close()
+    assert {k: v for k, v in played.items() if k != 'path_time'} == {k: v for k, v in expected.items() if k != 'path_time'}
+    assert failed['outcome'] == 'error' and 'FileNotFoundError' in failed['error']
+    assert results == {0: played, 1: failed} and sessions == {} # both over, not reported as running
+
+def test_replay_log_round_trip(tmp_path):
+    maze = generate_maze(41, 41, seed=3)
+    save_maze(maze, tmp_path / 'crowd' / 'maze.txt', entity_counts_for(maze, enemies=0.2)) # frames of LONG_FRAME moves or more
+    log_path = tmp_path / 'games.pacr'
+    results = []
+    for seed, folder, levels, max_ticks in [(0, MAPS / 'levels', ['map01.txt', 'map02.txt'], 3000),
+                                            (1, MAPS / 'levels', ['map03.txt'], 60),
+                                            (2, tmp_path / 'crowd', ['maze.txt'], 300)]:
+        log = ReplayWriter(log_path, seed)
+        game = Game(folder, headless=True, max_ticks=max_ticks, levels=levels, rng=np.random.RandomState(seed), log=log)
+        try:
+            results.append(game.a_star())
+        finally:
+            game.close()
+            log.close()
+    assert [result['outcome'] for result in results] == ['won', 'timeout', 'lost']
+
+    records = Counter()
+    for reader in read_games(log_path):
+        while reader.next_frame():
+            if reader.explicit is None:
+                records['run'] += 1
+            else:
+                records['long' if len(reader.explicit) >= LONG_FRAME else 'frame'] += 1
+    assert records['run'] and records['frame'] and records['long']
+
+    for reader, result in zip(read_games(log_path), results):
+        summary = verify(reader)
+        assert summary['mismatch'] == []
+        assert summary['recorded'] == result['outcome']
+        assert {key: summary['replayed'][key] for key in ('outcome', 'score', 'level', 'lives', 'ticks')} == \
+            {key: result[key] for key in ('outcome', 'score', 'level', 'lives', 'ticks')}
+
+    data = bytearray(log_path.read_bytes())
+    data[-1] ^= 1 # digest of the final state of the last game
+    log_path.write_bytes(bytes(data))
+    assert [verify(reader)['mismatch'] for reader in read_games(log_path)] == [[], [], ['digest']]
+
+def test_hierarchical_planner_stays_near_optimal(tmp_path):
+    save_maze(generate_maze(81, 81, loops=0.1, seed=0), tmp_path / 'maze.txt')
+    level = Map(tmp_path / 'maze.txt')
+    planner = HierarchicalPlanner(level, size=8)
+    rng = np.random.RandomState(0)
+    open_cells = [(int(x), int(y)) for y, x in zip(*np.nonzero(level.walkable))]
+    invalidated = 0
+    for query in range(10):
+        start, target = (open_cells[i] for i in rng.randint(len(open_cells), size=2))
+        enemies = [open_cells[i] for i in rng.randint(len(open_cells), size=6)] if query < 4 else []
+        field = distance_field(target, level)
+        pos, moves = start, 0
+        while pos != target:
+            danger = level.danger_field(enemies) if enemies else None
+            searches = counters['searches']
+            move = planner.next_move(pos, target, danger)
+            assert counters['searches'] == searches + 1 # one abstract search per move
+            if enemies: # costs change every frame: each query against a search with the same costs
+                invalidated += sum(isinstance(costs, dict) for costs in planner.intra)
+                penalty = np.where(danger >= DANGER_CUTOFF, danger, 0).ravel()
+                cost = lambda cell: 1 + penalty.item(cell)
+                best = path_cost(pos, search(pos, target, level, cost=cost), level, cost)
+                assert best - 1e-9 <= planner.path_cost <= HPA_BOUND * best
+            assert move in MOVES
+            pos = (pos[0] + move[0], pos[1] + move[1])
+            assert level.walkable[pos[1], pos[0]]
+            moves += 1
+            assert moves <= 2 * level.width * level.height
+            enemies = [(x + dx, y + dy) if level.walkable[y + dy, x + dx] else (x, y)
+                       for (x, y), (dx, dy) in zip(enemies, (MOVES[k] for k in rng.randint(len(MOVES), size=len(enemies))))]
+        if not enemies:
+            assert moves <= HPA_BOUND * field[start[1] * level.width + start[0]]
+    assert invalidated
+
+def test_parallel_planner_matches_sequential():
+    level = Map(MAPS / 'levels' / 'map01.txt')
+    rng = np.random.RandomState(0)
+    open_cells = [(int(x), int(y)) for y, x in zip(*np.nonzero(level.walkable))]
+    queries = [(open_cells[rng.randint(len(open_cells))], [open_cells[i] for i in rng.randint(len(open_cells), size=n)],
+                [open_cells[i] for i in rng.randint(len(open_cells), size=n % 3)] or None) for n in range(1, 12)]
+    for kind in ('thread', 'process'):
+        planner = ParallelPlanner(workers=3, kind=kind)
+        blocks = []
+        try:
+            for name in (None, 'manhattan'):
+                planner.set_map(level, name)
+                if planner.spec is not None:
+                    blocks.append(planner.spec['name'])
+                heuristic = HEURISTICS[name](level) if name else None
+                for target_pos, start_positions, avoid_pos in queries:
+                    danger = level.danger_field(avoid_pos) if avoid_pos else None
+                    expected = [plan_move(pos, target_pos, level, danger=danger, heuristic=heuristic, weight=SEARCH_WEIGHT)
+                                for pos in start_positions]
+                    assert planner.plan(target_pos, start_positions, avoid_pos, heuristic) == expected
+        finally:
+            planner.close()
+        assert len(blocks) == (2 if kind == 'process' else 0)
+        for block in blocks: # the layout of each level was freed
+            with pytest.raises(FileNotFoundError):
+                shared_memory.SharedMemory(name=block)
+
+def test_path_cache_matches_search():
+    level = Map(MAPS / 'levels' / 'map01.txt')
+    rng = np.random.RandomState(1)
+    open_cells = [(int(x), int(y)) for y, x in zip(*np.nonzero(level.walkable))]
+    pick = lambda n: [open_cells[i] for i in rng.randint(len(open_cells), size=n)]
+    for heuristic in (None, HEURISTICS['manhattan'](level)):
+        cache = PathCache(quantum=1)
+        for n in range(40):
+            (start_pos, end_pos), avoid_pos = pick(2), pick(n % 4) or None
+            expected = plan_move(start_pos, end_pos, level, avoid_pos, heuristic=heuristic)
+            misses = cache.misses
+            assert plan_move(start_pos, end_pos, level, avoid_pos, heuristic=heuristic, cache=cache) == expected
+            assert cache.misses == misses + 1
+            hits = cache.hits
+            assert plan_move(start_pos, end_pos, level, avoid_pos, heuristic=heuristic, cache=cache) == expected
+            assert cache.hits == hits + 1
+            other = (avoid_pos or []) + pick(1) # another avoid set is searched again, not served the cached move
+            assert plan_move(start_pos, end_pos, level, other, heuristic=heuristic, cache=cache) == \
+                plan_move(start_pos, end_pos, level, other, heuristic=heuristic)
+            assert cache.misses == misses + 2
+
+    cache = PathCache(max_bytes=2000, quantum=1)
+    keys = [cache.key(start_pos, end_pos, pick(n % 5)) for n, (start_pos, end_pos) in enumerate(zip(pick(200), pick(200)))]
+    for i, key in enumerate(keys):
+        cache.put(key, (0, 0))
+        if i:
+            cache.get(keys[0]) # kept as the most recently used
+        assert cache.bytes == sum(cache.sizes.values()) <= cache.max_bytes
+        assert cache.sizes.keys() == cache.entries.keys()
+    assert cache.evictions > 0 and keys[0] in cache.entries and keys[1] not in cache.entries
+    assert len(cache.entries) + cache.evictions == len(set(keys))
+
+    digests = []
+    for cached in (True, False): # the enemies move the same with and without the cache
+        game = Game(MAPS / 'levels', headless=True, max_ticks=1500, rng=np.random.RandomState(2))
+        if not cached:
+            game.path_cache = None
+        try:
+            game.a_star()
+        finally:
+            game.close()
+        if cached:
+            assert game.path_cache.hits > 0
+        digests.append((game.ticks, state_digest(game)))
+    assert digests[0] == digests[1]
+
+def test_batched_first_moves_are_shortest(tmp_path, monkeypatch):
+    closet = generate_maze(21, 21, seed=2)
+    closet[1:4, 1:4] = '%'
+    closet[2, 2] = '-' # walled off: nothing can be reached from it, nor reach it
+    save_maze(closet, tmp_path / 'closet.txt')
+    tables = {}
+    def check(target_pos, start_positions, level, moves):
+        layout = level.walkable.tobytes()
+        if layout not in tables:
+            tables[layout] = DistanceTable(level.walkable)
+        table = tables[layout]
+        target = table.index[target_pos[1], target_pos[0]]
+        assert len(moves) == len(start_positions)
+        for (x, y), (dx, dy) in zip(start_positions, moves):
+            d = table.dist[table.index[y, x], target]
+            if d <= 0: # already there, or unreachable
+                assert (dx, dy) == (0, 0)
+            else:
+                assert (dx, dy) in MOVES and table.dist[table.index[y + dy, x + dx], target] == d - 1
+
+    level = Map(tmp_path / 'closet.txt')
+    rng = np.random.RandomState(0)
+    open_cells = [(int(x), int(y)) for y, x in zip(*np.nonzero(level.walkable))]
+    for target_pos in [(2, 2)] + [open_cells[i] for i in rng.randint(len(open_cells), size=10)]:
+        start_positions = [(2, 2), target_pos] + [open_cells[i] for i in rng.randint(len(open_cells), size=8)]
+        check(target_pos, start_positions, level, first_moves(target_pos, start_positions, level))
+
+    calls = []
+    def checked(target_pos, start_positions, level):
+        moves = first_moves(target_pos, start_positions, level)
+        check(target_pos, start_positions, level, moves)
+        calls.append(len(moves))
+        return moves
+    monkeypatch.setattr(pacman, 'BATCHED_AGENTS', True)
+    monkeypatch.setattr(pacman, 'first_moves', checked)
+    for seed, name in enumerate(['map01.txt', 'map04.txt', 'map07.txt']): # the enemies and scared enemies of real games
+        game = Game(MAPS / 'levels', headless=True, max_ticks=300, levels=[name], rng=np.random.RandomState(seed))
+        try:
+            game.a_star()
+        finally:
+            game.close()
+    assert len(calls) > 100 and sum(calls) > len(calls)
+
+def test_frame_scheduler_paces_and_degrades():
+    now, slept = [0.0], []
+    def sleep(seconds):
+        slept.append(seconds)
+        now[0] += seconds
+    scheduler = FrameScheduler(period=0.1, max_degraded=2, clock=lambda: now[0], sleep=sleep)
+    degraded = []
+    for work in (0.03, 0.25, 0.2, 0.2, 0.2, 0.2, 0.02, 0.04): # seconds of work of each frame
+        scheduler.start_frame()
+        degraded.append(scheduler.degraded)
+        now[0] += work
+        scheduler.end_frame()
+    assert slept == pytest.approx([0.07, 0.08, 0.06]) # only what is left of the frame
+    assert [frame for frame, _ in scheduler.overruns] == [2, 3, 4, 5, 6]
+    assert [late for _, late in scheduler.overruns] == pytest.approx([0.15, 0.1, 0.1, 0.1, 0.1])
+    # degraded after an overrun, at most twice in a row, and no longer once on time
+    assert degraded == [False, False, True, True, False, True, True, False]
+    assert scheduler.summary() == {'frames': 8, 'overruns': 5, 'degraded': 4, 'max_late': pytest.approx(0.15)}
+
+    game = Game(MAPS / 'levels', headless=True, levels=['map01.txt'], rng=np.random.RandomState(0))
+    try:
+        while not game.last_moves or game.counter % game.enemy_frame: # until the enemies move again
+            assert game.step() is None
+        last_moves = dict(game.last_moves)
+        enemy_ids = game.map.get_entity_category('enemy')
+        recorded = []
+        game.record = recorded.append
+        game.plan_agents = None # a degraded frame plans nothing
+        game.scheduler = FrameScheduler()
+        game.scheduler.degraded = True
+        assert game.step() is None
+    finally:
+        game.close()
+    assert recorded[1] == [last_moves[enemy_id] for enemy_id in enemy_ids]
+
+def test_admissible_heuristics_find_shortest_paths(tmp_path):
+    save_maze(generate_maze(41, 31, loops=0.1, seed=3), tmp_path / 'maze.txt')
+    rng = np.random.RandomState(0)
+    for map_path in (MAPS / 'levels' / 'map01.txt', MAPS / 'levels' / 'map05.txt', MAPS / 'test_maps' / 'test_map.txt', tmp_path / 'maze.txt'):
+        level = Map(map_path)
+        table = DistanceTable(level.walkable)
+        heuristics = {name: HEURISTICS[name](level) for name in ('manhattan', 'exact', 'alt')}
+        assert all(h.admissible for h in heuristics.values()) and not HEURISTICS['euclidean'].admissible
+        for _ in range(15):
+            start, end = table.cells[rng.randint(len(table.cells), size=2)]
+            best = table.dist[table.index[start[1], start[0]], table.index[end[1], end[0]]]
+            if best < 0:
+                continue
+            start_pos, end_pos = (int(start[0]), int(start[1])), (int(end[0]), int(end[1]))
+            for name, heuristic in heuristics.items():
+                estimate = heuristic.to(end_pos[1] * level.width + end_pos[0])
+                to_end = table.dist[:, table.index[end_pos[1], end_pos[0]]]
+                assert all(estimate(int(y) * level.width + int(x)) <= d for (x, y), d in zip(table.cells, to_end) if d >= 0), name
+                for weight in (1, 1.5, 3):
+                    path = search(start_pos, end_pos, level, heuristic, weight=weight)
+                    x, y = start_pos
+                    for dx, dy in path[1:]:
+                        x, y = x + dx, y + dy
+                        assert level.walkable[y, x]
+                    assert (x, y) == end_pos
+                    if weight == 1:
+                        assert path_cost(start_pos, path, level) == best, name
+                    else:
+                        assert best <= path_cost(start_pos, path, level) <= weight * best, name
+
+def test_renderer_redraws_only_dirty_cells():
+    level = Map(MAPS / 'test_maps' / 'simple_map.txt')
+    stream = io.StringIO()
+    renderer = AnsiRenderer(stream, diff=True)
+    renderer.draw(level, 'start', offset=1)
+    assert stream.getvalue().startswith('\x1b[2J') and all(row in stream.getvalue() for row in level.rows())
+    assert not level.dirty
+
+    for changes, expected in (({(3, 1): 'P', (5, 2): '.', (7, 4): 'E'}, {(3, 1), (5, 2), (7, 4)}),
+                              ({(3, 1): '-', (5, 2): '.', (8, 4): '-'}, {(3, 1)}), # unchanged cells are not dirty
+                              ({}, set())):
+        stream.seek(0)
+        stream.truncate()
+        for (x, y), symbol in changes.items():
+            level.set_cell(x, y, symbol)
+        assert level.dirty == expected
+        renderer.draw(level, 'frame', offset=1)
+        out = stream.getvalue()
+        cells = {(int(col) - 1, int(row) - 2): symbol for row, col, symbol in re.findall(r'\x1b\[(\d+);(\d+)H(.)', out)
+                 if int(row) - 2 < level.height}
+        assert cells == {(x, y): level.symbol(x, y) for x, y in expected}
+        assert out.endswith('frame\x1b[K\n') and renderer.frame_bytes == len(out.encode())
+        assert not level.dirty
+
+    other = Map(MAPS / 'test_maps' / 'simple_map.txt') # another map object is drawn whole
+    stream.seek(0)
+    stream.truncate()
+    renderer.draw(other, 'next level', offset=1)
+    assert stream.getvalue().startswith('\x1b[2J')
+
+def test_profiler_counts_and_disabled_noop(tmp_path):
+    digests = []
+    for enabled in (True, False):
+        profiler = Profiler(enabled=enabled, trace=enabled)
+        game = Game(MAPS / 'levels', headless=True, max_ticks=150, levels=['map01.txt'], rng=np.random.RandomState(0), profiler=profiler)
+        expanded, scanned = counters['expanded'], targets.counters['scanned']
+        try:
+            game.a_star()
+        finally:
+            game.close()
+        digests.append(state_digest(game))
+        if enabled:
+            report = profiler.report() # ends the last frame
+            assert report.startswith(f'{game.ticks} frames') and len(profiler.frames) == game.ticks
+            assert sum(frame['expanded'] for frame in profiler.frames) == counters['expanded'] - expanded > 0
+            assert sum(frame['scanned'] for frame in profiler.frames) == targets.counters['scanned'] - scanned > 0
+            assert all(any(line.startswith(name) for line in report.splitlines()) for name in ('expanded', 'scanned', 'frame', 'target'))
+            profiler.dump_trace(tmp_path / 'trace.json')
+            events = json.loads((tmp_path / 'trace.json').read_text())['traceEvents']
+            assert sum(event['name'] == 'counters' for event in events) == game.ticks
+        else:
+            assert profiler.phase('target') is NO_PHASE
+            assert profiler.frames == [] and profiler.summary() == {} and profiler.report().startswith('0 frames')
+    assert digests[0] == digests[1] # profiling does not change the game